@@ -3,6 +3,7 @@ import logging
 import os
 import time
 import gc
+from itertools import groupby
 from circus.fixed_threading import Thread, get_ident
 import sys
 import select
@@ -11,6 +12,7 @@ from tornado import gen
 
 import zmq
 from tornado import ioloop
+from tornado import locks
 
 from circus.controller import Controller
 from circus.exc import AlreadyExist
@@ -39,6 +41,16 @@ class Arbiter(object):
     - **pubsub_endpoint** -- the pubsub endpoint
     - **statsd** -- If True, a circusd-stats process is run (default: False)
     - **stats_endpoint** -- the stats endpoint.
+    - **stats_query_endpoint** -- the endpoint circusd-stats answers queries
+      about the history of the stats on. (default: None, no queries)
+    - **stats_format** -- how circusd-stats sends the stats: *json*, one
+      message per stat, or *json-batch* or *msgpack*, one message per
+      watcher and interval. (default: json)
+    - **stats_keyframe_interval** -- when set, circusd-stats only publishes
+      the stats which changed, and all of them every
+      *stats_keyframe_interval* intervals. (default: 0)
+    - **stats_deadbands** -- a list of *metric=value* overriding how much
+      a metric has to change to be published. (default: None)
     - **statsd_close_outputs** -- if True sends the circusd-stats stdout/stderr
       to /dev/null (default: False)
     - **multicast_endpoint** -- the multicast endpoint for circusd cluster
@@ -75,6 +87,12 @@ class Arbiter(object):
     - **fqdn_prefix** -- a prefix for the unique identifier of the circus
                          instance on the cluster.
     - **endpoint_owner** -- unix user to chown the endpoint to if using ipc.
+    - **tier_concurrency** -- how many watchers sharing the same priority
+      are started or reloaded at the same time. Each priority tier is done
+      before the next one begins. 0 means no limit. (default: 1)
+    - **lock_timeout** -- how long in seconds a command waits for a
+      watcher, or the arbiter, busy with another command before failing.
+      When 0 it fails right away. (default: 0)
     """
 
     def __init__(self, watchers, endpoint, pubsub_endpoint, check_delay=1.0,
@@ -86,7 +104,10 @@ class Arbiter(object):
                  httpd_close_outputs=False, debug=False, debug_gc=False,
                  ssh_server=None, proc_name='circusd', pidfile=None,
                  loglevel=None, logoutput=None, loggerconfig=None,
-                 fqdn_prefix=None, umask=None, endpoint_owner=None):
+                 fqdn_prefix=None, umask=None, endpoint_owner=None,
+                 lock_timeout=0, tier_concurrency=1,
+                 stats_query_endpoint=None, stats_format='json',
+                 stats_keyframe_interval=0, stats_deadbands=None):
 
         self.watchers = watchers
         self.endpoint = endpoint
@@ -127,10 +148,21 @@ class Arbiter(object):
         self._init_context(context)
         self.pid = os.getpid()
         self._watchers_names = {}
+        # pid -> (watcher, process), maintained by the watchers
+        self._pids = {}
+        # number of children reaped by the last reap_processes call
+        self.last_reaped = 0
+        # processes being stopped, waiting for their exit
+        self._exit_waiters = {}
+        # watcher -> time it was last respawned on SIGCHLD
+        self._respawned = {}
         self._stopping = False
         self._restarting = False
         self.debug = debug
         self._exclusive_running_command = None
+        self.lock_timeout = lock_timeout
+        # notified each time a command releases its lock
+        self._lock_released = locks.Condition()
         if self.debug:
             self.stdout_stream = self.stderr_stream = {'class': 'StdoutStream'}
         else:
@@ -143,6 +175,10 @@ class Arbiter(object):
         # initializing circusd-stats as a watcher when configured
         self.statsd = statsd
         self.stats_endpoint = stats_endpoint
+        self.stats_query_endpoint = stats_query_endpoint
+        self.stats_format = stats_format
+        self.stats_keyframe_interval = stats_keyframe_interval
+        self.stats_deadbands = stats_deadbands or []
 
         if self.statsd:
             cmd = "%s -c 'from circus import stats; stats.main()'" % \
@@ -150,6 +186,15 @@ class Arbiter(object):
             cmd += ' --endpoint %s' % self.endpoint
             cmd += ' --pubsub %s' % self.pubsub_endpoint
             cmd += ' --statspoint %s' % self.stats_endpoint
+            if self.stats_query_endpoint is not None:
+                cmd += ' --querypoint %s' % self.stats_query_endpoint
+            if self.stats_format != 'json':
+                cmd += ' --stats-format %s' % self.stats_format
+            if self.stats_keyframe_interval:
+                cmd += ' --keyframe-interval %d' % \
+                    self.stats_keyframe_interval
+                for deadband in self.stats_deadbands:
+                    cmd += ' --deadband %s' % deadband
             if ssh_server is not None:
                 cmd += ' --ssh %s' % ssh_server
             if debug:
@@ -222,6 +267,7 @@ class Arbiter(object):
 
         self.sockets = CircusSockets(sockets)
         self.warmup_delay = warmup_delay
+        self.tier_concurrency = tier_concurrency
 
     @property
     def running(self):
@@ -465,7 +511,14 @@ class Arbiter(object):
                       loggerconfig=cfg.get('loggerconfig', None),
                       fqdn_prefix=cfg.get('fqdn_prefix', None),
                       umask=cfg['umask'],
-                      endpoint_owner=cfg.get('endpoint_owner', None))
+                      endpoint_owner=cfg.get('endpoint_owner', None),
+                      lock_timeout=cfg.get('lock_timeout', 0),
+                      tier_concurrency=cfg.get('tier_concurrency', 1),
+                      stats_query_endpoint=cfg.get('stats_query_endpoint'),
+                      stats_format=cfg.get('stats_format', 'json'),
+                      stats_keyframe_interval=cfg.get(
+                          'stats_keyframe_interval', 0),
+                      stats_deadbands=cfg.get('stats_deadbands'))
 
         # store the cfg which will be used, so it can be used later
         # for checking if the cfg has been changed
@@ -477,6 +530,39 @@ class Arbiter(object):
     def iter_watchers(self, reverse=True):
         return sorted(self.watchers, key=lambda a: a.priority, reverse=reverse)
 
+    def iter_tiers(self, watchers=None, reverse=True):
+        """Yield the lists of watchers sharing the same priority.
+
+        The highest priority comes first, unless *reverse* is False.
+        """
+        if watchers is None:
+            watchers = self.iter_watchers(reverse=reverse)
+        else:
+            watchers = sorted(watchers, key=lambda a: a.priority,
+                              reverse=reverse)
+        for _, tier in groupby(watchers, key=lambda a: a.priority):
+            yield list(tier)
+
+    @gen.coroutine
+    def _run_tiers(self, watchers, action):
+        """Call the *action* coroutine on *watchers*, tier by tier.
+
+        The watchers of a tier are handled concurrently, up to
+        *tier_concurrency* at a time, and *warmup_delay* is waited for
+        after each of them.
+        """
+        for tier in self.iter_tiers(watchers):
+            limit = self.tier_concurrency or len(tier)
+            slots = locks.Semaphore(limit)
+
+            @gen.coroutine
+            def run(watcher):
+                with (yield slots.acquire()):
+                    yield action(watcher)
+                    yield tornado_sleep(self.warmup_delay)
+
+            yield [run(watcher) for watcher in tier]
+
     @debuglog
     def initialize(self):
         # set process title
@@ -613,13 +699,13 @@ class Arbiter(object):
             self.loop.add_callback(self.loop.stop)
 
     def reap_processes(self):
-        # map watcher to pids
-        watchers_pids = {}
-        for watcher in self.iter_watchers():
-            if not watcher.is_stopped():
-                for process in watcher.processes.values():
-                    watchers_pids[process.pid] = watcher
+        """Reap the dead children.
 
+        Return a mapping of the watchers which lost a process to the
+        shortest lifetime of the processes they lost.
+        """
+        reaped = {}
+        count = 0
         # detect dead children
         if not IS_WINDOWS:
             while True:
@@ -629,17 +715,70 @@ class Arbiter(object):
                     if not pid:
                         break
 
-                    if pid in watchers_pids:
-                        watcher = watchers_pids[pid]
+                    count += 1
+                    watcher, process = self.get_process(pid)
+                    if watcher is not None and not watcher.is_stopped():
+                        lifetime = process.age()
                         watcher.reap_process(pid, status)
+                        reaped[watcher] = min(reaped.get(watcher, lifetime),
+                                              lifetime)
                 except OSError as e:
                     if e.errno == errno.ECHILD:
                         # process already reaped
-                        return
+                        break
                     else:
                         raise
+        if count:
+            logger.debug('reaped %d children in one batch', count)
+        self.last_reaped = count
+        return reaped
+
+    def check_exits(self):
+        """Resolve the exit future of the stopping processes which are gone.
+        """
+        for process in list(self._exit_waiters.values()):
+            process.poll()
+
+    @gen.coroutine
+    def reap_and_respawn(self):
+        """Reap the dead children and respawn the watchers they belonged to.
 
-    @synchronized("manage_watchers")
+        Called when circusd receives SIGCHLD, so a dead process is replaced
+        right away instead of on the next :meth:`manage_watchers` tick.
+        Only the watchers which actually lost a process are managed.
+
+        A watcher losing a process which lived less than *check_delay* is
+        respawned right away at most once per *check_delay*, the next
+        tick respawns it otherwise, so a process crashing on startup is
+        not respawned in a tight loop.
+        """
+        if self._stopping:
+            return
+        reaped = self.reap_processes()
+        now = time.monotonic()
+        watchers = []
+        for watcher, lifetime in reaped.items():
+            last = self._respawned.get(watcher)
+            if lifetime < self.check_delay and last is not None and \
+                    now - last < self.check_delay:
+                continue
+            self._respawned[watcher] = now
+            watchers.append(watcher)
+        if not watchers:
+            return
+        if self._restarting or self._exclusive_running_command is not None:
+            # another command is busy with the watchers, the next
+            # manage_watchers tick will respawn them if still needed
+            return
+        yield self._respawn_watchers(watchers)
+
+    @synchronized("manage_watchers", exclusive=False)
+    @gen.coroutine
+    def _respawn_watchers(self, watchers):
+        yield [watcher.manage_processes() for watcher in watchers
+               if watcher._running_command is None]
+
+    @synchronized("manage_watchers", exclusive=False)
     @gen.coroutine
     def manage_watchers(self):
         if self._stopping:
@@ -650,6 +789,9 @@ class Arbiter(object):
         self.reap_processes()
         list_to_yield = []
         for watcher in self.iter_watchers():
+            if watcher._running_command is not None:
+                # a command is running on this watcher, leave it alone
+                continue
             if watcher.on_demand and watcher.is_stopped():
                 need_on_demand = True
             list_to_yield.append(watcher.manage_processes())
@@ -687,9 +829,10 @@ class Arbiter(object):
                 handler.release()
 
         # gracefully reload watchers
-        for watcher in self.iter_watchers():
-            yield watcher._reload(graceful=graceful, sequential=sequential)
-            tornado_sleep(self.warmup_delay)
+        yield self._run_tiers(
+            self.watchers,
+            lambda watcher: watcher._reload(graceful=graceful,
+                                            sequential=sequential))
 
     def numprocesses(self):
         """Return the number of processes running across all watchers."""
@@ -703,11 +846,27 @@ class Arbiter(object):
         """Return the watcher *name*."""
         return self._watchers_names[name.lower()]
 
+    def get_process(self, pid):
+        """Return the (watcher, process) couple running *pid*.
+
+        (None, None) is returned if *pid* is not managed by circus.
+        """
+        return self._pids.get(pid, (None, None))
+
+    def register_process(self, watcher, process):
+        """Index *process*, which has just been spawned by *watcher*."""
+        self._pids[process.pid] = watcher, process
+
+    def unregister_process(self, watcher, pid):
+        """Remove *pid* from the index if it belongs to *watcher*."""
+        if self._pids.get(pid, (None, None))[0] is watcher:
+            del self._pids[pid]
+
     def statuses(self):
         return dict([(watcher.name, watcher.status())
                      for watcher in self.watchers])
 
-    @synchronized("arbiter_add_watcher")
+    @synchronized("arbiter_add_watcher", exclusive=False)
     def add_watcher(self, name, cmd, **kw):
         """Adds a watcher.
 
@@ -746,8 +905,13 @@ class Arbiter(object):
         watcher = self._watchers_names.pop(name.lower())
         watcher.notify_event("remove", {"time": time.time()})
         del self.watchers[self.watchers.index(watcher)]
+        self._respawned.pop(watcher, None)
 
-        if not nostop:
+        if nostop:
+            # the processes keep running but are not ours anymore
+            for pid in list(watcher.processes):
+                self.unregister_process(watcher, pid)
+        else:
             # stop the watcher
             yield watcher._stop()
 
@@ -762,10 +926,8 @@ class Arbiter(object):
             watchers = self.iter_watchers()
         else:
             watchers = watcher_iter_func()
-        for watcher in watchers:
-            if watcher.autostart:
-                yield watcher._start()
-                yield tornado_sleep(self.warmup_delay)
+        watchers = [watcher for watcher in watchers if watcher.autostart]
+        yield self._run_tiers(watchers, lambda watcher: watcher._start())
 
     @gen.coroutine
     @debuglog
@@ -6,6 +6,7 @@ import logging
 import os
 import sys
 import textwrap
+import time
 import traceback
 import shlex
 
@@ -150,7 +151,10 @@ class ControllerApp(object):
                     args.endpoint = DEFAULT_ENDPOINT_DEALER
 
             msg = command.message(*args.args, **opts)
-            handler = getattr(self, "handle_%s" % command.msg_type)
+            if opts.get('follow') and hasattr(command, 'follow_topics'):
+                handler = self.handle_follow
+            else:
+                handler = getattr(self, "handle_%s" % command.msg_type)
             return handler(command, self.globalopts, msg, args.endpoint,
                            int(args.timeout), args.ssh, args.ssh_keyfile)
 
@@ -161,6 +165,52 @@ class ControllerApp(object):
             print("%s: %s" % (topic, msg))
         return 0
 
+    def handle_follow(self, command, opts, msg, endpoint, timeout,
+                      ssh_server, ssh_keyfile):
+        if endpoint is not None:
+            client = CircusClient(endpoint=endpoint, timeout=timeout,
+                                  ssh_server=ssh_server,
+                                  ssh_keyfile=ssh_keyfile)
+        else:
+            client = self.client
+
+        try:
+            response = client.call(msg)
+            if response['status'] == 'error':
+                sys.stderr.write(command.console_msg(response) + '\n')
+                return 3
+            sys.stdout.write(command.console_msg(response))
+            sys.stdout.flush()
+
+            # the daemon publishes the output for a while after each
+            # request, so the request is sent again halfway through
+            renew_delay = command.follow_timeout / 2.
+            renew_at = time.time() + renew_delay
+            topics = command.follow_topics(msg)
+            consumer = CircusConsumer(topics,
+                                      endpoint=response['pubsub_endpoint'],
+                                      ssh_server=ssh_server)
+            with consumer:
+                while True:
+                    events = dict(consumer.poller.poll(1000))
+                    if events:
+                        __, message = consumer.pubsub_socket.recv_multipart()
+                        data = command.follow_msg(msg, json.loads(message))
+                        sys.stdout.write(data)
+                        sys.stdout.flush()
+                    if time.time() >= renew_at:
+                        client.call(command.follow_message(msg))
+                        renew_at = time.time() + renew_delay
+        except CallError as e:
+            msg = str(e)
+            if 'timed out' in str(e).lower():
+                msg += TIMEOUT_MSG
+            sys.stderr.write(msg)
+            return 1
+        finally:
+            if endpoint is not None:
+                client.stop()
+
     def _console(self, client, command, opts, msg):
         response = client.call(msg)
 
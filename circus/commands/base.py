@@ -101,6 +101,13 @@ class Command(object):
         except KeyError:
             raise MessageError("program %s not found" % watcher_name)
 
+    def _get_process(self, arbiter, watcher, pid):
+        """Get the process *pid* of the watcher if any."""
+        owner, process = arbiter.get_process(pid)
+        if owner is not watcher:
+            return None
+        return process
+
     def validate(self, props):
         if not self.properties:
             return
@@ -1,5 +1,6 @@
 from circus.commands.base import Command
 from circus.exc import ArgumentError, MessageError
+from circus.process import DEAD_OR_ZOMBIE, UNEXISTING
 from circus.util import to_signum
 from tornado import gen
 
@@ -88,9 +89,15 @@ class Kill(Command):
         graceful_timeout = props.get('graceful_timeout')
 
         watcher = self._get_watcher(arbiter, name)
-        processes = watcher.get_active_processes()
         if pid:
-            processes = [p for p in processes if p.pid == pid]
+            process = self._get_process(arbiter, watcher, pid)
+            if process is None or process.status in (DEAD_OR_ZOMBIE,
+                                                     UNEXISTING):
+                processes = []
+            else:
+                processes = [process]
+        else:
+            processes = watcher.get_active_processes()
 
         if processes:
             yield [watcher.kill_process(p,
@@ -0,0 +1,141 @@
+from circus.commands.base import Command
+from circus.exc import ArgumentError, MessageError
+from circus.stream import RingBufferStream, ThreadedStream
+
+
+class Tail(Command):
+    """\
+        Get the last output of a watcher
+        ================================
+
+        Get the output kept in memory by the *RingBufferStream* streams
+        of a watcher, for all its processes, or for one of them.
+
+        ZMQ Message
+        -----------
+
+        ::
+
+            {
+                "command": "tail",
+                "properties": {
+                    "name": <name>,
+                    "pid": <pid>,
+                    "follow": true,
+                    "size": <size>
+                }
+            }
+
+        The response returns the output of each process and stream::
+
+            {
+                "status": "ok",
+                "output": [
+                    {"pid": 1234, "stream": "stdout", "data": "..."},
+                    {"pid": 1234, "stream": "stderr", "data": "..."}
+                ],
+                "time": <timestamp>
+            }
+
+        *pid* is optional, and *size* limits the output returned for each
+        process and stream to its last *size* bytes.
+
+        With *follow* set, the new output of the watcher is published on
+        the ``watcher.<name>.output`` pubsub topic for the next 30
+        seconds, and the pubsub endpoint is added to the response. The
+        command has to be sent again to keep following the output.
+
+        Command line
+        ------------
+
+        ::
+
+            $ circusctl tail <name> [<pid>] [--follow]
+
+        Options
+        +++++++
+
+        - <name>: name of the watcher
+        - <pid>: integer, the process id
+        - --follow: keep printing the new output, until interrupted
+
+    """
+    name = "tail"
+    options = [('', 'follow', False, "Keep printing the new output")]
+    properties = ['name']
+
+    # how long the output is published after each follow request
+    follow_timeout = 30.
+
+    def message(self, *args, **opts):
+        if len(args) < 1 or len(args) > 2:
+            raise ArgumentError("Invalid number of arguments")
+
+        props = {'name': args[0]}
+        if len(args) == 2:
+            props['pid'] = int(args[1])
+        if opts.get('follow'):
+            props['follow'] = True
+        return self.make_message(**props)
+
+    def execute(self, arbiter, props):
+        watcher = self._get_watcher(arbiter, props['name'])
+        follow = props.get('follow', False)
+        found = False
+        output = []
+        for name in ('stdout', 'stderr'):
+            stream = getattr(watcher, '%s_stream' % name)
+            if isinstance(stream, ThreadedStream):
+                stream = stream.stream
+            if not isinstance(stream, RingBufferStream):
+                continue
+            found = True
+            if follow:
+                stream.follow(watcher.notify_event, self.follow_timeout)
+            for pid, data in stream.tail(props.get('pid'),
+                                         props.get('size')):
+                output.append({'pid': pid, 'stream': name,
+                               'data': data.decode('utf8', 'replace')})
+
+        if not found:
+            raise MessageError("watcher %s has no RingBufferStream"
+                               % props['name'])
+
+        resp = {'output': output}
+        if follow:
+            resp['pubsub_endpoint'] = arbiter.pubsub_endpoint
+        return resp
+
+    def validate(self, props):
+        super(Tail, self).validate(props)
+        if 'pid' in props and not isinstance(props['pid'], int):
+            raise MessageError("pid should be an integer")
+        if 'size' in props and not isinstance(props['size'], int):
+            raise MessageError("size should be an integer")
+
+    def console_msg(self, msg):
+        if msg.get('status') != 'ok':
+            return self.console_error(msg)
+        output = msg.get('output', [])
+        if len(output) == 1:
+            return output[0]['data']
+        parts = []
+        for item in output:
+            parts.append('==> %(pid)s %(stream)s <==\n%(data)s' % item)
+        return '\n'.join(parts)
+
+    def follow_topics(self, msg):
+        name = msg['properties']['name'].lower().replace(' ', '_')
+        return ['watcher.%s.output' % name]
+
+    def follow_message(self, msg):
+        """The message sent again to keep following the output."""
+        props = dict(msg['properties'], follow=True, size=0)
+        return self.make_message(**props)
+
+    def follow_msg(self, msg, event):
+        """Return the output of *event* to print, if it is wanted."""
+        pid = msg['properties'].get('pid')
+        if pid is not None and event.get('pid') != pid:
+            return ''
+        return event.get('data', '')
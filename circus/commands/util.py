@@ -50,6 +50,17 @@ def convert_option(key, val):
         return int(val)
     elif key == 'respawn':
         return util.to_bool(val)
+    elif key in ('spawn_concurrency', 'max_surge', 'max_unavailable'):
+        return int(val)
+    elif key == 'readiness_probe':
+        return val
+    elif key == 'readiness_timeout':
+        return float(val)
+    elif key in ('output_rate', 'output_lines_rate', 'watcher_output_rate',
+                 'watcher_output_lines_rate', 'output_burst'):
+        return float(val)
+    elif key == 'output_overflow':
+        return val
     elif key == "singleton":
         return util.to_bool(val)
     elif key == "close_child_stdin":
@@ -98,7 +109,12 @@ def validate_option(key, val):
                   'max_retry', 'graceful_timeout', 'stdout_stream',
                   'stderr_stream', 'max_age', 'max_age_variance', 'respawn',
                   'singleton', 'hooks', 'close_child_stdin',
-                  'close_child_stdout', 'close_child_stderr')
+                  'close_child_stdout', 'close_child_stderr',
+                  'spawn_concurrency', 'readiness_probe', 'readiness_timeout',
+                  'max_surge', 'max_unavailable', 'output_rate',
+                  'output_lines_rate', 'watcher_output_rate',
+                  'watcher_output_lines_rate', 'output_burst',
+                  'output_overflow')
 
     valid_prefixes = ('stdout_stream.', 'stderr_stream.', 'hooks.', 'rlimit_')
 
@@ -112,11 +128,15 @@ def validate_option(key, val):
         raise MessageError('unknown key %r' % key)
 
     if key in ('numprocesses', 'max_retry', 'max_age', 'max_age_variance',
-               'stop_signal'):
+               'stop_signal', 'spawn_concurrency', 'max_surge',
+               'max_unavailable'):
         if not isinstance(val, int):
             raise MessageError("%r isn't an integer" % key)
 
-    elif key in ('warmup_delay', 'retry_in', 'graceful_timeout',):
+    elif key in ('warmup_delay', 'retry_in', 'graceful_timeout',
+                 'readiness_timeout', 'output_rate', 'output_lines_rate',
+                 'watcher_output_rate', 'watcher_output_lines_rate',
+                 'output_burst'):
         if not isinstance(val, (int, float)):
             raise MessageError("%r isn't a number" % key)
 
@@ -124,6 +144,10 @@ def validate_option(key, val):
         if not isinstance(val, int) and not isinstance(val, str):
             raise MessageError("%r isn't an integer or string" % key)
 
+    elif key == 'readiness_probe':
+        if val is not None and not isinstance(val, str):
+            raise MessageError("%r isn't a string" % key)
+
     elif key in ('send_hup', 'shell', 'copy_env', 'respawn', 'stop_children',
                  'close_child_stdin', 'close_child_stdout',
                  'close_child_stderr'):
@@ -157,6 +157,17 @@ def get_config(config_file):
     config['multicast_endpoint'] = dget('circus', 'multicast_endpoint',
                                         DEFAULT_ENDPOINT_MULTICAST)
     config['stats_endpoint'] = dget('circus', 'stats_endpoint', None)
+    config['stats_query_endpoint'] = dget('circus', 'stats_query_endpoint',
+                                          None)
+    config['stats_format'] = dget('circus', 'stats_format', 'json')
+    config['stats_keyframe_interval'] = dget('circus',
+                                             'stats_keyframe_interval', 0,
+                                             int)
+    config['stats_deadbands'] = dget('circus', 'stats_deadbands',
+                                     '').replace(',', ' ').split()
+    # fail here rather than when circusd-stats collects the stats
+    from circus.stats.collector import read_deadbands
+    read_deadbands(config['stats_deadbands'])
     config['statsd'] = dget('circus', 'statsd', False, bool)
     config['umask'] = dget('circus', 'umask', None)
     if config['umask']:
@@ -171,6 +182,8 @@ def get_config(config_file):
         config['statsd'] = True
 
     config['warmup_delay'] = dget('circus', 'warmup_delay', 0, int)
+    config['tier_concurrency'] = dget('circus', 'tier_concurrency', 1, int)
+    config['lock_timeout'] = dget('circus', 'lock_timeout', 0, float)
     config['httpd'] = dget('circus', 'httpd', False, bool)
     config['httpd_host'] = dget('circus', 'httpd_host', 'localhost', str)
     config['httpd_port'] = dget('circus', 'httpd_port', 8080, int)
@@ -212,7 +225,8 @@ def get_config(config_file):
 
             # create watcher options
             for opt, val in cfg.items(section, noreplace=True):
-                if opt in ('cmd', 'args', 'working_dir', 'uid', 'gid'):
+                if opt in ('cmd', 'args', 'working_dir', 'uid', 'gid',
+                           'readiness_probe'):
                     watcher[opt] = val
                 elif opt == 'numprocesses':
                     watcher['numprocesses'] = dget(section, 'numprocesses', 1,
@@ -235,6 +249,20 @@ def get_config(config_file):
                 elif opt == 'graceful_timeout':
                     watcher['graceful_timeout'] = dget(
                         section, "graceful_timeout", 30., float)
+                elif opt == 'spawn_concurrency':
+                    watcher['spawn_concurrency'] = dget(
+                        section, "spawn_concurrency", 1, int)
+                elif opt in ('max_surge', 'max_unavailable'):
+                    watcher[opt] = dget(section, opt, 0, int)
+                elif opt in ('output_rate', 'output_lines_rate',
+                             'watcher_output_rate',
+                             'watcher_output_lines_rate'):
+                    watcher[opt] = dget(section, opt, 0, float)
+                elif opt == 'output_burst':
+                    watcher['output_burst'] = dget(section, opt, 1., float)
+                elif opt == 'readiness_timeout':
+                    watcher['readiness_timeout'] = dget(
+                        section, "readiness_timeout", 10., float)
                 elif opt.startswith('stderr_stream') or \
                         opt.startswith('stdout_stream'):
                     stream_name, stream_opt = opt.split(".", 1)
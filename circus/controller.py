@@ -99,6 +99,13 @@ class Controller(object):
             self.caller.start()
         self.started = True
 
+    def reap_children(self):
+        self.arbiter.check_exits()
+        # the watchers are only managed by the arbiter when the
+        # periodic callback runs (check_delay > 0)
+        if self.caller is not None:
+            return self.arbiter.reap_and_respawn()
+
     def stop(self):
         if self.started:
             if self.caller is not None:
@@ -136,7 +143,12 @@ class Controller(object):
     def _dispatch_callback_future(self, msg, cid, mid, cast, cmd_name,
                                   send_resp, future):
         exception = check_future_exception_and_log(future)
-        if exception is not None:
+        if isinstance(exception, ConflictError):
+            # a queued command gave up waiting for its lock
+            if send_resp:
+                self.send_error(mid, cid, msg, str(exception), cast=cast,
+                                errno=errors.COMMAND_ERROR)
+        elif exception is not None:
             if send_resp:
                 self.send_error(mid, cid, msg, "server error", cast=cast,
                                 errno=errors.BAD_MSG_DATA_ERROR)
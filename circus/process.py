@@ -11,7 +11,7 @@ except ImportError:
 import sys
 import errno
 import os
-from subprocess import PIPE
+from subprocess import PIPE, DEVNULL
 import time
 import shlex
 import warnings
@@ -20,6 +20,7 @@ try:
 except ImportError:
     resource = None     # NOQA
 
+from tornado.concurrent import Future
 from psutil import (Popen, STATUS_ZOMBIE, STATUS_DEAD, NoSuchProcess,
                     AccessDenied)
 
@@ -40,6 +41,28 @@ DEAD_OR_ZOMBIE = 1
 UNEXISTING = 2
 OTHER = 3
 
+# how long (in seconds) Process.status is cached
+STATUS_TTL = 0.1
+
+# on Linux the status is read straight from /proc instead of psutil
+USE_PROC_STAT = (sys.platform.startswith('linux') and
+                 os.path.exists('/proc/self/stat'))
+
+
+def read_proc_stat(pid):
+    """Return the (state, starttime) couple of *pid* from /proc/<pid>/stat.
+
+    Return None if the process does not exist.
+    """
+    try:
+        with open('/proc/%d/stat' % pid, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    # the command name may contain spaces and parenthesis
+    fields = data[data.rindex(b')') + 2:].split()
+    return fields[0], int(fields[19])
+
 
 # psutil < 2.x compat
 def get_children(proc, recursive=False):
@@ -205,6 +228,10 @@ class Process(object):
         self._worker = None
         self.redirected = False
         self.started = 0
+        self._status = None
+        self._status_time = 0
+        self._starttime = None
+        self._exit_future = None
 
         if self.uid is not None and self.gid is None:
             self.gid = get_default_gid(self.uid)
@@ -264,6 +291,48 @@ class Process(object):
         if self.watcher is not None:
             return self.watcher._get_stdin_socket_fd()
 
+    def _needs_preexec(self):
+        """Return True if the child can't be set up by subprocess alone."""
+        if self.rlimits and resource:
+            return True
+        # the pipes are replaced by /dev/null once set up
+        if self.pipe_stdout and self.close_child_stdout:
+            return True
+        if self.pipe_stderr and self.close_child_stderr:
+            return True
+        # subprocess supports user and group since python 3.9
+        if (self.uid or self.gid) and sys.version_info < (3, 9):
+            return True
+        return False
+
+    def _get_spawn_options(self):
+        """Return the Popen options doing what preexec() does."""
+        options = {'start_new_session': True}
+
+        stdin_socket_fd = self._get_stdin_socket_fd()
+        if stdin_socket_fd is not None:
+            options['stdin'] = stdin_socket_fd
+        elif self.close_child_stdin:
+            options['stdin'] = DEVNULL
+
+        if self.close_child_stdout:
+            options['stdout'] = DEVNULL
+
+        if self.close_child_stderr:
+            options['stderr'] = DEVNULL
+
+        if self.gid:
+            options['group'] = self.gid
+            # like os.initgroups(), which is only allowed to root
+            if self.username is not None and os.geteuid() == 0:
+                options['extra_groups'] = os.getgrouplist(self.username,
+                                                          self.gid)
+
+        if self.uid:
+            options['user'] = self.uid
+
+        return options
+
     def spawn(self):
         self.started = time.time()
         sockets_fds = self._get_sockets_fds()
@@ -345,12 +414,6 @@ class Process(object):
             if stdin_socket_fd is not None:
                 os.dup2(stdin_socket_fd, 0)
 
-        if IS_WINDOWS:
-            # On Windows we can't use a pre-exec function
-            preexec_fn = None
-        else:
-            preexec_fn = preexec
-
         extra = {}
         if self.pipe_stdout:
             extra['stdout'] = PIPE
@@ -358,6 +421,18 @@ class Process(object):
         if self.pipe_stderr:
             extra['stderr'] = PIPE
 
+        if IS_WINDOWS:
+            # On Windows we can't use a pre-exec function
+            preexec_fn = None
+        elif self._needs_preexec():
+            preexec_fn = preexec
+        else:
+            # let subprocess set the child up by itself: without a
+            # pre-exec function it can vfork() instead of copying the
+            # whole circusd process, and no python code runs in the child
+            preexec_fn = None
+            extra.update(self._get_spawn_options())
+
         self._worker = Popen(args, cwd=self.working_dir,
                              shell=self.shell, preexec_fn=preexec_fn,
                              env=self.env, close_fds=not self.use_fds,
@@ -437,7 +512,24 @@ class Process(object):
 
     @debuglog
     def poll(self):
-        return self._worker.poll()
+        self.invalidate_status()
+        returncode = self._worker.poll()
+        if returncode is not None:
+            self.notify_exit()
+        return returncode
+
+    def exit_future(self):
+        """Return a future resolved once the process has exited."""
+        if self._exit_future is None:
+            self._exit_future = Future()
+            if self._worker.returncode is not None:
+                self._exit_future.set_result(None)
+        return self._exit_future
+
+    def notify_exit(self):
+        """Resolve the exit future, the process is gone."""
+        if self._exit_future is not None and not self._exit_future.done():
+            self._exit_future.set_result(None)
 
     @debuglog
     def is_alive(self):
@@ -447,6 +539,7 @@ class Process(object):
     def send_signal(self, sig):
         """Sends a signal **sig** to the process."""
         logger.debug("sending signal %s to %s" % (sig, self.pid))
+        self.invalidate_status()
         return self._worker.send_signal(sig)
 
     @debuglog
@@ -462,6 +555,7 @@ class Process(object):
         is still there here, it's a kind of bad behavior
         because the graceful timeout won't be respected here.
         """
+        self.invalidate_status()
         try:
             try:
                 if self.is_alive():
@@ -489,7 +583,10 @@ class Process(object):
 
         Accepts a timeout in seconds.
         """
-        self._worker.wait(timeout)
+        try:
+            self._worker.wait(timeout)
+        finally:
+            self.invalidate_status()
 
     def age(self):
         """Return the age of the process in seconds."""
@@ -563,7 +660,35 @@ class Process(object):
         - DEAD_OR_ZOMBIE
         - UNEXISTING
         - OTHER
+
+        The status is cached for STATUS_TTL seconds, so the watchers
+        can check it several times per tick for the price of one read.
         """
+        now = time.monotonic()
+        if self._status is None or now - self._status_time >= STATUS_TTL:
+            self._status = self._read_status()
+            self._status_time = now
+        return self._status
+
+    def invalidate_status(self):
+        """Forget the cached status, the next access reads it again."""
+        self._status = None
+
+    def _read_status(self):
+        if USE_PROC_STAT:
+            stat = read_proc_stat(self.pid)
+            if stat is None:
+                return UNEXISTING
+            state, starttime = stat
+            if state in (b'Z', b'X', b'x'):
+                return DEAD_OR_ZOMBIE
+            if self._starttime is None:
+                self._starttime = starttime
+            elif starttime != self._starttime:
+                # the pid has been reused by another process
+                return OTHER
+            return RUNNING
+
         try:
             if get_status(self._worker) in (STATUS_ZOMBIE, STATUS_DEAD):
                 return DEAD_OR_ZOMBIE
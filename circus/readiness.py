@@ -0,0 +1,138 @@
+import os
+import socket
+import time
+from urllib.parse import urlparse
+
+from tornado import gen
+from tornado.iostream import IOStream, StreamClosedError
+from tornado.tcpclient import TCPClient
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+from circus.process import RUNNING
+from circus.util import replace_gnu_args, resolve_name, tornado_sleep
+
+
+class ReadinessProbe(object):
+    """Tells if a freshly spawned process is ready to do its job.
+
+    The probe is defined by a string which may contain *$(circus.wid)*
+    and *$(circus.pid)*, replaced by the values of the checked process.
+    """
+    def __init__(self, spec):
+        self.spec = spec
+
+    def format(self, process):
+        return replace_gnu_args(self.spec, wid=process.wid, pid=process.pid)
+
+    @gen.coroutine
+    def check(self, watcher, process):
+        """Return True if *process* is ready. Called until it is."""
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.spec)
+
+
+class TCPProbe(ReadinessProbe):
+    """Ready once a connection to tcp://host:port is accepted."""
+
+    @gen.coroutine
+    def check(self, watcher, process):
+        url = urlparse(self.format(process))
+        try:
+            stream = yield TCPClient().connect(url.hostname, url.port,
+                                               timeout=1)
+        except (IOError, StreamClosedError, gen.TimeoutError):
+            raise gen.Return(False)
+        stream.close()
+        raise gen.Return(True)
+
+
+class UnixProbe(ReadinessProbe):
+    """Ready once a connection to unix:///path is accepted."""
+
+    @gen.coroutine
+    def check(self, watcher, process):
+        path = urlparse(self.format(process)).path
+        stream = IOStream(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+        try:
+            yield stream.connect(path)
+        except (IOError, StreamClosedError):
+            raise gen.Return(False)
+        finally:
+            stream.close()
+        raise gen.Return(True)
+
+
+class HTTPProbe(ReadinessProbe):
+    """Ready once the url answers with a 2xx or 3xx status."""
+
+    @gen.coroutine
+    def check(self, watcher, process):
+        try:
+            response = yield AsyncHTTPClient().fetch(
+                self.format(process), raise_error=False, request_timeout=1)
+        except (HTTPClientError, OSError, StreamClosedError):
+            # the timeouts are raised even with raise_error=False
+            raise gen.Return(False)
+        raise gen.Return(200 <= response.code < 400)
+
+
+class FileProbe(ReadinessProbe):
+    """Ready once file:///path exists."""
+
+    @gen.coroutine
+    def check(self, watcher, process):
+        raise gen.Return(os.path.exists(urlparse(self.format(process)).path))
+
+
+class CallableProbe(ReadinessProbe):
+    """Ready once the callable, called with the watcher and the process,
+    returns True. The callable may return a future.
+    """
+    def __init__(self, spec):
+        super(CallableProbe, self).__init__(spec)
+        self.callable = resolve_name(spec)
+
+    @gen.coroutine
+    def check(self, watcher, process):
+        res = yield gen.maybe_future(self.callable(watcher, process))
+        raise gen.Return(bool(res))
+
+
+_PROBES = {'tcp': TCPProbe, 'unix': UnixProbe, 'http': HTTPProbe,
+           'https': HTTPProbe, 'file': FileProbe}
+
+
+def get_probe(spec):
+    """Return the probe defined by *spec*, or None if *spec* is empty.
+
+    *spec* is an url (tcp://, unix://, http://, https:// or file://)
+    or the dotted name of a callable.
+    """
+    if not spec:
+        return None
+    if '://' not in spec:
+        return CallableProbe(spec)
+    scheme = spec.split('://', 1)[0].lower()
+    if scheme not in _PROBES:
+        raise ValueError('unknown readiness probe %r' % spec)
+    return _PROBES[scheme](spec)
+
+
+@gen.coroutine
+def wait_ready(probe, watcher, process, timeout, interval=0.1):
+    """Check *process* with *probe* until it is ready.
+
+    Return False if the process is not ready after *timeout* seconds or
+    if it died in the meantime.
+    """
+    start = time.time()
+    while process.status == RUNNING:
+        ready = yield probe.check(watcher, process)
+        if ready:
+            raise gen.Return(True)
+        if time.time() - start >= timeout:
+            break
+        yield tornado_sleep(interval)
+    raise gen.Return(False)
@@ -14,6 +14,9 @@ class SysHandler(object):
 
     SIGNALS = [getattr(signal, "SIG%s" % x) for x in _SIGNALS_NAMES.split()]
 
+    # True once SIGCHLD tells the arbiter when a child exits
+    handles_chld = False
+
     SIG_NAMES = dict(
         (getattr(signal, name), name[3:].lower()) for name in dir(signal)
         if name[:3] == "SIG" and name[3] != "_"
@@ -21,6 +24,7 @@ class SysHandler(object):
 
     def __init__(self, controller):
         self.controller = controller
+        self._chld_pending = False
 
         # init signals
         logger.info('Registering signals...')
@@ -28,6 +32,7 @@ class SysHandler(object):
         self._register()
 
     def stop(self):
+        self.handles_chld = False
         for sig, callback in self._old.items():
             try:
                 signal.signal(sig, callback)
@@ -45,6 +50,14 @@ class SysHandler(object):
             signal.siginterrupt(signal.SIGQUIT, False)
             signal.siginterrupt(signal.SIGUSR1, False)
 
+        # SIGCHLD only wakes the loop up to reap the dead children
+        if not IS_WINDOWS:
+            self._old[signal.SIGCHLD] = signal.getsignal(signal.SIGCHLD)
+            signal.signal(signal.SIGCHLD, self.handle_chld)
+            if hasattr(signal, 'siginterrupt'):
+                signal.siginterrupt(signal.SIGCHLD, False)
+            self.handles_chld = True
+
     def signal(self, sig, frame=None):
         signame = self.SIG_NAMES.get(sig)
         logger.info('Got signal SIG_%s' % signame.upper())
@@ -73,6 +86,18 @@ class SysHandler(object):
             (None, make_json("reload", graceful=True))
         )
 
+    def handle_chld(self, sig=None, frame=None):
+        # We need to transfer the control to the loop's thread.
+        # Not logged on purpose, we get one per dead child, and the
+        # signals received before the loop runs the callback are merged.
+        if not self._chld_pending:
+            self._chld_pending = True
+            self.controller.loop.add_callback_from_signal(self._reap_children)
+
+    def _reap_children(self):
+        self._chld_pending = False
+        return self.controller.reap_children()
+
     def handle_int(self):
         self.quit()
 
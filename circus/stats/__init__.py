@@ -13,6 +13,8 @@ import sys
 import signal
 import argparse
 
+from circus.stats.collector import read_deadbands
+from circus.stats.publisher import FORMATS
 from circus.stats.streamer import StatsStreamer
 from circus.util import configure_logger
 from circus.sighandler import SysHandler
@@ -37,6 +39,29 @@ def main():
                         help='The ZeroMQ pub/sub socket to send data to',
                         default=util.DEFAULT_ENDPOINT_STATS)
 
+    parser.add_argument('--querypoint',
+                        help='The ZeroMQ socket to answer stats queries on',
+                        default=None)
+
+    parser.add_argument('--stats-format', dest='statsformat',
+                        default='json', choices=FORMATS,
+                        help='How the stats are sent: one json message per '
+                             'stat, or all the stats of a watcher in one '
+                             'json or msgpack message')
+
+    parser.add_argument('--keyframe-interval', dest='keyframe_interval',
+                        type=int, default=0,
+                        help='Only publish the stats which changed, and '
+                             'all of them every KEYFRAME_INTERVAL intervals')
+
+    parser.add_argument('--deadband', dest='deadbands', action='append',
+                        default=[], metavar='METRIC=VALUE',
+                        help='How much a metric has to change to be '
+                             'published, like cpu=1 or mem_info1=5%%')
+
+    parser.add_argument('--history', type=int, default=300,
+                        help='How many samples are kept for each process')
+
     parser.add_argument('--log-level', dest='loglevel', default='info',
                         help="log level")
 
@@ -58,8 +83,17 @@ def main():
     # configure the logger
     configure_logger(logger, args.loglevel, args.logoutput)
 
+    try:
+        deadbands = read_deadbands(args.deadbands)
+    except ValueError as e:
+        parser.error(str(e))
+
     stats = StatsStreamer(args.endpoint, args.pubsub, args.statspoint,
-                          args.ssh)
+                          args.ssh, query_endpoint=args.querypoint,
+                          history_size=args.history,
+                          stats_format=args.statsformat,
+                          deadbands=deadbands,
+                          keyframe_interval=args.keyframe_interval)
 
     # Register some sighandlers to stop the loop when killed
     for sig in SysHandler.SIGNALS:
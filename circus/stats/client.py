@@ -11,6 +11,7 @@ import zmq
 import zmq.utils.jsonapi as json
 
 from circus.consumer import CircusConsumer
+from circus.stats.publisher import decode_stats
 from circus import __version__
 from circus.util import DEFAULT_ENDPOINT_STATS, to_str
 
@@ -36,7 +37,7 @@ class StatsClient(CircusConsumer):
                     continue
 
                 try:
-                    topic, stat = recv()
+                    frames = recv()
                 except zmq.core.error.ZMQError as e:
                     if e.errno != errno.EINTR:
                         raise
@@ -47,6 +48,18 @@ class StatsClient(CircusConsumer):
                             pass
                         continue
 
+                if len(frames) == 3:
+                    # all the stats of a watcher, in a batch format
+                    topic, format, data = frames
+                    __, watcher = to_str(topic).split('.', 1)
+                    for stat in decode_stats(data, to_str(format)):
+                        subtopic = stat.get('subtopic')
+                        if subtopic is not None:
+                            subtopic = str(subtopic)
+                        yield watcher, subtopic, stat
+                    continue
+
+                topic, stat = frames
                 topic = to_str(topic).split('.')
                 if len(topic) == 3:
                     __, watcher, subtopic = topic
@@ -248,10 +261,14 @@ def main():
                 if subtopic is None:
                     subtopic = 'all'
 
-                # Clean pids that have not been updated recently
+                # Clean pids that have not been updated recently, unless
+                # the watcher still lists them: with a keyframe interval
+                # the stats of idle processes are not sent every time
+                alive = watchers[watcher].get('all', {}).get('pid', [])
                 for pid in tuple(p for p in watchers[watcher] if p.isdigit()):
                     if (last_refresh_for_pid[pid] <
-                            time.time() - int(args.process_timeout)):
+                            time.time() - int(args.process_timeout) and
+                            int(pid) not in alive):
                         del watchers[watcher][pid]
                 last_refresh_for_pid[subtopic] = time.time()
 
@@ -1,27 +1,151 @@
 import errno
+from array import array
 from collections import defaultdict
+import math
 import select
 import socket
+import time
 
-from circus import util
 from circus import logger
 from circus.util import AsyncPeriodicCallback
+from circus.stats.sampler import ProcSampler, PsutilSampler
+from circus.stats.series import percentile, to_number
+
+
+# the counters of the processes turned into rates for each watcher: the
+# cpu seconds and the bytes of I/O per second
+_COUNTERS = (('ctime', 'ctime'), ('io_read', 'io_read'),
+             ('io_write', 'io_write'))
+
+
+# how much each metric has to move from its last published value for a
+# stat to be published again, between two keyframes. A percentage is
+# relative to the last published value.
+DEADBANDS = {'cpu': '1', 'mem': '0.1', 'mem_info1': '5%', 'mem_info2': '5%',
+             'fds': '0', 'threads': '0', 'num_children': '0',
+             'ctime_rate': '0.01', 'io_read_rate': '5%',
+             'io_write_rate': '5%'}
+
+
+def parse_deadbands(deadbands):
+    """Return the *deadbands*, a mapping of metrics to an absolute value
+    or a percentage like ``5%``, as (value, relative) tuples."""
+    res = {}
+    for metric, value in deadbands.items():
+        value = str(value).strip()
+        relative = value.endswith('%')
+        if relative:
+            value = value[:-1]
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError('Invalid deadband for %s: %r'
+                             % (metric, deadbands[metric]))
+        res[metric] = value / 100. if relative else value, relative
+    return res
 
 
-class BaseStatsCollector(AsyncPeriodicCallback):
+def read_deadbands(items):
+    """Return the default deadbands overridden by *items*, a list of
+    ``metric=value`` strings, raising ValueError on a malformed one."""
+    deadbands = dict(DEADBANDS)
+    for item in items:
+        metric, sep, value = item.partition('=')
+        if not sep or not metric.strip():
+            raise ValueError('Invalid deadband %r, expected metric=value'
+                             % item)
+        deadbands[metric.strip()] = value
+    parse_deadbands(deadbands)
+    return deadbands
+
+
+def _column(stats, key):
+    """Return the *key* values of *stats* as an array, with NaN for the
+    missing ones."""
+    return array('d', [to_number(stat.get(key)) for stat in stats])
+
+
+def _present(column):
+    return [value for value in column if not math.isnan(value)]
 
-    def __init__(self, streamer, name, callback_time=1., io_loop=None):
+
+def _total(stats, column):
+    # a missing value makes the total missing
+    total = math.fsum(column)
+    if stats and math.isnan(total):
+        return 'N/A'
+    return total
+
+
+class BaseStatsCollector(AsyncPeriodicCallback):
+    """Publish the stats of *name* every *callback_time* seconds.
+
+    When *keyframe_interval* is set, the stats of a process, or of the
+    whole watcher, are only published when one of their metrics moved
+    out of its *deadbands* since they were last published, or when the
+    list of processes changed. Every *keyframe_interval* callbacks, all
+    the stats are published, so subscribers can rebuild the full state.
+    The stats with none of the metrics of the deadbands are always
+    published.
+    """
+
+    def __init__(self, streamer, name, callback_time=1., io_loop=None,
+                 deadbands=None, keyframe_interval=0):
         AsyncPeriodicCallback.__init__(self, self._callback,
                                        callback_time * 1000)
         self.streamer = streamer
         self.name = name
+        self.keyframe_interval = keyframe_interval
+        self.deadbands = parse_deadbands(
+            DEADBANDS if deadbands is None else deadbands)
+        self._count = 0
+        # subtopic (None for the whole watcher) -> last published stat
+        self._published = {}
+
+    def _moved(self, stat, published):
+        """Tell if *stat* moved out of the deadbands of *published*."""
+        if published is None or stat.get('pid') != published.get('pid'):
+            return True
+        for metric, (band, relative) in self.deadbands.items():
+            new, old = stat.get(metric), published.get(metric)
+            if new is None and old is None:
+                continue
+            new, old = to_number(new), to_number(old)
+            if math.isnan(new) or math.isnan(old):
+                if math.isnan(new) != math.isnan(old):
+                    return True
+                continue
+            if relative:
+                band = abs(old) * band
+            if abs(new - old) > band:
+                return True
+        return False
+
+    def _filter(self, stats):
+        """Return the *stats* to publish."""
+        keyframe = self._count % self.keyframe_interval == 0
+        self._count += 1
+        published = {}
+        res = []
+        for stat in stats:
+            key = stat.get('subtopic')
+            last = self._published.get(key)
+            if not any(metric in stat for metric in self.deadbands):
+                res.append(stat)
+            elif keyframe or self._moved(stat, last):
+                res.append(stat)
+                last = stat
+            published[key] = last
+        # the stats of the processes which are gone are forgotten
+        self._published = published
+        return res
 
     def _callback(self):
         logger.debug('Publishing stats about {0}'.format(self.name))
-        for stats in self.collect_stats():
-            if stats is None:
-                continue
-            self.streamer.publisher.publish(self.name, stats)
+        stats = [stat for stat in self.collect_stats() if stat is not None]
+        if self.keyframe_interval:
+            stats = self._filter(stats)
+        self.streamer.publisher.publish_all(self.name, stats)
 
     def collect_stats(self):
         # should be implemented in subclasses
@@ -29,60 +153,99 @@ class BaseStatsCollector(AsyncPeriodicCallback):
 
 
 class WatcherStatsCollector(BaseStatsCollector):
-    def _aggregate(self, aggregate):
+
+    def __init__(self, streamer, name, callback_time=1., io_loop=None,
+                 **kwargs):
+        super(WatcherStatsCollector, self).__init__(streamer, name,
+                                                    callback_time, io_loop,
+                                                    **kwargs)
+        # on Linux, all the pids are read from /proc in one pass, other
+        # systems go through psutil, pid by pid. Both give raw numbers.
+        if ProcSampler.available():
+            self.sampler = ProcSampler()
+        else:
+            self.sampler = PsutilSampler()
+        # time of the previous aggregation, position of each pid in its
+        # columns, and columns of counters
+        self._previous = None, {}, {}
+
+    def _aggregate(self, aggregate, now=None):
+        if now is None:
+            now = time.time()
         res = {'pid': list(aggregate.keys())}
         stats = list(aggregate.values())
 
         # aggregating CPU does not mean anything
         # but the average can be a good indicator
-        cpu = [stat['cpu'] for stat in stats]
-        if 'N/A' in cpu:
+        cpu = _present(_column(stats, 'cpu'))
+        if not stats:
+            res['cpu'] = 0.
+        elif not cpu:
             res['cpu'] = 'N/A'
         else:
-            try:
-                res['cpu'] = sum(cpu) / len(cpu)
-            except ZeroDivisionError:
-                res['cpu'] = 0.
+            res['cpu'] = sum(cpu) / len(cpu)
+            res['cpu_max'] = max(cpu)
+            res['cpu_p50'] = percentile(cpu, 50)
+            res['cpu_p95'] = percentile(cpu, 95)
 
         # aggregating memory does make sense
-        mem = [stat['mem'] for stat in stats]
-        if 'N/A' in mem:
-            res['mem'] = 'N/A'
-        else:
-            res['mem'] = sum(mem)
+        res['mem'] = _total(stats, _column(stats, 'mem'))
+        res['rss'] = _total(stats, _column(stats, 'mem_info1'))
+        res['children'] = _total(stats, _column(stats, 'num_children'))
 
         # finding out the older process
-        ages = [stat['age'] for stat in stats if stat['age'] != 'N/A']
+        ages = _present(_column(stats, 'age'))
         if len(ages) == 0:
             res['age'] = 'N/A'
         else:
             res['age'] = max(ages)
 
+        # the rates come from the counters of the processes which were
+        # already there at the previous aggregation
+        counters = dict((name, _column(stats, key))
+                        for name, key in _COUNTERS)
+        indexes = dict((pid, i) for i, pid in enumerate(res['pid']))
+        previous_time, previous_indexes, previous = self._previous
+        self._previous = now, indexes, counters
+        # the position of each pid in the current and previous columns
+        kept = [(i, previous_indexes[pid]) for pid, i in indexes.items()
+                if pid in previous_indexes]
+        for name, __ in _COUNTERS:
+            column, previous_column = counters[name], previous.get(name)
+            increase = [] if previous_column is None else _present(
+                [column[i] - previous_column[j] for i, j in kept])
+            if not increase or now <= previous_time:
+                res[name + '_rate'] = 'N/A'
+            else:
+                res[name + '_rate'] = sum(increase) / (now - previous_time)
+
         return res
 
+    def _get_infos(self, pids):
+        try:
+            return self.sampler.sample(pids)
+        except Exception as e:
+            logger.exception('Failed to sample %s. %s' % (self.name, str(e)))
+            return {}
+
     def collect_stats(self):
         aggregate = {}
 
         # sending by pids
-        for pid in self.streamer.get_pids(self.name):
+        infos = self._get_infos(self.streamer.get_pids(self.name))
+        if self.streamer.history is not None:
+            self.streamer.history.record(self.name, infos)
+        for pid, info in infos.items():
             name = None
 
             if self.name == 'circus':
                 if pid in self.streamer.circus_pids:
                     name = self.streamer.circus_pids[pid]
 
-            try:
-                info = util.get_info(pid)
-                aggregate[pid] = info
-                info['subtopic'] = pid
-                info['name'] = name
-                yield info
-            except util.NoSuchProcess:
-                # the process is gone !
-                pass
-            except Exception as e:
-                logger.exception('Failed to get info for %d. %s' % (pid,
-                                                                    str(e)))
+            aggregate[pid] = info
+            info['subtopic'] = pid
+            info['name'] = name
+            yield info
 
         # now sending the aggregation
         yield self._aggregate(aggregate)
@@ -105,9 +268,11 @@ _LOOP_RES = 10
 
 class SocketStatsCollector(BaseStatsCollector):
 
-    def __init__(self, streamer, name, callback_time=1., io_loop=None):
+    def __init__(self, streamer, name, callback_time=1., io_loop=None,
+                 **kwargs):
         super(SocketStatsCollector, self).__init__(streamer, name,
-                                                   callback_time, io_loop)
+                                                   callback_time, io_loop,
+                                                   **kwargs)
         self._rstats = defaultdict(int)
         self.sockets = [sock for sock, address, fd in self.streamer.sockets]
         self._p = AsyncPeriodicCallback(self._select, _LOOP_RES)
@@ -4,9 +4,57 @@ import zmq.utils.jsonapi as json
 from circus import logger
 from circus.util import to_bytes
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# the formats of the stats: one json message per stat, or all the stats
+# of a watcher in one message, encoded with json or msgpack
+FORMATS = ('json', 'json-batch', 'msgpack')
+
+
+def pack_stats(stats):
+    """Return the *stats* as a list of [keys, rows], the stats sharing
+    the same keys being rows of values in the order of the keys."""
+    groups = {}
+    for stat in stats:
+        keys = tuple(stat)
+        groups.setdefault(keys, []).append([stat[key] for key in keys])
+    return [[list(keys), rows] for keys, rows in groups.items()]
+
+
+def unpack_stats(groups):
+    """The opposite of :func:`pack_stats`."""
+    for keys, rows in groups:
+        for row in rows:
+            yield dict(zip(keys, row))
+
+
+def encode_stats(stats, format):
+    if format == 'msgpack':
+        return msgpack.packb(pack_stats(stats), use_bin_type=True)
+    return json.dumps(pack_stats(stats))
+
+
+def decode_stats(data, format):
+    if format == 'msgpack':
+        groups = msgpack.unpackb(data, raw=False)
+    else:
+        groups = json.loads(data)
+    return unpack_stats(groups)
+
 
 class StatsPublisher(object):
-    def __init__(self, stats_endpoint='tcp://127.0.0.1:5557', context=None):
+    def __init__(self, stats_endpoint='tcp://127.0.0.1:5557', context=None,
+                 format='json'):
+        if format not in FORMATS:
+            raise ValueError('format should be one of %s, not %r'
+                             % (', '.join(FORMATS), format))
+        if format == 'msgpack' and msgpack is None:
+            raise ValueError('the msgpack format needs msgpack')
+        self.format = format
         self.ctx = context or zmq.Context()
         self.destroy_context = context is None
         self.stats_endpoint = stats_endpoint
@@ -30,6 +78,30 @@ class StatsPublisher(object):
             else:
                 raise
 
+    def publish_all(self, name, stats):
+        """Publish the *stats* of *name* taken at once.
+
+        With a batch format they are sent in a single message of three
+        frames: the topic of the aggregated stat, the format, and the
+        encoded stats.
+        """
+        if self.format == 'json':
+            for stat in stats:
+                self.publish(name, stat)
+            return
+
+        if not stats:
+            return
+        try:
+            self.socket.send_multipart([to_bytes('stat.%s' % str(name)),
+                                        to_bytes(self.format),
+                                        encode_stats(stats, self.format)])
+        except zmq.ZMQError:
+            if self.socket.closed:
+                pass
+            else:
+                raise
+
     def stop(self):
         if self.destroy_context:
             self.ctx.destroy(0)
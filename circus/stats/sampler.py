@@ -0,0 +1,258 @@
+import os
+import time
+
+import psutil
+
+try:
+    import pwd
+except ImportError:
+    # not on Windows, which has no /proc either
+    pwd = None
+
+
+_PROC = '/proc'
+
+
+def _read(path, size=4096):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+
+class ProcSampler(object):
+    """Sample the processes of a watcher from /proc, in one pass.
+
+    Each sample reads the ``stat`` file of each pid, which holds its cpu
+    times, nice value, start time, threads and memory, its ``status`` file
+    for the context switches, its ``io`` file for the bytes read and
+    written, the children of its main thread, and counts its open files.
+    The counters the current user cannot read are missing. The user and the
+    command line, which do not change, are read the first time a pid is
+    seen. The cpu usage is computed from the cpu times of the previous
+    sample of the pid, so the first sample of a pid shows no cpu usage,
+    like psutil does.
+
+    The values are raw numbers: the memory is in bytes, the cpu time in
+    seconds, and formatting them is left to whoever displays them.
+    """
+    def __init__(self, proc=_PROC):
+        self.proc = proc
+        self.ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.boot_time = self._boot_time()
+        self.total_memory = self._total_memory()
+        # pid -> (cpu ticks, time of the sample, static infos)
+        self._previous = {}
+        self._usernames = {}
+
+    @classmethod
+    def available(cls, proc=_PROC):
+        return os.path.exists(os.path.join(proc, 'self', 'stat'))
+
+    def _boot_time(self):
+        for line in _read(os.path.join(self.proc, 'stat'), 65536).split(
+                b'\n'):
+            if line.startswith(b'btime'):
+                return float(line.split()[1])
+        return 0.
+
+    def _total_memory(self):
+        for line in _read(os.path.join(self.proc, 'meminfo')).split(b'\n'):
+            if line.startswith(b'MemTotal:'):
+                return int(line.split()[1]) * 1024
+        return 0
+
+    def _username(self, uid):
+        try:
+            return self._usernames[uid]
+        except KeyError:
+            try:
+                name = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                name = str(uid)
+            self._usernames[uid] = name
+            return name
+
+    def _static_info(self, pid, status):
+        """Read what does not change during the life of *pid*."""
+        path = os.path.join(self.proc, str(pid))
+        username = 'N/A'
+        for line in status:
+            if line.startswith(b'Uid:'):
+                username = self._username(int(line.split()[1]))
+                break
+        try:
+            argv0 = _read(os.path.join(path, 'cmdline')).split(b'\0')[0]
+            cmdline = os.path.basename(argv0.decode('utf8', 'replace'))
+        except PermissionError:
+            cmdline = ''
+        return {'username': username, 'cmdline': cmdline or 'N/A'}
+
+    def _io(self, path):
+        try:
+            io = _read(os.path.join(path, 'io'))
+        except (FileNotFoundError, PermissionError):
+            return 'N/A', 'N/A'
+        read = write = 'N/A'
+        for line in io.split(b'\n'):
+            if line.startswith(b'read_bytes:'):
+                read = int(line.split()[1])
+            elif line.startswith(b'write_bytes:'):
+                write = int(line.split()[1])
+        return read, write
+
+    def _num_children(self, path, pid):
+        # only the children of the main thread are listed, which are all
+        # the children of most processes
+        try:
+            children = _read(os.path.join(path, 'task', str(pid),
+                                          'children'), 65536)
+        except (FileNotFoundError, PermissionError):
+            return 'N/A'
+        return len(children.split())
+
+    def sample(self, pids):
+        """Return a mapping of the infos of the running *pids*."""
+        infos = {}
+        previous = self._previous
+        self._previous = current = {}
+        now = time.time()
+        for pid in pids:
+            path = os.path.join(self.proc, str(pid))
+            try:
+                stat = _read(os.path.join(path, 'stat'))
+                # the command name, between parenthesis, can hold spaces
+                fields = stat[stat.rfind(b')') + 2:].split()
+                status = _read(os.path.join(path, 'status')).split(b'\n')
+                last = previous.get(pid)
+                if last is None:
+                    static = self._static_info(pid, status)
+                else:
+                    static = last[2]
+                try:
+                    fds = len(os.listdir(os.path.join(path, 'fd')))
+                except PermissionError:
+                    fds = 'N/A'
+            except (FileNotFoundError, ProcessLookupError):
+                # the process is gone !
+                continue
+
+            ctx_switches = 0
+            for line in status:
+                if line.endswith(b'ctxt_switches', 0, line.find(b':')):
+                    ctx_switches += int(line.split()[1])
+            io_read, io_write = self._io(path)
+
+            ticks = int(fields[11]) + int(fields[12])
+            if last is None or now <= last[1]:
+                cpu = 0.
+            else:
+                cpu = round((ticks - last[0]) / self.ticks /
+                            (now - last[1]) * 100, 1)
+            current[pid] = ticks, now, static
+
+            rss = int(fields[21]) * self.page_size
+            create_time = self.boot_time + int(fields[19]) / self.ticks
+            if self.total_memory:
+                mem = round(rss * 100. / self.total_memory, 3)
+            else:
+                mem = 'N/A'
+            infos[pid] = {'pid': pid,
+                          'cpu': cpu,
+                          'mem': mem,
+                          'mem_info1': rss,
+                          'mem_info2': int(fields[20]),
+                          'ctime': ticks / self.ticks,
+                          'nice': int(fields[16]),
+                          'create_time': create_time,
+                          'age': now - create_time,
+                          'threads': int(fields[17]),
+                          'fds': fds,
+                          'ctx_switches': ctx_switches,
+                          'io_read': io_read,
+                          'io_write': io_write,
+                          'num_children': self._num_children(path, pid),
+                          'username': static['username'],
+                          'cmdline': static['cmdline'],
+                          'children': []}
+        return infos
+
+
+def _get(method, default='N/A'):
+    try:
+        return method()
+    except psutil.AccessDenied:
+        return default
+
+
+class PsutilSampler(object):
+    """Sample the processes of a watcher with psutil, pid by pid, on the
+    systems without /proc.
+
+    The infos are the ones of :class:`ProcSampler`, raw numbers included,
+    so the stats look the same whatever the system. The counters psutil
+    can't read on the system, or the current user can't read, are
+    missing.
+    """
+    def __init__(self):
+        # pid -> psutil.Process, which keeps the cpu times of the previous
+        # sample to compute the cpu usage
+        self._processes = {}
+
+    def _info(self, process, now):
+        pid = process.pid
+        info = {'pid': pid, 'children': []}
+        info['cpu'] = _get(process.cpu_percent)
+        mem = _get(process.memory_info, None)
+        if mem is None:
+            info['mem_info1'] = info['mem_info2'] = 'N/A'
+        else:
+            info['mem_info1'], info['mem_info2'] = mem.rss, mem.vms
+        mem = _get(process.memory_percent)
+        info['mem'] = mem if mem == 'N/A' else round(mem, 3)
+        times = _get(process.cpu_times, None)
+        info['ctime'] = 'N/A' if times is None else times.user + times.system
+        info['nice'] = _get(process.nice)
+        info['create_time'] = _get(process.create_time)
+        if info['create_time'] == 'N/A':
+            info['age'] = 'N/A'
+        else:
+            info['age'] = now - info['create_time']
+        info['threads'] = _get(process.num_threads)
+        num_fds = getattr(process, 'num_fds', None) or \
+            getattr(process, 'num_handles', None)
+        info['fds'] = 'N/A' if num_fds is None else _get(num_fds)
+        switches = _get(process.num_ctx_switches, None)
+        info['ctx_switches'] = 'N/A' if switches is None else \
+            switches.voluntary + switches.involuntary
+        io_counters = getattr(process, 'io_counters', None)
+        io = None if io_counters is None else _get(io_counters, None)
+        if io is None:
+            info['io_read'] = info['io_write'] = 'N/A'
+        else:
+            info['io_read'], info['io_write'] = io.read_bytes, io.write_bytes
+        children = _get(process.children, None)
+        info['num_children'] = 'N/A' if children is None else len(children)
+        info['username'] = _get(process.username)
+        cmdline = _get(process.cmdline, None)
+        info['cmdline'] = os.path.basename(cmdline[0]) if cmdline else 'N/A'
+        return info
+
+    def sample(self, pids):
+        """Return a mapping of the infos of the running *pids*."""
+        infos = {}
+        previous = self._processes
+        self._processes = current = {}
+        now = time.time()
+        for pid in pids:
+            try:
+                process = previous.get(pid) or psutil.Process(pid)
+                with process.oneshot():
+                    infos[pid] = self._info(process, now)
+            except psutil.NoSuchProcess:
+                # the process is gone !
+                continue
+            current[pid] = process
+        return infos
@@ -0,0 +1,158 @@
+import math
+import time
+from array import array
+
+
+METRICS = ('cpu', 'rss', 'vms', 'fds', 'threads', 'ctx_switches')
+
+# where each metric is found in the infos of a process
+_FIELDS = {'cpu': 'cpu', 'rss': 'mem_info1', 'vms': 'mem_info2',
+           'fds': 'fds', 'threads': 'threads',
+           'ctx_switches': 'ctx_switches'}
+
+AGGREGATES = ('mean', 'max', 'p95', 'rate')
+
+_NAN = float('nan')
+
+
+def to_number(value):
+    """Return *value* as a float, NaN when it is missing, like 'N/A'."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return _NAN
+
+
+class Series(object):
+    """The last *size* samples of some metrics of a process or a watcher.
+
+    The samples are kept in fixed size arrays of doubles, used as ring
+    buffers, so adding a sample costs the same whatever the size, and the
+    memory used does not grow. Missing values are kept as NaN.
+    """
+    def __init__(self, size, metrics=METRICS):
+        self.size = size
+        self.metrics = metrics
+        self.times = array('d', [_NAN]) * size
+        self.values = dict((metric, array('d', [_NAN]) * size)
+                           for metric in metrics)
+        self.count = 0
+        self._next = 0
+
+    def append(self, when, values):
+        i = self._next
+        self.times[i] = when
+        for metric, column in self.values.items():
+            column[i] = values.get(metric, _NAN)
+        self._next = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def window(self, since):
+        """Return the times, and the values of each metric, of the samples
+        taken since *since*, oldest first."""
+        indexes = []
+        i = self._next
+        for __ in range(self.count):
+            i = (i - 1) % self.size
+            if self.times[i] < since:
+                break
+            indexes.append(i)
+        indexes.reverse()
+        times = [self.times[i] for i in indexes]
+        values = dict((metric, [column[i] for i in indexes])
+                      for metric, column in self.values.items())
+        return times, values
+
+
+def percentile(values, percent):
+    """Return the nearest-rank *percent* percentile of *values*."""
+    values = sorted(values)
+    return values[min(int(math.ceil(len(values) * percent / 100.)) - 1,
+                      len(values) - 1)]
+
+
+def aggregate(times, values, aggregates=AGGREGATES):
+    """Aggregate the *values* sampled at *times*, skipping missing ones."""
+    samples = [(when, value) for when, value in zip(times, values)
+               if not math.isnan(value)]
+    res = {'count': len(samples)}
+    if not samples:
+        for name in aggregates:
+            res[name] = None
+        return res
+
+    numbers = [value for __, value in samples]
+    for name in aggregates:
+        if name == 'mean':
+            res[name] = sum(numbers) / len(numbers)
+        elif name == 'max':
+            res[name] = max(numbers)
+        elif name == 'p95':
+            res[name] = percentile(numbers, 95)
+        elif name == 'rate':
+            # for counters, the increase per second over the window
+            (first, start), (last, end) = samples[0], samples[-1]
+            res[name] = (end - start) / (last - first) if last > first \
+                else None
+        else:
+            raise ValueError('Unknown aggregate %r' % name)
+    return res
+
+
+class StatsHistory(object):
+    """Keep the last *size* samples of each process, and of the sum of
+    the processes of each watcher.
+
+    The series of a process are dropped when it is removed, so the memory
+    used only depends on the number of running processes.
+    """
+    def __init__(self, size=300):
+        self.size = size
+        # watcher -> pid (None for the whole watcher) -> series
+        self._series = {}
+
+    def _get_series(self, watcher, pid):
+        series = self._series.setdefault(watcher, {})
+        if pid not in series:
+            series[pid] = Series(self.size)
+        return series[pid]
+
+    def record(self, watcher, infos, when=None):
+        """Add a sample of the *infos* of the processes of *watcher*."""
+        if when is None:
+            when = time.time()
+        total = dict((metric, 0.) for metric in METRICS)
+        for pid, info in infos.items():
+            values = dict((metric, to_number(info.get(field)))
+                          for metric, field in _FIELDS.items())
+            self._get_series(watcher, pid).append(when, values)
+            for metric, value in values.items():
+                # a missing value makes the sum missing
+                total[metric] += value
+        self._get_series(watcher, None).append(when, total)
+
+    def forget(self, watcher, pid=None):
+        """Drop the series of *pid*, or of the whole *watcher*."""
+        if pid is None:
+            self._series.pop(watcher, None)
+        else:
+            self._series.get(watcher, {}).pop(pid, None)
+
+    def query(self, watcher, pid=None, window=60., metrics=METRICS,
+              aggregates=AGGREGATES, now=None):
+        """Return the *aggregates* of the *metrics* of *pid*, or of the
+        whole *watcher*, over the last *window* seconds."""
+        try:
+            series = self._series[watcher][pid]
+        except KeyError:
+            raise KeyError('No stats for %s' % (
+                watcher if pid is None else '%s pid %s' % (watcher, pid)))
+        if now is None:
+            now = time.time()
+        times, values = series.window(now - window)
+        res = {}
+        for metric in metrics:
+            if metric not in values:
+                raise ValueError('Unknown metric %r' % metric)
+            res[metric] = aggregate(times, values[metric], aggregates)
+        return res
@@ -9,17 +9,25 @@ import zmq.utils.jsonapi as json
 from tornado import ioloop
 from zmq.eventloop import zmqstream
 
-from circus.commands import get_commands
+from circus.commands import get_commands, ok, error
 from circus.client import CircusClient
 from circus.stats.collector import WatcherStatsCollector, SocketStatsCollector
 from circus.stats.publisher import StatsPublisher
+from circus.stats.series import StatsHistory, METRICS, AGGREGATES
 from circus import logger
 from circus.util import to_str
 
 
 class StatsStreamer(object):
+    # how many samples of each process are kept to answer queries
+    history_size = 300
+    deadbands = None
+    keyframe_interval = 0
+
     def __init__(self, endpoint, pubsub_endoint, stats_endpoint,
-                 ssh_server=None, delay=1., loop=None):
+                 ssh_server=None, delay=1., loop=None, query_endpoint=None,
+                 history_size=300, stats_format='json', deadbands=None,
+                 keyframe_interval=0):
         self.topic = b'watcher.'
         self.delay = delay
         self.ctx = zmq.Context()
@@ -33,7 +41,19 @@ class StatsStreamer(object):
         self.client = CircusClient(context=self.ctx, endpoint=endpoint,
                                    ssh_server=ssh_server)
         self.cmds = get_commands()
-        self.publisher = StatsPublisher(stats_endpoint, self.ctx)
+        self.publisher = StatsPublisher(stats_endpoint, self.ctx,
+                                        format=stats_format)
+        self.history_size = history_size
+        self.deadbands = deadbands
+        self.keyframe_interval = keyframe_interval
+        self.query_endpoint = query_endpoint
+        if query_endpoint is not None:
+            self.query_socket = self.ctx.socket(zmq.ROUTER)
+            self.query_socket.bind(query_endpoint)
+            self.query_socket.linger = 0
+            self.querystream = zmqstream.ZMQStream(self.query_socket,
+                                                   self.loop)
+            self.querystream.on_recv(self.handle_query)
         self._initialize()
 
     def _initialize(self):
@@ -44,6 +64,7 @@ class StatsStreamer(object):
         self.circus_pids = {}
         self.sockets = []
         self.get_watchers = self._pids.keys
+        self.history = StatsHistory(self.history_size)
 
     def get_pids(self, watcher=None):
         if watcher is not None:
@@ -82,7 +103,9 @@ class StatsStreamer(object):
         else:
             raise ValueError('Unknown callback kind %r' % kind)
 
-        self._callbacks[name] = klass(self, name, self.delay, self.loop)
+        self._callbacks[name] = klass(
+            self, name, self.delay, self.loop, deadbands=self.deadbands,
+            keyframe_interval=self.keyframe_interval)
         if start:
             self._callbacks[name].start()
 
@@ -128,11 +151,13 @@ class StatsStreamer(object):
     def stop_watcher(self, watcher):
         for pid in self._pids[watcher]:
             self.remove_pid(watcher, pid)
+        self.history.forget(watcher)
 
     def remove_pid(self, watcher, pid):
         if pid in self._pids[watcher]:
             logger.debug('Removing %d from %s' % (pid, watcher))
             self._pids[watcher].remove(pid)
+            self.history.forget(watcher, pid)
             if len(self._pids[watcher]) == 0:
                 logger.debug(
                     'Stopping the periodic callback for {0}' .format(watcher))
@@ -206,6 +231,41 @@ class StatsStreamer(object):
         except Exception:
             logger.exception('Failed to handle %r' % msg)
 
+    def query(self, props):
+        """Return the aggregates of the samples of a watcher, or of one of
+        its processes, over the last *window* seconds."""
+        if 'name' not in props:
+            raise ValueError('message invalid \'name\' is missing')
+        window = float(props.get('window', 60.))
+        metrics = props.get('metrics', METRICS)
+        aggregates = props.get('aggregates', AGGREGATES)
+        return self.history.query(props['name'], props.get('pid'), window,
+                                  metrics, aggregates)
+
+    def handle_query(self, data):
+        """called each time a client sends a query"""
+        try:
+            cid, msg = data
+        except ValueError:
+            logger.warning('got unexpected query %s' % str(data))
+            return
+
+        mid = None
+        try:
+            msg = json.loads(msg)
+            mid = msg.get('id')
+            if msg.get('command') != 'query':
+                raise ValueError('unknown command: %r' % msg.get('command'))
+            resp = ok({'stats': self.query(msg.get('properties', {}))})
+        except (KeyError, TypeError, ValueError) as e:
+            resp = error(str(e).strip("'\""))
+        except Exception:
+            logger.exception('Failed to handle the query %r' % msg)
+            resp = error('server error')
+
+        resp['id'] = mid
+        self.querystream.send_multipart([cid, json.dumps(resp)])
+
     def stop(self):
         # stop all the periodic callbacks running
         for callback in self._callbacks.values():
@@ -4,11 +4,16 @@ import random
 from datetime import datetime
 from queue import Queue, Empty  # noqa: F401
 
-from circus.util import resolve_name, to_str
+from circus.util import resolve_name, to_str, to_bool
 from circus.stream.file_stream import FileStream
 from circus.stream.file_stream import WatchedFileStream  # noqa: F401
 from circus.stream.file_stream import TimedRotatingFileStream  # noqa: F401
+from circus.stream.file_stream import JSONLinesStream  # noqa: F401
+from circus.stream.prefixer import TimeFormatter
 from circus.stream.redirector import Redirector  # noqa: F401
+from circus.stream.ring_buffer import RingBufferStream  # noqa: F401
+from circus.stream.sink import SinkStream  # noqa: F401
+from circus.stream.threaded_stream import ThreadedStream
 
 
 class QueueStream(Queue):
@@ -79,6 +84,7 @@ class FancyStdoutStream(StdoutStream):
     def __init__(self, color=None, time_format=None, **kwargs):
         super(FancyStdoutStream, self).__init__(**kwargs)
         self.time_format = time_format or '%Y-%m-%d %H:%M:%S'
+        self.formatter = TimeFormatter(self.time_format)
         if color not in self.colors:
             color = random.choice(self.colors)
         self.color_code = self.colors.index(color) + 1
@@ -98,7 +104,7 @@ class FancyStdoutStream(StdoutStream):
             time = self.fromtimestamp(data['timestamp'])
         else:
             time = self.now()
-        time = time.strftime(self.time_format)
+        time = self.formatter.format(time)
 
         # start the coloring with the ansi escape sequence
         color = '\033[0;3%s;40m' % self.color_code
@@ -118,6 +124,13 @@ class FancyStdoutStream(StdoutStream):
 
 def get_stream(conf, reload=False):
     if conf:
+        # any stream can be written from a dedicated thread
+        threaded = to_bool(conf.pop('threaded', False))
+        threaded_options = {}
+        for key in ('queue_size', 'overflow'):
+            if key in conf:
+                threaded_options[key] = conf.pop(key)
+
         # we can have 'stream' or 'class' or 'filename'
         if 'class' in conf:
             class_name = conf.pop('class')
@@ -133,4 +146,6 @@ def get_stream(conf, reload=False):
         else:
             raise ValueError("stream configuration invalid")
 
+        if threaded:
+            inst = ThreadedStream(inst, **threaded_options)
         return inst
@@ -1,12 +1,63 @@
 import errno
+import gzip
+import io
 import os
+import shutil
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time as time_
 import re
 from stat import ST_DEV, ST_INO, ST_MTIME
+from tornado.ioloop import IOLoop, PeriodicCallback
+
 from circus import logger
-from circus.util import to_str
+from circus.stream.prefixer import JSONLineFormatter, LinePrefixer
+from circus.util import to_bytes, to_str
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# os.splice is Linux only, and Python >= 3.10
+_splice = getattr(os, 'splice', None)
+
+# extension of the compressed backups
+_COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# rotated files are compressed and pruned by a few threads shared by all
+# the streams
+ROTATION_WORKERS = 2
+_rotation_pool = None
+_rotation_pool_lock = threading.Lock()
+
+
+def _get_rotation_pool():
+    global _rotation_pool
+    with _rotation_pool_lock:
+        if _rotation_pool is None:
+            _rotation_pool = ThreadPoolExecutor(
+                max_workers=ROTATION_WORKERS,
+                thread_name_prefix='circus-rotation')
+        return _rotation_pool
+
+
+def compress_file(source, target, method):
+    """Compress *source* into *target* with *method*, then remove
+    *source*. *target* only appears once complete.
+    """
+    tmp = target + '.tmp'
+    with open(source, 'rb') as src:
+        if method == 'gzip':
+            with gzip.open(tmp, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            with open(tmp, 'wb') as dst:
+                zstandard.ZstdCompressor().copy_stream(src, dst)
+    os.rename(tmp, target)
+    os.remove(source)
 
 
 class _FileStreamBase(object):
@@ -16,55 +67,229 @@ class _FileStreamBase(object):
     now = datetime.now
     fromtimestamp = datetime.fromtimestamp
 
-    def __init__(self, filename, time_format):
+    def __init__(self, filename, time_format, flush_bytes=0,
+                 flush_interval=0, compress=None):
+        if compress and compress not in _COMPRESSIONS:
+            raise ValueError('compress should be one of %s, not %r'
+                             % (', '.join(_COMPRESSIONS), compress))
+        if compress == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression needs the zstandard package')
+        self._compress = compress or None
+        # the last rotation job submitted, the next one waits for it
+        self._rotation = None
         if filename is None:
             fd, filename = tempfile.mkstemp()
             os.close(fd)
         self._filename = filename
+        # by default the file is flushed after each write
+        self._flush_bytes = int(flush_bytes)
+        self._flush_interval = int(flush_interval)
+        self._pending = 0
+        self._flusher = None
+        # writes the cut lines which waited too long, (loop, timeout)
+        self._carry_timer = None
         self._file = self._open()
         self._time_format = time_format
+        self._prefixer = None
+        if time_format is not None:
+            self._prefixer = LinePrefixer(time_format)
         self._buffer = []  # XXX - is this really needed?
+        # splice refuses files opened in append mode, so the passthrough
+        # mode writes through its own descriptor on the current file
+        self._splice_fd = None
+        self._splice_file = None
+        self._passthrough = (_splice is not None and time_format is None
+                             and self._writes_as_is())
+        # size of the current file, counted in memory to avoid a seek on
+        # each write. Computed again when the file changes, and once over
+        # max_bytes. Once other writers are seen, like another stream
+        # appending to the same file, it is read on each write instead.
+        self._size = 0
+        self._size_file = None
+        self._shared = False
+
+    def _writes_as_is(self):
+        # a subclass changing how the data is written, like formatting
+        # it, has to read it, so the data can't be spliced to the file
+        return all(getattr(type(self), name).__module__ == __name__
+                   for name in ('__call__', 'write_data', '_write'))
 
     def _open(self):
-        return open(self._filename, 'a+')
+        buffering = -1
+        if self._flush_bytes > io.DEFAULT_BUFFER_SIZE:
+            buffering = self._flush_bytes
+        return open(self._filename, 'ab', buffering=buffering)
 
     def open(self):
         if self._file.closed:
             self._file = self._open()
 
     def close(self):
+        if self._prefixer is not None and not self._file.closed:
+            # the lines cut by the end of the output
+            self._write(self._prefixer.drain(self.now()))
+        self._stop_flusher()
+        self._stop_carry_timer()
+        self._close_splice_fd()
         self._file.close()
 
-    def write_data(self, data):
-        # data to write on file
-        file_data = to_str(data['data'])
+    def flush(self):
+        """Write the buffered data to the file."""
+        self._write_stale_lines()
+        if self._pending and self._file is not None \
+                and not self._file.closed:
+            self._file.flush()
+        self._pending = 0
+
+    def _stop_flusher(self):
+        if self._flusher is not None:
+            self._flusher.stop()
+            self._flusher = None
+
+    def end_output(self, data):
+        """Write the last line of the process of *data*, whose output
+        ended, even if it has no newline."""
+        if self._prefixer is not None and self._file is not None \
+                and not self._file.closed:
+            lines = self._prefixer.end(data, self._time(data))
+            if lines:
+                self._write(lines)
+
+    def _write_stale_lines(self):
+        if self._prefixer is not None and self._prefixer.carrying \
+                and self._file is not None and not self._file.closed:
+            lines = self._prefixer.drain(self.now(),
+                                         self._prefixer.carry_timeout)
+            if lines:
+                self._write(lines)
+
+    def _start_carry_timer(self):
+        if self._carry_timer is not None:
+            return
+        loop = IOLoop.current(instance=False)
+        if loop is None:
+            # out of the loop, e.g. in a ThreadedStream, which flushes
+            # while it waits for output
+            return
+        timeout = loop.call_later(self._prefixer.carry_timeout,
+                                  self._carry_timed_out)
+        self._carry_timer = loop, timeout
+
+    def _stop_carry_timer(self):
+        if self._carry_timer is not None:
+            loop, timeout = self._carry_timer
+            loop.remove_timeout(timeout)
+            self._carry_timer = None
+
+    def _carry_timed_out(self):
+        self._carry_timer = None
+        self._write_stale_lines()
+        if self._prefixer.carrying:
+            self._start_carry_timer()
+
+    def _file_size(self):
+        if self._shared or self._size_file is not self._file:
+            self._file.seek(0, 2)
+            self._size = self._file.tell()
+            self._size_file = self._file
+        return self._size
+
+    def _rotate_in_background(self, job, *args):
+        """Run *job* in the rotation pool, after the previous rotation
+        jobs of this stream."""
+        previous = self._rotation
+
+        def run():
+            if previous is not None:
+                previous.result()
+            try:
+                job(*args)
+            except Exception:
+                logger.exception('Could not rotate %s', self._filename)
+
+        self._rotation = _get_rotation_pool().submit(run)
+        return self._rotation
+
+    def _close_splice_fd(self):
+        if self._splice_fd is not None:
+            os.close(self._splice_fd)
+            self._splice_fd = self._splice_file = None
+
+    def splice(self, fd, size):
+        """Move up to *size* bytes from the *fd* pipe straight to the file.
+
+        The data never goes through Python buffers. Return the number of
+        bytes moved, 0 once the pipe is closed, or None when the data has
+        to be read and given to the stream instead: the lines are prefixed
+        by a timestamp, or the platform can't splice.
+        """
+        if not self._passthrough:
+            return None
+        # what was written before has to land first
+        self.flush()
+        if self._splice_file is not self._file:
+            self._close_splice_fd()
+            self._splice_fd = os.open(self._filename,
+                                      os.O_WRONLY | os.O_CREAT, 0o666)
+            self._splice_file = self._file
+        os.lseek(self._splice_fd, 0, os.SEEK_END)
+        try:
+            moved = _splice(fd, self._splice_fd, size,
+                            flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+            # the file system doesn't support splice
+            self._passthrough = False
+            self._close_splice_fd()
+            return None
+        self._size = self._file_size() + moved
+        return moved
+
+    def _time(self, data):
+        if 'timestamp' in data:
+            return self.fromtimestamp(data['timestamp'])
+        return self.now()
 
+    def write_data(self, data):
         # If we want to prefix the stream with the current datetime
-        if self._time_format is not None:
-            if 'timestamp' in data:
-                time = self.fromtimestamp(data['timestamp'])
-            else:
-                time = self.now()
-            time = time.strftime(self._time_format)
-            prefix = '{time} [{pid}] | '.format(time=time, pid=data['pid'])
-            file_data = prefix + file_data.rstrip('\n')
-            file_data = file_data.replace('\n', '\n' + prefix)
-            file_data += '\n'
+        if self._prefixer is not None:
+            file_data = self._prefixer(data, self._time(data))
+            if self._prefixer.carrying:
+                self._start_carry_timer()
+        else:
+            file_data = to_bytes(data['data'])
+        if file_data:
+            self._write(file_data)
 
+    def _write(self, file_data):
         # writing into the file
-        try:
-            self._file.write(file_data)
-        except Exception:
-            file_data = file_data.encode('latin-1', errors='replace')
-            file_data = file_data.decode('latin-1')
+        size = self._file_size()
+        if isinstance(self._file, io.TextIOBase):
+            self._file.write(to_str(file_data))
+        else:
             self._file.write(file_data)
-
-        self._file.flush()
+        self._size = size + len(file_data)
+        self._pending += len(file_data)
+
+        if self._flush_interval > 0:
+            # no timer out of the loop thread, e.g. in a ThreadedStream
+            # which flushes each time it runs out of data
+            if self._flusher is None and \
+                    IOLoop.current(instance=False) is not None:
+                self._flusher = PeriodicCallback(self.flush,
+                                                 self._flush_interval)
+                self._flusher.start()
+            if 0 < self._flush_bytes <= self._pending:
+                self.flush()
+        elif self._flush_bytes <= self._pending:
+            self.flush()
 
 
 class FileStream(_FileStreamBase):
     def __init__(self, filename=None, max_bytes=0, backup_count=0,
-                 time_format=None, **kwargs):
+                 time_format=None, flush_bytes=0, flush_interval=0,
+                 compress=None, **kwargs):
         '''
         File writer handler which writes output to a file, allowing rotation
         behaviour based on Python's ``logging.handlers.RotatingFileHandler``.
@@ -89,6 +314,14 @@ class FileStream(_FileStreamBase):
         You may also configure the timestamp format as defined by
         datetime.strftime.
 
+        The file is flushed after each write, unless flush_bytes or
+        flush_interval are set: it is then flushed once flush_bytes are
+        buffered, and/or every flush_interval milliseconds.
+
+        With compress set to gzip or zstd, the backups are compressed
+        ("app.log.1.gz", ...) and shifted by a background thread, so the
+        rollover only renames the current file.
+
         Here is an example: ::
 
           [watcher:foo]
@@ -97,9 +330,11 @@ class FileStream(_FileStreamBase):
           stdout_stream.filename = /var/log/circus/out.log
           stdout_stream.time_format = %Y-%m-%d %H:%M:%S
         '''
-        super(FileStream, self).__init__(filename, time_format)
+        super(FileStream, self).__init__(filename, time_format, flush_bytes,
+                                         flush_interval, compress)
         self._max_bytes = int(max_bytes)
         self._backup_count = int(backup_count)
+        self._rotations = 0
 
     def __call__(self, data):
         if self._should_rollover(data['data']):
@@ -107,6 +342,13 @@ class FileStream(_FileStreamBase):
 
         self.write_data(data)
 
+    def splice(self, fd, size):
+        # the size of the data is unknown until it is moved, rollover
+        # once the file is full instead of before it overflows
+        if self._passthrough and self._should_rollover(b''):
+            self._do_rollover()
+        return super(FileStream, self).splice(fd, size)
+
     def _do_rollover(self):
         """
         Do a rollover, as described in __init__().
@@ -114,7 +356,14 @@ class FileStream(_FileStreamBase):
         if self._file:
             self._file.close()
             self._file = None
-        if self._backup_count > 0:
+        if self._backup_count > 0 and self._compress:
+            # the backups are shifted and compressed in the background
+            self._rotations += 1
+            rotated = '%s.rotating.%d.%d' % (self._filename, os.getpid(),
+                                             self._rotations)
+            os.rename(self._filename, rotated)
+            self._rotate_in_background(self._shift_backups, rotated)
+        elif self._backup_count > 0:
             for i in range(self._backup_count - 1, 0, -1):
                 sfn = "%s.%d" % (self._filename, i)
                 dfn = "%s.%d" % (self._filename, i + 1)
@@ -130,6 +379,22 @@ class FileStream(_FileStreamBase):
             logger.debug("Log rotating %s -> %s" % (self._filename, dfn))
         self._file = self._open()
 
+    def _shift_backups(self, rotated):
+        ext = _COMPRESSIONS[self._compress]
+        for i in range(self._backup_count - 1, 0, -1):
+            sfn = "%s.%d%s" % (self._filename, i, ext)
+            dfn = "%s.%d%s" % (self._filename, i + 1, ext)
+            if os.path.exists(sfn):
+                logger.debug("Log rotating %s -> %s" % (sfn, dfn))
+                if os.path.exists(dfn):
+                    os.remove(dfn)
+                os.rename(sfn, dfn)
+        dfn = "%s.1%s" % (self._filename, ext)
+        if os.path.exists(dfn):
+            os.remove(dfn)
+        compress_file(rotated, dfn, self._compress)
+        logger.debug("Log rotating %s -> %s" % (self._filename, dfn))
+
     def _should_rollover(self, raw_data):
         """
         Determine if rollover should occur.
@@ -140,14 +405,65 @@ class FileStream(_FileStreamBase):
         if self._file is None:                 # delay was set...
             self._file = self._open()
         if self._max_bytes > 0:                   # are we rolling over?
-            self._file.seek(0, 2)  # due to non-posix-compliant Windows feature
-            if self._file.tell() + len(raw_data) >= self._max_bytes:
-                return 1
+            if self._file_size() + len(raw_data) >= self._max_bytes:
+                return self._check_size() + len(raw_data) >= self._max_bytes
         return 0
 
+    def _check_size(self):
+        """Return the real size of the file, which others may have
+        written to, or rotated, since the size was last read."""
+        counted = self._size
+        try:
+            stat = os.stat(self._filename)
+        except FileNotFoundError:
+            stat = None
+        current = os.fstat(self._file.fileno())
+        if stat is None or (stat[ST_DEV], stat[ST_INO]) != \
+                (current[ST_DEV], current[ST_INO]):
+            # the file was rotated by another stream, or removed: write
+            # to the new one
+            self._shared = stat is not None
+            self._file.close()
+            self._file = self._open()
+        else:
+            self._size_file = None
+        size = self._file_size()
+        if size > counted:
+            self._shared = True
+        return size
+
+
+class JSONLinesStream(FileStream):
+    def __init__(self, filename=None, **kwargs):
+        '''
+        File writer handler which writes each line of output as a JSON
+        record, for log shippers: ::
+
+          {"time": 1500000000.5, "watcher": "foo", "wid": 1, "pid": 333,
+           "stream": "stdout", "data": "the line"}
+
+        *time* is a timestamp, the other options are the ones of
+        ``FileStream`` except time_format.
+
+        Here is an example: ::
+
+          [watcher:foo]
+          cmd = python -m myapp.server
+          stdout_stream.class = JSONLinesStream
+          stdout_stream.filename = /var/log/circus/out.json
+          stdout_stream.max_bytes = 1073741824
+          stdout_stream.backup_count = 5
+        '''
+        kwargs.pop('time_format', None)
+        super(JSONLinesStream, self).__init__(filename=filename, **kwargs)
+        self._prefixer = JSONLineFormatter()
+        # the lines have to be read to be formatted
+        self._passthrough = False
+
 
 class WatchedFileStream(_FileStreamBase):
-    def __init__(self, filename=None, time_format=None, **kwargs):
+    def __init__(self, filename=None, time_format=None, flush_bytes=0,
+                 flush_interval=0, **kwargs):
         '''
         File writer handler which writes output to a file, allowing an external
         log rotation process to handle rotation, like Python's
@@ -158,7 +474,7 @@ class WatchedFileStream(_FileStreamBase):
         logrotate.
 
         You may also configure the timestamp format as defined by
-        datetime.strftime.
+        datetime.strftime, and the flush policy as for ``FileStream``.
 
         Here is an example: ::
 
@@ -168,7 +484,8 @@ class WatchedFileStream(_FileStreamBase):
           stdout_stream.filename = /var/log/circus/out.log
           stdout_stream.time_format = %Y-%m-%d %H:%M:%S
         '''
-        super(WatchedFileStream, self).__init__(filename, time_format)
+        super(WatchedFileStream, self).__init__(filename, time_format,
+                                                flush_bytes, flush_interval)
         self.dev, self.ino = -1, -1
         self._statfile()
 
@@ -186,7 +503,7 @@ class WatchedFileStream(_FileStreamBase):
             else:
                 raise
 
-    def __call__(self, data):
+    def _reopen_if_moved(self):
         # stat the filename to see if the file we opened still exists. If the
         # ino or dev doesn't match, we need to open a new file handle
         dev, ino = self._statfilename()
@@ -196,8 +513,15 @@ class WatchedFileStream(_FileStreamBase):
             self._file = self._open()
             self._statfile()
 
+    def __call__(self, data):
+        self._reopen_if_moved()
         self.write_data(data)
 
+    def splice(self, fd, size):
+        if self._passthrough:
+            self._reopen_if_moved()
+        return super(WatchedFileStream, self).splice(fd, size)
+
 
 _MIDNIGHT = 24 * 60 * 60  # number of seconds in a day
 
@@ -221,6 +545,8 @@ class TimedRotatingFileStream(FileStream):
           'W0'-'W6' or 'midnight'. See Python's TimedRotatingFileHandler
           for more information.
         - rotate_interval: Rollover interval in seconds. Default: 1
+        - compress: gzip or zstd to compress the backups, and delete the
+          old ones, in a background thread. Default: None
 
         Here is an example: ::
 
@@ -311,7 +637,10 @@ for weekly rollover: %s" % self._when)
             os.rename(self._filename, dfn)
             logger.debug("Log rotating %s -> %s" % (self._filename, dfn))
 
-        if self._backup_count > 0:
+        if self._compress:
+            # compressing and pruning the backups lists and reads files
+            self._rotate_in_background(self._compress_backup, dfn)
+        elif self._backup_count > 0:
             for f in self._get_files_to_delete():
                 os.remove(f)
 
@@ -358,15 +687,26 @@ for weekly rollover: %s" % self._when)
 
         return result
 
+    def _compress_backup(self, dfn):
+        if os.path.exists(dfn):
+            compress_file(dfn, dfn + _COMPRESSIONS[self._compress],
+                          self._compress)
+        if self._backup_count > 0:
+            for f in self._get_files_to_delete():
+                os.remove(f)
+
     def _get_files_to_delete(self):
         dirname, basename = os.path.split(self._filename)
         prefix = basename + "."
         plen = len(prefix)
+        ext = _COMPRESSIONS.get(self._compress)
 
         result = []
         for filename in os.listdir(dirname):
             if filename[:plen] == prefix:
                 suffix = filename[plen:]
+                if ext is not None and suffix.endswith(ext):
+                    suffix = suffix[:-len(ext)]
                 if self._ext_match.match(suffix):
                     result.append(os.path.join(dirname, filename))
         result.sort()
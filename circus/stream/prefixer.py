@@ -0,0 +1,163 @@
+import json
+import time
+from json.encoder import encode_basestring_ascii
+
+from circus.util import to_bytes
+
+
+class TimeFormatter(object):
+    """Format datetimes with *time_format*, caching the result for the
+    second being formatted, unless the format shows microseconds.
+    """
+    def __init__(self, time_format):
+        self.time_format = time_format
+        self._cacheable = '%f' not in time_format
+        self._key = None
+        self._text = None
+        self._bytes = None
+
+    def format(self, when):
+        if self._cacheable:
+            key = when.replace(microsecond=0)
+            if key == self._key:
+                return self._text
+            self._key = key
+        self._text = when.strftime(self.time_format)
+        self._bytes = None
+        return self._text
+
+    def format_bytes(self, when):
+        text = self.format(when)
+        if self._bytes is None:
+            self._bytes = text.encode('utf8')
+        return self._bytes
+
+
+class LineFramer(object):
+    """Cut the output in lines, and format them.
+
+    Works on bytes. A line cut at the end of a chunk is kept until the
+    rest of it comes with the next chunk of the same process, so it is
+    formatted once. Once a cut line grows over *max_carry* bytes it is
+    formatted anyway. The streams call :meth:`end` when the output of a
+    process ends, and :meth:`drain` with *carry_timeout* from time to time,
+    so the last line of a process which exits or pauses is not held back.
+    """
+    max_carry = 65536
+    carry_timeout = 1.
+
+    def __init__(self):
+        # key -> (data, cut line, time the line was cut)
+        self._carry = {}
+
+    @property
+    def carrying(self):
+        return bool(self._carry)
+
+    def _key(self, data):
+        return data.get('pid')
+
+    def format(self, data, lines, when):
+        """Return the formatted *lines*, which end with a newline."""
+        raise NotImplementedError()
+
+    def __call__(self, data, when):
+        """Return the complete lines of *data*, formatted."""
+        key = self._key(data)
+        chunk = to_bytes(data['data'])
+        carried = self._carry.pop(key, None)
+        if carried is not None:
+            chunk = carried[1] + chunk
+        end = chunk.rfind(b'\n') + 1
+        if len(chunk) - end >= self.max_carry:
+            chunk += b'\n'
+        elif end < len(chunk):
+            if carried is None or end > 0:
+                since = time.monotonic()
+            else:
+                # still the same line
+                since = carried[2]
+            self._carry[key] = data, chunk[end:], since
+            chunk = chunk[:end]
+        if not chunk:
+            return b''
+        return self.format(data, chunk, when)
+
+    def end(self, data, when):
+        """Return the cut line of the process of *data*, formatted, once
+        its output ended."""
+        carried = self._carry.pop(self._key(data), None)
+        if carried is None:
+            return b''
+        return self.format(carried[0], carried[1] + b'\n', when)
+
+    def drain(self, when, timeout=None):
+        """Return the cut lines waiting for their end, formatted, or only
+        the ones waiting for more than *timeout* seconds."""
+        if timeout is None:
+            keys = list(self._carry)
+        else:
+            limit = time.monotonic() - timeout
+            keys = [key for key, carried in self._carry.items()
+                    if carried[2] <= limit]
+        lines = []
+        for key in keys:
+            data, line, __ = self._carry.pop(key)
+            lines.append(self.format(data, line + b'\n', when))
+        return b''.join(lines)
+
+
+class LinePrefixer(LineFramer):
+    """Prefix each line of the output with the time and the pid."""
+
+    def __init__(self, time_format):
+        super(LinePrefixer, self).__init__()
+        self.formatter = TimeFormatter(time_format)
+
+    def prefix(self, data, when):
+        return b''.join((self.formatter.format_bytes(when), b' [',
+                         to_bytes(data.get('pid')), b'] | '))
+
+    def format(self, data, lines, when):
+        prefix = self.prefix(data, when)
+        # lines end with a newline, which is not followed by a prefix
+        return prefix + lines[:-1].replace(b'\n', b'\n' + prefix) + b'\n'
+
+
+class TaggedLinePrefixer(LinePrefixer):
+    """Prefix each line with the time, the watcher, the pid and the name
+    of the stream, for output of several watchers sharing a file.
+    """
+    def _key(self, data):
+        return data.get('watcher'), data.get('pid'), data.get('name')
+
+    def prefix(self, data, when):
+        return b''.join((self.formatter.format_bytes(when), b' ',
+                         to_bytes(data.get('watcher')), b' [',
+                         to_bytes(data.get('pid')), b'] ',
+                         to_bytes(data.get('name')), b' | '))
+
+
+class JSONLineFormatter(LineFramer):
+    """Format each line of the output as a JSON record holding the time
+    (a timestamp), the watcher, the wid, the pid, the stream and the line.
+    """
+    def _key(self, data):
+        return data.get('watcher'), data.get('pid'), data.get('name')
+
+    def format(self, data, lines, when):
+        meta = json.dumps({'time': when.timestamp(),
+                           'watcher': data.get('watcher'),
+                           'wid': data.get('wid'),
+                           'pid': data.get('pid'),
+                           'stream': data.get('name')})
+        # the metadata is encoded once for all the lines of the chunk,
+        # the lines with the C string encoder of the json module, and the
+        # whole chunk is joined and encoded at once
+        head = meta[:-1] + ', "data": '
+        parts = []
+        for line in lines[:-1].decode('utf8', 'replace').split('\n'):
+            parts.append(head)
+            parts.append(encode_basestring_ascii(line))
+            parts.append('}\n')
+        return ''.join(parts).encode('utf8')
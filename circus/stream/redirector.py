@@ -1,11 +1,47 @@
-import errno
 import os
-import sys
+import time
 
 from tornado import ioloop
 
 
+class TokenBucket(object):
+    """Allow *rate* units per second, in bursts of up to *burst* units."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = max(float(burst), 1.)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def available(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return int(self.tokens)
+
+    def consume(self, amount):
+        self.tokens -= amount
+
+
+def _cut_lines(data, size, lines):
+    """Return the size of the *lines* first lines of data[:size]."""
+    if data.count(b'\n', 0, size) <= lines:
+        return size
+    end = 0
+    for _ in range(lines):
+        end = data.index(b'\n', end) + 1
+    return end
+
+
+def _datamap(name, process, data):
+    return {'data': data, 'pid': process.pid, 'name': name,
+            'watcher': process.name, 'wid': process.wid}
+
+
 class Redirector(object):
+    # how many bytes a stream able to splice moves at once, the default
+    # capacity of a pipe
+    splice_size = 65536
 
     class Handler(object):
         def __init__(self, redirector, name, process, pipe):
@@ -13,36 +49,220 @@ class Redirector(object):
             self.name = name
             self.process = process
             self.pipe = pipe
+            # grows up to redirector.max_buffer while the pipe stays busy
+            self.read_size = redirector.buffer
 
         def __call__(self, fd, events):
             if not (events & ioloop.IOLoop.READ):
                 if events == ioloop.IOLoop.ERROR:
                     self.redirector.remove_fd(fd)
                 return
-            try:
-                data = os.read(fd, self.redirector.buffer)
-                if len(data) == 0:
-                    self.redirector.remove_fd(fd)
-                else:
-                    datamap = {'data': data, 'pid': self.process.pid,
-                               'name': self.name}
-                    self.redirector.redirect[self.name](datamap)
-            except IOError as ex:
-                if ex.args[0] != errno.EAGAIN:
-                    raise
+            redirector = self.redirector
+            stream = redirector.redirect[self.name]
+            splice = getattr(stream, 'splice', None)
+            opened = None
+            if splice is not None and not redirector.limited:
+                # file streams can move the data themselves
+                opened = self._drain_splice(fd, splice)
+            if opened is None:
+                chunks, opened = self._drain_read(fd)
+                data = b''.join(chunks)
+                if redirector.limited:
+                    data = redirector.limit(self, data)
+                if data:
+                    stream(self.datamap(data))
+            if not opened:
+                if redirector.limited:
+                    redirector.report(self, force=True)
+                redirector.remove_fd(fd)
+
+        def datamap(self, data):
+            return _datamap(self.name, self.process, data)
+
+        def _drain_read(self, fd):
+            """Read *fd* until it is empty or the budget is spent.
+
+            Return the chunks read and False if the pipe was closed.
+            """
+            redirector = self.redirector
+            chunks = []
+            total = 0
+            while total < redirector.budget:
                 try:
-                    sys.exc_clear()
-                except Exception:
-                    pass
+                    data = os.read(fd, self.read_size)
+                except BlockingIOError:
+                    break
+                if not data:
+                    return chunks, False
+                chunks.append(data)
+                total += len(data)
+                if len(data) == self.read_size:
+                    self.read_size = min(self.read_size * 2,
+                                         redirector.max_buffer)
+                    continue
+                if len(data) < self.read_size // 4:
+                    self.read_size = max(self.read_size // 2,
+                                         redirector.buffer)
+                # a short read means the pipe is empty
+                break
+            return chunks, True
+
+        def _drain_splice(self, fd, splice):
+            """Splice *fd* until it is empty or the budget is spent.
+
+            Return False if the pipe was closed, or None if the stream
+            can't splice.
+            """
+            redirector = self.redirector
+            total = 0
+            while total < redirector.budget:
+                try:
+                    moved = splice(fd, redirector.splice_size)
+                except BlockingIOError:
+                    break
+                if moved is None:
+                    return None if total == 0 else True
+                if moved == 0:
+                    return False
+                total += moved
+                if moved < redirector.splice_size:
+                    break
+            return True
 
     def __init__(self, stdout_redirect, stderr_redirect, buffer=1024,
-                 loop=None):
+                 loop=None, max_buffer=65536, budget=262144, **limits):
         self.running = False
         self.pipes = {}
         self._active = {}
         self.redirect = {'stdout': stdout_redirect, 'stderr': stderr_redirect}
+        # the read size starts at buffer and grows up to max_buffer, at
+        # most budget bytes are drained from a pipe before yielding to
+        # the other fds of the loop
         self.buffer = buffer
+        self.max_buffer = max(max_buffer, buffer)
+        self.budget = budget
         self.loop = loop or ioloop.IOLoop.current()
+        # (pid, stream name) -> [suppressed bytes, first suppression time,
+        # handler]
+        self._suppressed = {}
+        # reports the suppressed output of the processes gone quiet
+        self._reporter = None
+        self.set_limits(**limits)
+
+    def set_limits(self, output_rate=0, output_lines_rate=0,
+                   watcher_output_rate=0, watcher_output_lines_rate=0,
+                   output_burst=1., output_overflow='drop', notify=None,
+                   report_interval=1.):
+        """Limit the output rate of each process, and of all of them.
+
+        The rates are in bytes or lines per second, 0 meaning no limit. A
+        burst of *output_burst* seconds of output is allowed. The output
+        over the limits is dropped. With *output_overflow* set to sample,
+        a marker telling how many bytes were dropped is written to the
+        stream, and an output_suppressed event is sent with *notify*, at
+        most every *report_interval* seconds.
+
+        The lines rates only cut the output on newlines: a process writing
+        without newlines is not limited by them, only by the bytes rates.
+        """
+        if output_overflow not in ('drop', 'sample'):
+            raise ValueError('output_overflow should be drop or sample, '
+                             'not %r' % output_overflow)
+        # what was dropped under the previous limits is reported first
+        self._report_all(force=True)
+        self._stop_reporter()
+        self.output_rate = float(output_rate)
+        self.output_lines_rate = float(output_lines_rate)
+        self.output_burst = float(output_burst)
+        self.output_overflow = output_overflow
+        self.notify = notify
+        self.report_interval = report_interval
+        self._watcher_buckets = self._make_buckets(
+            float(watcher_output_rate), float(watcher_output_lines_rate))
+        self._process_buckets = {}
+        self.limited = bool(self.output_rate or self.output_lines_rate or
+                            self._watcher_buckets)
+        if self.running:
+            self._start_reporter()
+
+    def _make_buckets(self, rate, lines_rate):
+        buckets = []
+        if rate:
+            buckets.append((TokenBucket(rate, rate * self.output_burst),
+                            False))
+        if lines_rate:
+            buckets.append((TokenBucket(lines_rate,
+                                        lines_rate * self.output_burst),
+                            True))
+        return buckets
+
+    def limit(self, handler, data):
+        """Return the part of *data* within the rate limits."""
+        pid = handler.process.pid
+        buckets = self._process_buckets.get(pid)
+        if buckets is None:
+            buckets = self._process_buckets[pid] = self._make_buckets(
+                self.output_rate, self.output_lines_rate)
+        buckets = buckets + self._watcher_buckets
+        now = time.monotonic()
+        size = len(data)
+        for bucket, lines in buckets:
+            if lines:
+                size = _cut_lines(data, size, bucket.available(now))
+            else:
+                size = min(size, bucket.available(now))
+        kept = data[:size] if size < len(data) else data
+        nlines = None
+        for bucket, lines in buckets:
+            if lines:
+                if nlines is None:
+                    nlines = kept.count(b'\n')
+                bucket.consume(nlines)
+            else:
+                bucket.consume(size)
+        if size < len(data):
+            key = pid, handler.name
+            suppressed = self._suppressed.setdefault(key, [0, now, handler])
+            suppressed[0] += len(data) - size
+        self.report(handler, now=now)
+        return kept
+
+    def report(self, handler, now=None, force=False):
+        """Tell how much output of *handler* was dropped, if any, and if
+        *report_interval* passed since the first dropped byte."""
+        key = handler.process.pid, handler.name
+        suppressed = self._suppressed.get(key)
+        if suppressed is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        if not force and now - suppressed[1] < self.report_interval:
+            return
+        del self._suppressed[key]
+        if self.output_overflow != 'sample':
+            return
+        marker = '[circus] %d bytes suppressed\n' % suppressed[0]
+        self.redirect[handler.name](handler.datamap(marker.encode('utf8')))
+        if self.notify is not None:
+            self.notify('output_suppressed',
+                        {'pid': handler.process.pid, 'stream': handler.name,
+                         'bytes': suppressed[0], 'time': time.time()})
+
+    def _report_all(self, force=False):
+        now = time.monotonic()
+        for suppressed in list(self._suppressed.values()):
+            self.report(suppressed[2], now=now, force=force)
+
+    def _start_reporter(self):
+        if self.limited and self._reporter is None:
+            self._reporter = ioloop.PeriodicCallback(
+                self._report_all, self.report_interval * 1000)
+            self._reporter.start()
+
+    def _stop_reporter(self):
+        if self._reporter is not None:
+            self._reporter.stop()
+            self._reporter = None
 
     def _start_one(self, fd, stream_name, process, pipe):
         if fd not in self._active:
@@ -58,6 +278,7 @@ class Redirector(object):
             name, process, pipe = value
             count += self._start_one(fd, name, process, pipe)
         self.running = True
+        self._start_reporter()
         return count
 
     def _stop_one(self, fd):
@@ -72,6 +293,8 @@ class Redirector(object):
         for fd in list(self._active.keys()):
             count += self._stop_one(fd)
         self.running = False
+        self._report_all(force=True)
+        self._stop_reporter()
         return count
 
     @staticmethod
@@ -84,6 +307,8 @@ class Redirector(object):
     def add_redirections(self, process):
         for name, pipe in self.get_process_pipes(process):
             fd = pipe.fileno()
+            # the handler reads until the pipe is empty
+            os.set_blocking(fd, False)
             self._stop_one(fd)
             self.pipes[fd] = name, process, pipe
             if self.running:
@@ -93,7 +318,17 @@ class Redirector(object):
     def remove_fd(self, fd):
         self._stop_one(fd)
         if fd in self.pipes:
-            del self.pipes[fd]
+            name, process, __ = self.pipes.pop(fd)
+            # the streams holding back the last line of the process, which
+            # has no newline, write it now
+            end_output = getattr(self.redirect.get(name), 'end_output',
+                                 None)
+            if end_output is not None:
+                end_output(_datamap(name, process, b''))
+            if not any(other.pid == process.pid
+                       for __, other, __ in self.pipes.values()):
+                # the last pipe of the process is gone
+                self._forget_process(process)
 
     def remove_redirections(self, process):
         for _, pipe in self.get_process_pipes(process):
@@ -104,8 +339,15 @@ class Redirector(object):
                 pass
             else:
                 self.remove_fd(fileno)
+        self._forget_process(process)
         process.redirected = False
 
+    def _forget_process(self, process):
+        for key, suppressed in list(self._suppressed.items()):
+            if key[0] == process.pid:
+                self.report(suppressed[2], force=True)
+        self._process_buckets.pop(process.pid, None)
+
     def change_stream(self, stream_name, redirect_writer):
         self.redirect[stream_name] = redirect_writer
 
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from tornado.ioloop import IOLoop
+
+from circus.util import to_bytes
+
+
+class RingBufferStream(object):
+    """Keep the last *max_bytes* of output of each process in memory.
+
+    The buffers of the *max_processes* processes which wrote last are
+    kept, so the output of a process which died stays around until newer
+    processes take its place. The memory used is bounded by *max_bytes*
+    times *max_processes*.
+
+    The buffers are read with the ``tail`` command, which can also follow
+    the new output, published on the ``watcher.<name>.output`` topic. The
+    stream can be written from the thread of a ``ThreadedStream``.
+
+    Here is an example: ::
+
+      [watcher:foo]
+      cmd = python -m myapp.server
+      stdout_stream.class = RingBufferStream
+      stdout_stream.max_bytes = 131072
+    """
+    def __init__(self, max_bytes=65536, max_processes=16, **kwargs):
+        self.max_bytes = max(int(max_bytes), 1)
+        self.max_processes = max(int(max_processes), 1)
+        # pid -> [chunks, size], the process which wrote last at the end
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+        self._notify = None
+        self._follow_until = 0
+        # the loop the output is published from
+        self._loop = None
+
+    def __call__(self, data):
+        pid = data.get('pid')
+        chunk = to_bytes(data['data'])
+        with self._lock:
+            buffer = self._buffers.get(pid)
+            if buffer is None:
+                buffer = self._buffers[pid] = [deque(), 0]
+                while len(self._buffers) > self.max_processes:
+                    self._buffers.popitem(last=False)
+            else:
+                self._buffers.move_to_end(pid)
+
+            chunks = buffer[0]
+            chunks.append(chunk)
+            buffer[1] += len(chunk)
+            while buffer[1] > self.max_bytes:
+                excess = buffer[1] - self.max_bytes
+                if len(chunks[0]) <= excess:
+                    buffer[1] -= len(chunks.popleft())
+                else:
+                    chunks[0] = chunks[0][excess:]
+                    buffer[1] -= excess
+
+        notify = self._notify
+        if notify is not None:
+            if time.monotonic() >= self._follow_until:
+                self._notify = None
+                return
+            msg = {'pid': pid, 'stream': data.get('name'),
+                   'data': chunk.decode('utf8', 'replace'),
+                   'time': time.time()}
+            if IOLoop.current(instance=False) is self._loop:
+                notify('output', msg)
+            else:
+                # written from a ThreadedStream
+                self._loop.add_callback(notify, 'output', msg)
+
+    def tail(self, pid=None, size=None):
+        """Return a list of (pid, output) of the buffered processes, or of
+        *pid* only, with the last *size* bytes of their output if given.
+        """
+        with self._lock:
+            if pid is None:
+                pids = list(self._buffers)
+            elif pid in self._buffers:
+                pids = [pid]
+            else:
+                pids = []
+            output = [(pid, b''.join(self._buffers[pid][0]))
+                      for pid in pids]
+        if size is not None:
+            output = [(pid, data[-size:] if size else b'')
+                      for pid, data in output]
+        return output
+
+    def follow(self, notify, timeout):
+        """Call *notify* with the new output for the next *timeout*
+        seconds."""
+        self._loop = IOLoop.current()
+        self._notify = notify
+        self._follow_until = time.monotonic() + timeout
+
+    def close(self):
+        # the buffers are kept, to read the output of a stopped watcher
+        self._notify = None
@@ -0,0 +1,166 @@
+import threading
+from datetime import datetime
+
+from tornado.ioloop import IOLoop
+
+from circus.stream.prefixer import JSONLineFormatter, TaggedLinePrefixer
+
+
+class SharedSink(object):
+    """A file shared by all the SinkStream pointing to it.
+
+    The records are buffered, and written in one append, followed by a
+    single flush, once per loop iteration.
+    """
+    _sinks = {}
+    _sinks_lock = threading.Lock()
+
+    def __init__(self, filename, format='text',
+                 time_format='%Y-%m-%d %H:%M:%S'):
+        self.filename = filename
+        self.format = format
+        if format == 'json':
+            self.framer = JSONLineFormatter()
+        elif format == 'text':
+            self.framer = TaggedLinePrefixer(time_format)
+        else:
+            raise ValueError('format should be text or json, not %r'
+                             % format)
+        self.users = 0
+        self._file = open(filename, 'ab')
+        self._records = []
+        self._scheduled = False
+        # writes the cut lines which waited too long, (loop, timeout)
+        self._carry_timer = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, filename, **options):
+        """Return the sink writing to *filename*, opened if needed."""
+        with cls._sinks_lock:
+            sink = cls._sinks.get(filename)
+            if sink is None:
+                sink = cls._sinks[filename] = cls(filename, **options)
+            sink.users += 1
+            return sink
+
+    def release(self):
+        """Forget a user of the sink, closed once it has no users."""
+        with self._sinks_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            del self._sinks[self.filename]
+        if self._carry_timer is not None:
+            loop, timeout = self._carry_timer
+            loop.remove_timeout(timeout)
+            self._carry_timer = None
+        self.flush(drain=True)
+        self._file.close()
+
+    def write(self, data, when):
+        self._add(self.framer, data, when)
+
+    def end(self, data, when):
+        """Write the last line of the process of *data*, whose output
+        ended, even if it has no newline."""
+        self._add(self.framer.end, data, when)
+
+    def _add(self, frame, data, when):
+        with self._lock:
+            record = frame(data, when)
+            loop = IOLoop.current(instance=False)
+            if loop is None:
+                # out of the loop, e.g. in a ThreadedStream, which
+                # flushes each time it runs out of output
+                if record:
+                    self._records.append(record)
+                return
+            if self.framer.carrying and self._carry_timer is None:
+                self._start_carry_timer(loop)
+            if not record:
+                return
+            self._records.append(record)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        loop.add_callback(self.flush)
+
+    def _start_carry_timer(self, loop):
+        timeout = loop.call_later(self.framer.carry_timeout,
+                                  self._carry_timed_out)
+        self._carry_timer = loop, timeout
+
+    def _carry_timed_out(self):
+        loop, __ = self._carry_timer
+        self._carry_timer = None
+        self.flush()
+        if self.framer.carrying:
+            self._start_carry_timer(loop)
+
+    def flush(self, drain=False):
+        with self._lock:
+            self._scheduled = False
+            if drain:
+                self._records.append(self.framer.drain(datetime.now()))
+            elif self.framer.carrying:
+                self._records.append(self.framer.drain(
+                    datetime.now(), self.framer.carry_timeout))
+            records, self._records = self._records, []
+            if records:
+                self._file.write(b''.join(records))
+                self._file.flush()
+
+
+class SinkStream(object):
+    """Write the output of many watchers to a single shared file.
+
+    All the SinkStream with the same *filename* share one file descriptor
+    and write their records together, once per loop iteration. Each line
+    is tagged with the watcher, the pid and the stream name, in text
+    (prefixed by *time_format*) or, with *format* set to json, as JSON
+    lines.
+
+    The options of the first stream opening the file are used.
+
+    Here is an example: ::
+
+      [watcher:foo]
+      cmd = python -m myapp.server
+      stdout_stream.class = SinkStream
+      stdout_stream.filename = /var/log/circus/all.log
+      stdout_stream.format = json
+    """
+    now = datetime.now
+    fromtimestamp = datetime.fromtimestamp
+
+    def __init__(self, filename, format='text',
+                 time_format='%Y-%m-%d %H:%M:%S', **kwargs):
+        self._options = {'format': format, 'time_format': time_format}
+        self._filename = filename
+        self.sink = SharedSink.acquire(filename, **self._options)
+
+    def _time(self, data):
+        if 'timestamp' in data:
+            return self.fromtimestamp(data['timestamp'])
+        return self.now()
+
+    def __call__(self, data):
+        self.sink.write(data, self._time(data))
+
+    def end_output(self, data):
+        if self.sink is not None:
+            self.sink.end(data, self._time(data))
+
+    def flush(self):
+        if self.sink is not None:
+            self.sink.flush()
+
+    def open(self):
+        if self.sink is None:
+            self.sink = SharedSink.acquire(self._filename, **self._options)
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.release()
+            self.sink = None
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import deque
+
+from circus import logger
+from circus.fixed_threading import Thread
+
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+_OVERFLOWS = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class ThreadedStream(object):
+    """Hand the output over to *stream* from a dedicated writer thread.
+
+    The chunks wait in a queue of at most *queue_size* entries, so a slow
+    disk never delays the circusd loop. When the queue is full, *overflow*
+    tells what to do:
+
+    - **block**: wait for the writer thread to make room (default)
+    - **drop_oldest**: forget the oldest chunk waiting in the queue
+    - **drop_newest**: forget the new chunk
+
+    The number of forgotten chunks is kept in *dropped*. Each time the
+    queue runs empty, and every *idle_flush* seconds while it stays empty,
+    the stream is flushed, if it has a flush method.
+    """
+    idle_flush = 1.
+
+    def __init__(self, stream, queue_size=1024, overflow=BLOCK):
+        if overflow not in _OVERFLOWS:
+            raise ValueError('overflow should be one of %s, not %r'
+                             % (', '.join(_OVERFLOWS), overflow))
+        self.stream = stream
+        self.queue_size = max(int(queue_size), 1)
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = None
+
+    def __call__(self, data):
+        self._put(self.stream, data)
+
+    def end_output(self, data):
+        end_output = getattr(self.stream, 'end_output', None)
+        if end_output is not None:
+            self._put(end_output, data)
+
+    def _put(self, write, data):
+        # the output is timestamped when it is captured, not when the
+        # writer thread gets to it
+        data.setdefault('timestamp', time.time())
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                if self.overflow == DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                elif self.overflow == DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._queue) >= self.queue_size and \
+                            self._thread is not None:
+                        self._cond.wait()
+            self._queue.append((write, data))
+            self._cond.notify_all()
+            if self._thread is None:
+                self._thread = Thread(target=self._run,
+                                      name='circus-stream-writer')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        flush = getattr(self.stream, 'flush', None)
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    if not self._cond.wait(self.idle_flush):
+                        # flush what the stream holds back
+                        break
+                if not self._queue and self._closing:
+                    return
+                batch = list(self._queue)
+                self._queue.clear()
+                self._cond.notify_all()
+            for write, data in batch:
+                try:
+                    write(data)
+                except Exception:
+                    logger.exception('Could not write to %r', self.stream)
+            if flush is not None and not self._queue:
+                try:
+                    flush()
+                except Exception:
+                    logger.exception('Could not flush %r', self.stream)
+
+    def open(self):
+        if hasattr(self.stream, 'open'):
+            self.stream.open()
+
+    def close(self):
+        """Write what is left in the queue, then close the stream."""
+        with self._cond:
+            thread = self._thread
+            self._closing = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+        with self._cond:
+            self._thread = None
+            self._closing = False
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
@@ -28,7 +28,7 @@ except ImportError:
     pwd = None
 from tornado import gen
 from tornado import concurrent
-from tornado.ioloop import PeriodicCallback
+from tornado.ioloop import IOLoop, PeriodicCallback
 
 from configparser import (
     RawConfigParser, MissingSectionHeaderError, ParsingError, DEFAULTSECT
@@ -1017,38 +1017,117 @@ def dict_differ(dict1, dict2):
     return len(DictDiffer(dict1, dict2).changed()) > 0
 
 
-def _synchronized_cb(arbiter, future):
-    if arbiter is not None:
+def _lock_owners(obj):
+    """Return the (arbiter, watcher) couple locked by a method of *obj*.
+
+    Watchers are locked one by one, the arbiter is locked as a whole.
+    """
+    if hasattr(obj, "arbiter"):
+        if obj.arbiter is None:
+            return None, None
+        return obj.arbiter, obj
+    if hasattr(obj, "_exclusive_running_command"):
+        return obj, None
+    return None, None
+
+
+def _lock_conflict(arbiter, watcher, exclusive):
+    """Return why the lock can't be taken, or None if it is free."""
+    if arbiter._exclusive_running_command is not None:
+        return ("arbiter is already running %s command"
+                % arbiter._exclusive_running_command)
+    if watcher is not None:
+        watchers = [watcher]
+    elif exclusive:
+        watchers = arbiter.watchers
+    else:
+        watchers = []
+    for busy in watchers:
+        command = getattr(busy, "_running_command", None)
+        if command is not None:
+            return ("watcher %s is already running %s command"
+                    % (busy.name, command))
+    return None
+
+
+def _release_lock(arbiter, watcher):
+    if watcher is None:
         arbiter._exclusive_running_command = None
+    else:
+        watcher._running_command = None
+    released = getattr(arbiter, "_lock_released", None)
+    if released is not None:
+        released.notify_all()
 
 
-def synchronized(name):
+def _synchronized_cb(arbiter, watcher, future):
+    _release_lock(arbiter, watcher)
+
+
+def _call_locked(name, f, obj, arbiter, watcher, args, kwargs):
+    if watcher is None:
+        arbiter._exclusive_running_command = name
+    else:
+        watcher._running_command = name
+    resp = None
+    try:
+        resp = f(obj, *args, **kwargs)
+    finally:
+        if isinstance(resp, concurrent.Future):
+            cb = functools.partial(_synchronized_cb, arbiter, watcher)
+            concurrent.future_add_done_callback(resp, cb)
+        else:
+            _release_lock(arbiter, watcher)
+    return resp
+
+
+@gen.coroutine
+def _call_queued(name, f, obj, arbiter, watcher, exclusive, args, kwargs):
+    deadline = IOLoop.current().time() + arbiter.lock_timeout
+    while True:
+        if arbiter._restarting:
+            raise ConflictError("arbiter is restarting...")
+        conflict = _lock_conflict(arbiter, watcher, exclusive)
+        if conflict is None:
+            break
+        released = yield arbiter._lock_released.wait(deadline)
+        if not released:
+            raise ConflictError(conflict)
+    resp = yield _call_locked(name, f, obj, arbiter, watcher, args, kwargs)
+    raise gen.Return(resp)
+
+
+def synchronized(name, exclusive=True):
+    """Run the decorated method while holding a lock.
+
+    A method of a watcher locks that watcher only, so commands on
+    different watchers run concurrently. A method of the arbiter locks
+    the whole arbiter: it conflicts with any running command, unless
+    *exclusive* is False, in which case busy watchers are not waited for
+    and the method is expected to leave them alone.
+
+    When the lock is busy a ConflictError is raised, or, for coroutines
+    and if the arbiter has a *lock_timeout*, the call is queued until
+    the lock is released or the timeout expires.
+    """
     def real_decorator(f):
+        coroutine = gen.is_coroutine_function(f)
+
         @wraps(f)
         def wrapper(self, *args, **kwargs):
-            arbiter = None
-            if hasattr(self, "arbiter"):
-                arbiter = self.arbiter
-            elif hasattr(self, "_exclusive_running_command"):
-                arbiter = self
-            if arbiter is not None:
-                if arbiter._restarting:
-                    raise ConflictError("arbiter is restarting...")
-                if arbiter._exclusive_running_command is not None:
-                    raise ConflictError("arbiter is already running %s command"
-                                        % arbiter._exclusive_running_command)
-                arbiter._exclusive_running_command = name
-            resp = None
-            try:
-                resp = f(self, *args, **kwargs)
-            finally:
-                if isinstance(resp, concurrent.Future):
-                    cb = functools.partial(_synchronized_cb, arbiter)
-                    concurrent.future_add_done_callback(resp, cb)
-                else:
-                    if arbiter is not None:
-                        arbiter._exclusive_running_command = None
-            return resp
+            arbiter, watcher = _lock_owners(self)
+            if arbiter is None:
+                return f(self, *args, **kwargs)
+            if arbiter._restarting:
+                raise ConflictError("arbiter is restarting...")
+            conflict = _lock_conflict(arbiter, watcher, exclusive)
+            if conflict is not None:
+                if coroutine and getattr(arbiter, "lock_timeout", 0) > 0:
+                    return _call_queued(name, f, self, arbiter, watcher,
+                                        exclusive, args, kwargs)
+                raise ConflictError(conflict)
+            return _call_locked(name, f, self, arbiter, watcher, args,
+                                kwargs)
         return wrapper
     return real_decorator
 
@@ -13,8 +13,9 @@ from psutil import NoSuchProcess, TimeoutExpired
 import zmq.utils.jsonapi as json
 from tornado import ioloop
 
-from circus.process import Process, DEAD_OR_ZOMBIE, UNEXISTING
+from circus.process import Process, RUNNING, DEAD_OR_ZOMBIE, UNEXISTING
 from circus import logger
+from circus import readiness
 from circus import util
 from circus.stream import get_stream, Redirector
 from circus.util import parse_env_dict, resolve_name, tornado_sleep, IS_WINDOWS
@@ -182,6 +183,42 @@ class Watcher(object):
 
     - **close_child_stderr**: If True, closes the stderr after the fork.
       default: False.
+
+    - **spawn_concurrency**: how many processes are started at once. The
+      watcher waits for the **readiness_probe** (or **warmup_delay**)
+      between two batches. 0 starts all the processes at once.
+      default: 1.
+
+    - **readiness_probe**: If not None, tells when a new process is ready.
+      Either an url -- *tcp://host:port*, *unix:///path*, *http://...* or
+      *file:///path* -- which may contain *$(circus.wid)* and
+      *$(circus.pid)*, or the name of a callable receiving the watcher and
+      the process. It replaces **warmup_delay** when spawning processes.
+      default: None.
+
+    - **readiness_timeout**: how long (in seconds) a new process has to
+      pass the **readiness_probe**. default: 10.
+
+    - **max_surge**: during a graceful reload, how many processes can run
+      on top of **numprocesses**. Along with **max_unavailable**, enables
+      the rolling reload. default: 0.
+
+    - **max_unavailable**: during a graceful reload, how many processes
+      can be missing from **numprocesses**. default: 0.
+
+    - **output_rate**, **output_lines_rate**: the most bytes, and lines,
+      per second each process can write on its redirected outputs. The
+      rest is dropped. default: 0 (no limit).
+
+    - **watcher_output_rate**, **watcher_output_lines_rate**: the same,
+      for all the processes of the watcher. default: 0 (no limit).
+
+    - **output_burst**: how many seconds worth of output are allowed at
+      once above the rates. default: 1.
+
+    - **output_overflow**: *drop* to silently drop the output over the
+      rates, or *sample* to write a marker telling how many bytes were
+      dropped and send an *output_suppressed* event. default: drop.
     """
 
     def __init__(self, name, cmd, args=None, numprocesses=1, warmup_delay=0.,
@@ -196,7 +233,12 @@ class Watcher(object):
                  autostart=True, on_demand=False, virtualenv=None,
                  stdin_socket=None, close_child_stdin=True,
                  close_child_stdout=False,
-                 close_child_stderr=False, virtualenv_py_ver=None, **options):
+                 close_child_stderr=False, virtualenv_py_ver=None,
+                 spawn_concurrency=1, readiness_probe=None,
+                 readiness_timeout=10., max_surge=0, max_unavailable=0,
+                 output_rate=0, output_lines_rate=0, watcher_output_rate=0,
+                 watcher_output_lines_rate=0, output_burst=1.,
+                 output_overflow='drop', **options):
         self.name = name
         self.use_sockets = use_sockets
         self.on_demand = on_demand
@@ -234,6 +276,18 @@ class Watcher(object):
         self.close_child_stdin = close_child_stdin
         self.close_child_stdout = close_child_stdout
         self.close_child_stderr = close_child_stderr
+        self.spawn_concurrency = int(spawn_concurrency)
+        self.readiness_probe = readiness_probe
+        self.readiness = readiness.get_probe(readiness_probe)
+        self.readiness_timeout = float(readiness_timeout)
+        self.max_surge = int(max_surge)
+        self.max_unavailable = int(max_unavailable)
+        self.output_rate = float(output_rate)
+        self.output_lines_rate = float(output_lines_rate)
+        self.watcher_output_rate = float(watcher_output_rate)
+        self.watcher_output_lines_rate = float(watcher_output_lines_rate)
+        self.output_burst = float(output_burst)
+        self.output_overflow = output_overflow
         self.loop = loop or ioloop.IOLoop.current()
 
         if singleton and self.numprocesses not in (0, 1):
@@ -265,7 +319,12 @@ class Watcher(object):
                           "stdout_stream_conf", "on_demand",
                           "stderr_stream_conf", "max_age", "max_age_variance",
                           "close_child_stdin", "close_child_stdout",
-                          "close_child_stderr") +
+                          "close_child_stderr", "spawn_concurrency",
+                          "readiness_probe", "readiness_timeout",
+                          "max_surge", "max_unavailable", "output_rate",
+                          "output_lines_rate", "watcher_output_rate",
+                          "watcher_output_lines_rate", "output_burst",
+                          "output_overflow") +
                          tuple(options.keys()))
 
         if not working_dir:
@@ -274,6 +333,8 @@ class Watcher(object):
 
         self.working_dir = working_dir
         self.processes = {}
+        # name of the synchronized command running on this watcher
+        self._running_command = None
         self.shell = shell
         self.shell_args = shell_args
         self.uid = uid
@@ -344,7 +405,8 @@ class Watcher(object):
             self.stream_redirector.change_stream(stream_type, new_stream)
         else:
             self.stream_redirector = self._redirector_class(
-                self.stdout_stream, self.stderr_stream, loop=self.loop)
+                self.stdout_stream, self.stderr_stream, loop=self.loop,
+                **self._output_limits())
 
         if old_stream:
             if hasattr(old_stream, 'close'):
@@ -359,10 +421,20 @@ class Watcher(object):
             if self.stream_redirector:
                 self.stream_redirector.stop()
             self.stream_redirector = self._redirector_class(
-                self.stdout_stream, self.stderr_stream, loop=self.loop)
+                self.stdout_stream, self.stderr_stream, loop=self.loop,
+                **self._output_limits())
         else:
             self.stream_redirector = None
 
+    def _output_limits(self):
+        return {'output_rate': self.output_rate,
+                'output_lines_rate': self.output_lines_rate,
+                'watcher_output_rate': self.watcher_output_rate,
+                'watcher_output_lines_rate': self.watcher_output_lines_rate,
+                'output_burst': self.output_burst,
+                'output_overflow': self.output_overflow,
+                'notify': self.notify_event}
+
     def _resolve_hook(self, name, callable_or_name, ignore_failure,
                       reload_module=False):
         if callable(callable_or_name):
@@ -423,57 +495,72 @@ class Watcher(object):
         if self.evpub_socket is not None and not self.evpub_socket.closed:
             self.evpub_socket.send_multipart(multipart_msg)
 
+    def _add_process(self, process):
+        self.processes[process.pid] = process
+        if self.arbiter is not None:
+            self.arbiter.register_process(self, process)
+
+    def _remove_process(self, pid):
+        process = self.processes.pop(pid, None)
+        if self.arbiter is not None:
+            self.arbiter.unregister_process(self, pid)
+        return process
+
     @util.debuglog
     def reap_process(self, pid, status=None):
-        """ensure that the process is killed (and not a zombie)"""
-        if pid not in self.processes:
-            return
-
-        # We ignore the hook result
-        self.call_hook("before_reap", process_pid=pid, time=time.time())
+        """ensure that the process is killed (and not a zombie)
 
-        process = self.processes.pop(pid)
+        This never blocks: a process which is still running is kept
+        and will be reaped by a later pass. Return True if the process
+        has been reaped.
+        """
+        if pid not in self.processes:
+            return False
 
-        timeout = 0.001
+        process = self.processes[pid]
 
-        while status is None:
+        if status is None:
             if IS_WINDOWS:
                 try:
                     # On Windows we can't use waitpid as it's blocking,
                     # so we use psutils' wait
-                    status = process.wait(timeout=timeout)
+                    status = process.wait(timeout=0)
                 except TimeoutExpired:
-                    continue
+                    return False
             else:
                 try:
                     resulting_pid, status = os.waitpid(pid, os.WNOHANG)
                     if (resulting_pid, status) == (0, 0):
-                        status = None
-                        time.sleep(timeout)
-                        continue
+                        # still running, defer to the next reap pass
+                        return False
                 except OSError as e:
                     if e.errno == errno.ECHILD:
                         status = None
                     else:
                         raise
 
-            if status is None:
-                # nothing to do here, we do not have any child
-                # process running
-                # but we still need to send the "reap" signal.
-                #
-                # This can happen if poll() or wait() were called on
-                # the underlying process.
-                logger.debug('reaping already dead process %s [%s]',
-                             pid, self.name)
-                msg = {"process_pid": pid,
-                       "time": time.time(),
-                       "exit_code": process.returncode()}
-                self.notify_event("reap", msg)
-                process.stop()
-                # We ignore the hook result
-                self.call_hook("after_reap", process_status=None, **msg)
-                return
+        # We ignore the hook result
+        self.call_hook("before_reap", process_pid=pid, time=time.time())
+
+        self._remove_process(pid)
+
+        if status is None:
+            # nothing to do here, we do not have any child
+            # process running
+            # but we still need to send the "reap" signal.
+            #
+            # This can happen if poll() or wait() were called on
+            # the underlying process.
+            logger.debug('reaping already dead process %s [%s]',
+                         pid, self.name)
+            msg = {"process_pid": pid,
+                   "time": time.time(),
+                   "exit_code": process.returncode()}
+            self.notify_event("reap", msg)
+            process.stop()
+            # We ignore the hook result
+            self.call_hook("after_reap", process_status=None, **msg)
+            return True
 
         # get return code
         if hasattr(os, 'WIFSIGNALED'):
@@ -500,6 +587,7 @@ class Watcher(object):
             exit_code = status
 
         # if the process is dead or a zombie try to definitely stop it.
+        process.invalidate_status()
         process_status = process.status
         if process_status in (DEAD_OR_ZOMBIE, UNEXISTING):
             process.stop()
@@ -511,18 +599,61 @@ class Watcher(object):
         self.notify_event("reap", msg)
         # We ignore the hook result
         self.call_hook("after_reap", process_status=process_status, **msg)
+        return True
 
     @util.debuglog
     def reap_processes(self):
-        """Reap all the processes for this watcher.
+        """Reap all the dead processes for this watcher.
+
+        Return the number of reaped processes.
         """
         if self.is_stopped():
             logger.debug('do not reap processes as the watcher is stopped')
-            return
+            return 0
 
         # reap_process changes our dict, look through the copy of keys
+        reaped = 0
+        for pid in list(self.processes.keys()):
+            if self.reap_process(pid):
+                reaped += 1
+        return reaped
+
+    @gen.coroutine
+    def _wait_reap_processes(self, timeout=None):
+        """Reap all the processes, waiting for the ones still exiting
+        without blocking the loop, for at most *timeout* seconds
+        (graceful_timeout by default).
+
+        The processes still there are then killed, and forgotten if they
+        are not reaped within a second.
+        """
+        if timeout is None:
+            timeout = self.graceful_timeout
+        killed = False
+        deadline = time.monotonic() + timeout
+        self.reap_processes()
+        while self.processes:
+            if time.monotonic() >= deadline:
+                if killed:
+                    break
+                killed = True
+                deadline = time.monotonic() + 1.
+                for process in list(self.processes.values()):
+                    logger.warning('%s: process %s is still there, killing '
+                                   'it', self.name, process.pid)
+                    if hasattr(signal, 'SIGKILL'):
+                        try:
+                            self.send_signal_process(process, signal.SIGKILL,
+                                                     recursive=True)
+                        except (NoSuchProcess, OSError):
+                            pass
+            yield tornado_sleep(0.01)
+            self.reap_processes()
+
         for pid in list(self.processes.keys()):
-            self.reap_process(pid)
+            logger.error('%s: could not reap process %s, forgetting it',
+                         self.name, pid)
+            self._remove_process(pid).stop()
 
     @gen.coroutine
     @util.debuglog
@@ -534,7 +665,7 @@ class Watcher(object):
         # remove dead or zombie processes first
         for process in list(self.processes.values()):
             if process.status in (DEAD_OR_ZOMBIE, UNEXISTING):
-                self.processes.pop(process.pid)
+                self._remove_process(process.pid)
 
         if self.max_age:
             yield self.remove_expired_processes()
@@ -553,7 +684,7 @@ class Watcher(object):
                                   key=lambda process: process.started,
                                   reverse=True)[self.numprocesses:]:
                 if process.status in (DEAD_OR_ZOMBIE, UNEXISTING):
-                    self.processes.pop(process.pid)
+                    self._remove_process(process.pid)
                 else:
                     processes_to_kill.append(process)
 
@@ -561,7 +692,7 @@ class Watcher(object):
                              for process in processes_to_kill]
             for i, process in enumerate(processes_to_kill):
                 if removes[i]:
-                    self.processes.pop(process.pid)
+                    self._remove_process(process.pid)
 
     @gen.coroutine
     @util.debuglog
@@ -572,7 +703,7 @@ class Watcher(object):
         removes = yield [self.kill_process(x) for x in expired_processes]
         for i, process in enumerate(expired_processes):
             if removes[i]:
-                self.processes.pop(process.pid)
+                self._remove_process(process.pid)
 
     @gen.coroutine
     @util.debuglog
@@ -598,6 +729,10 @@ class Watcher(object):
             yield tornado_sleep(0)
         self._found_wids = {}
 
+        if self.spawn_concurrency != 1 or self.readiness is not None:
+            yield self._spawn_batches()
+            return
+
         for i in range(self.numprocesses - len(self.processes)):
             res = self.spawn_process()
             if res is False:
@@ -610,6 +745,50 @@ class Watcher(object):
                     delay = 0
             yield tornado_sleep(delay)
 
+    @gen.coroutine
+    def _spawn_batches(self):
+        """Spawn the missing processes by batches of spawn_concurrency,
+        waiting for the readiness probe or the warmup delay in between.
+        """
+        to_spawn = self.numprocesses - len(self.processes)
+        while to_spawn > 0:
+            batch = to_spawn
+            if self.spawn_concurrency > 0:
+                batch = min(batch, self.spawn_concurrency)
+            before = set(self.processes)
+            start = time.time()
+            for i in range(batch):
+                if self.spawn_process() is False:
+                    yield self._stop()
+                    return
+            to_spawn -= batch
+
+            if self.readiness is not None:
+                spawned = [process for pid, process in self.processes.items()
+                           if pid not in before]
+                yield self.wait_ready(spawned)
+            else:
+                delay = max(self.warmup_delay - (time.time() - start), 0)
+                yield tornado_sleep(delay)
+
+    @gen.coroutine
+    def wait_ready(self, processes):
+        """Wait for *processes* to pass the readiness probe.
+
+        Return the processes which are not ready after readiness_timeout.
+        """
+        if self.readiness is None:
+            raise gen.Return([])
+        results = yield [readiness.wait_ready(self.readiness, self, process,
+                                              self.readiness_timeout)
+                         for process in processes]
+        not_ready = [process for process, ready in zip(processes, results)
+                     if not ready]
+        for process in not_ready:
+            logger.warning('%s: process %s is not ready after %ss',
+                           self.name, process.pid, self.readiness_timeout)
+        raise gen.Return(not_ready)
+
     def _get_sockets_fds(self):
         # XXX should be cached
         if self.sockets is None:
@@ -666,12 +845,12 @@ class Watcher(object):
                 if self.stream_redirector:
                     self.stream_redirector.add_redirections(process)
 
-                self.processes[process.pid] = process
+                self._add_process(process)
                 logger.debug('running %s process [pid %d]', self.name,
                              process.pid)
                 if not self.call_hook('after_spawn', pid=process.pid):
                     self.kill_process(process)
-                    del self.processes[process.pid]
+                    self._remove_process(process.pid)
                     return False
 
             # catch ValueError as well, as a misconfigured rlimit setting could
@@ -742,13 +921,8 @@ class Watcher(object):
             raise gen.Return(False)
 
         process.stopping = True
-        waited = 0
-        while waited < graceful_timeout:
-            if not process.is_alive():
-                break
-            yield tornado_sleep(0.1)
-            waited += 0.1
-        if waited >= graceful_timeout:
+        exited = yield self._wait_for_exit(process, graceful_timeout)
+        if not exited:
             # On Windows we can't send a SIGKILL signal, but the
             # process.stop function will terminate the process
             # later anyway
@@ -762,6 +936,37 @@ class Watcher(object):
         process.stop()
         raise gen.Return(True)
 
+    def _exits_notified(self):
+        # the arbiter is told about the exits by SIGCHLD
+        arbiter = self.arbiter
+        return (arbiter is not None and arbiter.ctrl is not None and
+                arbiter.ctrl.sys_hdl.handles_chld is True)
+
+    @gen.coroutine
+    def _wait_for_exit(self, process, timeout):
+        """Return True if *process* exits within *timeout* seconds."""
+        if not self._exits_notified():
+            waited = 0
+            while waited < timeout:
+                if not process.is_alive():
+                    raise gen.Return(True)
+                yield tornado_sleep(0.1)
+                waited += 0.1
+            raise gen.Return(False)
+
+        waiters = self.arbiter._exit_waiters
+        waiters[process.pid] = process
+        try:
+            # the process may be gone before it was registered
+            if process.is_alive():
+                yield gen.with_timeout(self.loop.time() + timeout,
+                                       process.exit_future())
+        except gen.TimeoutError:
+            raise gen.Return(not process.is_alive())
+        finally:
+            waiters.pop(process.pid, None)
+        raise gen.Return(True)
+
     @gen.coroutine
     @util.debuglog
     def kill_processes(self, stop_signal=None, graceful_timeout=None):
@@ -855,7 +1060,7 @@ class Watcher(object):
         # We ignore the hook result
         self.call_hook('before_stop')
         yield self.kill_processes()
-        self.reap_processes()
+        yield self._wait_reap_processes()
 
         # stop redirectors
         if self.stream_redirector:
@@ -1027,6 +1232,10 @@ class Watcher(object):
                     self.reap_process(process.pid)
                     self.spawn_process()
                     yield tornado_sleep(self.warmup_delay)
+            elif self.max_surge > 0 or self.max_unavailable > 0:
+                reloaded = yield self._rolling_reload()
+                if not reloaded:
+                    return
             else:
                 for i in range(self.numprocesses):
                     self.spawn_process()
@@ -1034,6 +1243,58 @@ class Watcher(object):
         self.notify_event("reload", {"time": time.time()})
         logger.info('%s reloaded', self.name)
 
+    @gen.coroutine
+    def _rolling_reload(self):
+        """Replace the processes by batches, running at most max_surge
+        processes on top of numprocesses and at most max_unavailable
+        processes below it.
+
+        The next batch is started once the new processes are ready. If
+        they are not, they are killed and the reload is aborted: the
+        remaining old processes are kept. Return True if all the
+        processes have been replaced.
+        """
+        old_processes = sorted(self.get_active_processes(),
+                               key=lambda process: process.started)
+        step = max(self.max_surge + self.max_unavailable, 1)
+        while old_processes:
+            batch = old_processes[:step]
+            old_processes = old_processes[step:]
+
+            # free the slots we are allowed to miss first
+            yield self._kill_and_remove(batch[:self.max_unavailable])
+
+            before = set(self.processes)
+            for i in range(len(batch)):
+                if self.spawn_process() is False:
+                    logger.error('%s: reload aborted, spawn failed',
+                                 self.name)
+                    raise gen.Return(False)
+            spawned = [process for pid, process in self.processes.items()
+                       if pid not in before]
+
+            if self.readiness is not None:
+                not_ready = yield self.wait_ready(spawned)
+            else:
+                yield tornado_sleep(self.warmup_delay)
+                not_ready = [process for process in spawned
+                             if process.status != RUNNING]
+            if not_ready:
+                logger.error('%s: reload aborted, %d new processes are '
+                             'not ready', self.name, len(not_ready))
+                yield self._kill_and_remove(not_ready)
+                raise gen.Return(False)
+
+            yield self._kill_and_remove(batch[self.max_unavailable:])
+        raise gen.Return(True)
+
+    @gen.coroutine
+    def _kill_and_remove(self, processes):
+        removes = yield [self.kill_process(process) for process in processes]
+        for i, process in enumerate(processes):
+            if removes[i]:
+                self._remove_process(process.pid)
+
     @gen.coroutine
     def set_numprocesses(self, np):
         if np < 0:
@@ -1118,6 +1379,26 @@ class Watcher(object):
         elif key == "max_age_variance":
             self.max_age_variance = int(val)
             action = 1
+        elif key == "spawn_concurrency":
+            self.spawn_concurrency = int(val)
+        elif key == "readiness_probe":
+            self.readiness = readiness.get_probe(val)
+            self.readiness_probe = val
+        elif key == "readiness_timeout":
+            self.readiness_timeout = float(val)
+        elif key == "max_surge":
+            self.max_surge = int(val)
+        elif key == "max_unavailable":
+            self.max_unavailable = int(val)
+        elif key in ("output_rate", "output_lines_rate",
+                     "watcher_output_rate", "watcher_output_lines_rate",
+                     "output_burst", "output_overflow"):
+            if key == "output_overflow":
+                self.output_overflow = val
+            else:
+                setattr(self, key, float(val))
+            if self.stream_redirector:
+                self.stream_redirector.set_limits(**self._output_limits())
         elif (key.startswith('stdout_stream') or
               key.startswith('stderr_stream')):
             action = self._reload_stream(key, val)
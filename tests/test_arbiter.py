@@ -2,6 +2,7 @@ import os
 import signal
 import socket
 import tornado
+from tornado import gen
 from tempfile import mkstemp
 from time import time
 import zmq.utils.jsonapi as json
@@ -15,7 +16,8 @@ from circus.plugins import CircusPlugin
 from tests.support import (TestCircus, async_poll_for, truncate_file,
                            skipIf, get_ioloop, SLEEP, PYTHON)
 from circus.util import (DEFAULT_ENDPOINT_DEALER, DEFAULT_ENDPOINT_MULTICAST,
-                         DEFAULT_ENDPOINT_SUB, to_str, IS_WINDOWS)
+                         DEFAULT_ENDPOINT_SUB, to_str, IS_WINDOWS,
+                         tornado_sleep)
 from tests.support import (MockWatcher, has_circusweb,
                                   poll_for_callable, get_available_port)
 from circus import watcher as watcher_mod
@@ -702,6 +704,105 @@ class TestArbiter(TestCircus):
         finally:
             yield arbiter.stop()
 
+    @tornado.testing.gen_test
+    def test_reload_by_tier(self):
+        events = []
+
+        class TierWatcher(object):
+            def __init__(self, name, priority):
+                self.name = name
+                self.priority = priority
+
+            @gen.coroutine
+            def _reload(self, graceful=True, sequential=False):
+                events.append(('start', self.name))
+                yield tornado_sleep(0.1)
+                events.append(('end', self.name))
+
+        watchers = [TierWatcher('low', 1), TierWatcher('high1', 2),
+                    TierWatcher('high2', 2), TierWatcher('high3', 2)]
+        arbiter = Arbiter(watchers, None, None, check_delay=-1,
+                          tier_concurrency=2)
+        yield arbiter.reload()
+
+        # the two first watchers of the highest tier run concurrently,
+        # the third one waits for a slot and the low tier for all of them
+        self.assertEqual(events[:2], [('start', 'high1'), ('start', 'high2')])
+        self.assertEqual(events[2][0], 'end')
+        self.assertIn(events[3], [('start', 'high3'), ('end', 'high2')])
+        self.assertEqual(events[-2:], [('start', 'low'), ('end', 'low')])
+
+    @skipIf(IS_WINDOWS, "SIGCHLD not supported on Windows")
+    @tornado.testing.gen_test
+    def test_respawn_on_sigchld(self):
+        controller = "tcp://127.0.0.1:%d" % get_available_port()
+        sub = "tcp://127.0.0.1:%d" % get_available_port()
+        # the periodic check will not run during the test
+        arbiter = Arbiter([], controller, sub, loop=get_ioloop(),
+                          check_delay=60)
+        arbiter.add_watcher('foo', SLEEP % 5, warmup_delay=0)
+        try:
+            yield arbiter.start()
+            watcher = arbiter.watchers[0]
+            old_pid = watcher.get_active_pids()[0]
+            os.kill(old_pid, signal.SIGKILL)
+
+            start = time()
+            pids = [old_pid]
+            while pids == [old_pid] and time() - start < 5:
+                yield tornado_sleep(0.1)
+                pids = watcher.get_active_pids()
+            self.assertEqual(len(pids), 1)
+            self.assertNotEqual(pids[0], old_pid)
+        finally:
+            yield arbiter.stop()
+
+    @skipIf(IS_WINDOWS, "SIGCHLD not supported on Windows")
+    @tornado.testing.gen_test
+    def test_crash_loop_is_not_respawned_on_sigchld(self):
+        controller = "tcp://127.0.0.1:%d" % get_available_port()
+        sub = "tcp://127.0.0.1:%d" % get_available_port()
+        arbiter = Arbiter([], controller, sub, loop=get_ioloop(),
+                          check_delay=5)
+        # a worker exiting as soon as it starts
+        arbiter.add_watcher('foo', '%s -c "import sys; sys.exit(1)"'
+                            % PYTHON, warmup_delay=0)
+        try:
+            yield arbiter.start()
+            watcher = arbiter.watchers[0]
+            spawned = []
+            spawn_process = watcher.spawn_process
+
+            def _spawn_process(*args, **kwargs):
+                spawned.append(1)
+                return spawn_process(*args, **kwargs)
+
+            watcher.spawn_process = _spawn_process
+            yield tornado_sleep(2)
+            # respawned once on SIGCHLD, then left to the periodic check
+            self.assertTrue(len(spawned) <= 2, len(spawned))
+        finally:
+            yield arbiter.stop()
+
+    @tornado.testing.gen_test
+    def test_get_process(self):
+        controller = "tcp://127.0.0.1:%d" % get_available_port()
+        sub = "tcp://127.0.0.1:%d" % get_available_port()
+        arbiter = Arbiter([], controller, sub, loop=get_ioloop(),
+                          check_delay=-1)
+        arbiter.add_watcher('foo', SLEEP % 5, numprocesses=2)
+        try:
+            yield arbiter.start()
+            watcher = arbiter.watchers[0]
+            for pid, process in watcher.processes.items():
+                self.assertEqual(arbiter.get_process(pid), (watcher, process))
+            yield watcher.decr()
+            self.assertEqual(len(arbiter._pids), 1)
+        finally:
+            yield arbiter.stop()
+        self.assertEqual(arbiter.get_process(pid), (None, None))
+        self.assertEqual(arbiter._pids, {})
+
     @tornado.testing.gen_test
     def test_add_watcher_same_lowercase_names(self):
         controller = "tcp://127.0.0.1:%d" % get_available_port()
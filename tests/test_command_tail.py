@@ -0,0 +1,96 @@
+from tornado import gen
+from tornado.testing import gen_test
+
+from tests.support import TestCircus
+from circus.commands.tail import Tail
+from circus.exc import ArgumentError, MessageError
+from circus.stream import RingBufferStream, get_stream
+
+
+class FakeWatcher(object):
+    name = 'one'
+    stderr_stream = None
+
+    def __init__(self):
+        self.stdout_stream = RingBufferStream()
+        self.events = []
+
+    def notify_event(self, topic, msg):
+        self.events.append((topic, msg))
+
+
+class FakeArbiter(object):
+    pubsub_endpoint = 'tcp://127.0.0.1:5556'
+
+    def __init__(self):
+        self.watcher = FakeWatcher()
+
+    def get_watcher(self, name):
+        if name != 'one':
+            raise KeyError(name)
+        return self.watcher
+
+
+class TailCommandTest(TestCircus):
+
+    def test_message(self):
+        cmd = Tail()
+        self.assertEqual(cmd.message('one', '12', follow=True),
+                         {'command': 'tail',
+                          'properties': {'name': 'one', 'pid': 12,
+                                         'follow': True}})
+        self.assertRaises(ArgumentError, cmd.message)
+
+    def test_execute(self):
+        cmd = Tail()
+        arbiter = FakeArbiter()
+        stream = arbiter.watcher.stdout_stream
+        stream({'pid': 12, 'name': 'stdout', 'data': b'one\n'})
+        stream({'pid': 13, 'name': 'stdout', 'data': b'two\n'})
+
+        resp = cmd.execute(arbiter, {'name': 'one', 'pid': 12})
+        self.assertEqual(resp, {'output': [{'pid': 12, 'stream': 'stdout',
+                                            'data': 'one\n'}]})
+        self.assertEqual(cmd.console_msg(dict(resp, status='ok')), 'one\n')
+
+        resp = cmd.execute(arbiter, {'name': 'one', 'follow': True})
+        self.assertEqual(len(resp['output']), 2)
+        self.assertEqual(resp['pubsub_endpoint'], arbiter.pubsub_endpoint)
+        stream({'pid': 12, 'name': 'stdout', 'data': b'three\n'})
+        self.assertEqual(arbiter.watcher.events[0][1]['data'], 'three\n')
+
+    @gen_test
+    def test_threaded(self):
+        cmd = Tail()
+        arbiter = FakeArbiter()
+        stream = get_stream({'class': 'RingBufferStream',
+                             'threaded': 'true'})
+        self.addCleanup(stream.close)
+        arbiter.watcher.stdout_stream = stream
+
+        resp = cmd.execute(arbiter, {'name': 'one', 'follow': True})
+        self.assertEqual(resp['output'], [])
+        stream({'pid': 12, 'name': 'stdout', 'data': b'one\n'})
+        # the output written by the thread is published from the loop
+        while not arbiter.watcher.events:
+            yield gen.sleep(0.01)
+        self.assertEqual(arbiter.watcher.events[0][1]['data'], 'one\n')
+
+        resp = cmd.execute(arbiter, {'name': 'one'})
+        self.assertEqual(resp['output'], [{'pid': 12, 'stream': 'stdout',
+                                           'data': 'one\n'}])
+
+    def test_no_ring_buffer(self):
+        cmd = Tail()
+        arbiter = FakeArbiter()
+        arbiter.watcher.stdout_stream = None
+        self.assertRaises(MessageError, cmd.execute, arbiter, {'name': 'one'})
+        self.assertRaises(MessageError, cmd.execute, arbiter, {'name': 'two'})
+
+    def test_follow_msg(self):
+        cmd = Tail()
+        msg = cmd.message('One', '12', follow=True)
+        self.assertEqual(cmd.follow_topics(msg), ['watcher.one.output'])
+        self.assertEqual(cmd.follow_message(msg)['properties']['size'], 0)
+        self.assertEqual(cmd.follow_msg(msg, {'pid': 13, 'data': 'x'}), '')
+        self.assertEqual(cmd.follow_msg(msg, {'pid': 12, 'data': 'x'}), 'x')
@@ -45,7 +45,8 @@ _CONF = {
     'issue680': os.path.join(CONFIG_DIR, 'issue680.ini'),
     'virtualenv': os.path.join(CONFIG_DIR, 'virtualenv.ini'),
     'empty_section': os.path.join(CONFIG_DIR, 'empty_section.ini'),
-    'issue1088': os.path.join(CONFIG_DIR, 'issue1088.ini')
+    'issue1088': os.path.join(CONFIG_DIR, 'issue1088.ini'),
+    'deadbands': os.path.join(CONFIG_DIR, 'deadbands.ini')
 }
 
 
@@ -283,6 +284,9 @@ class TestConfig(TestCase):
     def test_config_unexistant(self):
         self.assertRaises(IOError, get_config, _CONF['unexistant'])
 
+    def test_invalid_deadbands(self):
+        self.assertRaises(ValueError, get_config, _CONF['deadbands'])
+
     def test_variables_everywhere(self):
         os.environ['circus_stats_endpoint'] = 'tcp://0.0.0.0:9876'
         os.environ['circus_statsd'] = 'True'
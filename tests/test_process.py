@@ -2,8 +2,10 @@ import io
 import os
 import sys
 import time
+from unittest import mock
 
-from circus.process import Process
+from circus.process import (Process, RUNNING, UNEXISTING, USE_PROC_STAT,
+                            STATUS_TTL, read_proc_stat)
 from tests.support import (TestCircus, skipIf, DEBUG,
                                   poll_for, IS_WINDOWS, PYTHON, SLEEP)
 
@@ -114,6 +116,56 @@ class TestProcess(TestCircus):
         p1.stop()
         p2.stop()
 
+    def test_status(self):
+        cmd = PYTHON
+        args = "-c 'import time; time.sleep(10)'"
+        process = Process('test', 1, cmd, args=args, shell=False,
+                          use_fds=USE_FDS)
+        try:
+            self.assertEqual(process.status, RUNNING)
+            with mock.patch.object(process, '_read_status') as read:
+                # cached
+                self.assertEqual(process.status, RUNNING)
+                self.assertFalse(read.called)
+                # the wall clock stepping back doesn't keep it cached
+                process._status_time -= STATUS_TTL
+                with mock.patch('circus.process.time.time',
+                                return_value=0):
+                    process.status
+                self.assertTrue(read.called)
+        finally:
+            process.stop()
+            process.wait(3)
+        self.assertEqual(process.status, UNEXISTING)
+
+    @skipIf(not USE_PROC_STAT, "/proc not available")
+    def test_read_proc_stat(self):
+        state, starttime = read_proc_stat(os.getpid())
+        self.assertEqual(state, b'R')
+        self.assertTrue(starttime > 0)
+        self.assertEqual(read_proc_stat(2 ** 22 + 1), None)
+
+    @skipIf(IS_WINDOWS, "No sessions on Windows")
+    def test_spawn_without_preexec(self):
+        cmd = PYTHON
+        args = "-c 'import time; time.sleep(10)'"
+        with mock.patch('circus.process.Popen') as popen:
+            Process('test', 1, cmd, args=args, use_fds=USE_FDS)
+            kwargs = popen.call_args[1]
+            self.assertEqual(kwargs['preexec_fn'], None)
+            self.assertTrue(kwargs['start_new_session'])
+
+            # rlimits still need python code in the child
+            Process('test', 1, cmd, args=args, use_fds=USE_FDS,
+                    rlimits={'nofile': 20})
+            self.assertNotEqual(popen.call_args[1]['preexec_fn'], None)
+
+        process = Process('test', 1, cmd, args=args, use_fds=USE_FDS)
+        try:
+            self.assertEqual(os.getsid(process.pid), process.pid)
+        finally:
+            process.stop()
+
     def test_process_parameters(self):
         # all the options passed to the process should be available by the
         # command / process
@@ -0,0 +1,101 @@
+import os
+import socket
+import tempfile
+
+import tornado
+
+from circus.process import RUNNING, UNEXISTING
+from circus.readiness import (get_probe, wait_ready, TCPProbe, UnixProbe,
+                              HTTPProbe, FileProbe, CallableProbe)
+from tests.support import TestCircus, get_available_port
+
+
+class FakeProcess(object):
+
+    def __init__(self, status=RUNNING, wid=1, pid=1234):
+        self.status = status
+        self.wid = wid
+        self.pid = pid
+
+
+def always_ready(watcher, process):
+    return True
+
+
+class TestReadiness(TestCircus):
+
+    def test_get_probe(self):
+        self.assertEqual(get_probe(None), None)
+        self.assertTrue(isinstance(get_probe('tcp://127.0.0.1:80'), TCPProbe))
+        self.assertTrue(isinstance(get_probe('unix:///tmp/sock'), UnixProbe))
+        self.assertTrue(isinstance(get_probe('http://localhost/'),
+                                   HTTPProbe))
+        self.assertTrue(isinstance(get_probe('file:///tmp/ready'),
+                                   FileProbe))
+        probe = get_probe('tests.test_readiness.always_ready')
+        self.assertTrue(isinstance(probe, CallableProbe))
+        self.assertRaises(ValueError, get_probe, 'ftp://localhost/')
+
+    def test_format(self):
+        probe = get_probe('file:///tmp/ready-$(circus.wid)-$(circus.pid)')
+        self.assertEqual(probe.format(FakeProcess(wid=3, pid=42)),
+                         'file:///tmp/ready-3-42')
+
+    @tornado.testing.gen_test
+    def test_file_probe(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        probe = get_probe('file://%s' % path)
+        try:
+            ready = yield probe.check(None, FakeProcess())
+            self.assertTrue(ready)
+        finally:
+            os.remove(path)
+        ready = yield probe.check(None, FakeProcess())
+        self.assertFalse(ready)
+
+    @tornado.testing.gen_test
+    def test_tcp_probe(self):
+        port = get_available_port()
+        probe = get_probe('tcp://127.0.0.1:%d' % port)
+        ready = yield probe.check(None, FakeProcess())
+        self.assertFalse(ready)
+
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', port))
+        sock.listen(1)
+        try:
+            ready = yield probe.check(None, FakeProcess())
+            self.assertTrue(ready)
+        finally:
+            sock.close()
+
+    @tornado.testing.gen_test(timeout=10)
+    def test_http_probe_no_answer(self):
+        # a server which accepts the connection but never answers
+        port = get_available_port()
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', port))
+        sock.listen(1)
+        try:
+            probe = get_probe('http://127.0.0.1:%d/' % port)
+            ready = yield probe.check(None, FakeProcess())
+            self.assertFalse(ready)
+        finally:
+            sock.close()
+
+    @tornado.testing.gen_test
+    def test_wait_ready(self):
+        probe = get_probe('tests.test_readiness.always_ready')
+        ready = yield wait_ready(probe, None, FakeProcess(), timeout=1)
+        self.assertTrue(ready)
+
+        # a dead process is never ready
+        ready = yield wait_ready(probe, None, FakeProcess(UNEXISTING),
+                                 timeout=1)
+        self.assertFalse(ready)
+
+        probe = get_probe('file:///does/not/exist')
+        ready = yield wait_ready(probe, None, FakeProcess(), timeout=0.2,
+                                 interval=0.05)
+        self.assertFalse(ready)
@@ -1,13 +1,17 @@
+import os
+import shutil
 import socket
+import tempfile
 import time
 from collections import defaultdict
 from circus.fixed_threading import Thread
 
 from tornado import ioloop
 
-from circus.stats import collector as collector_module
 from circus.stats.collector import SocketStatsCollector, WatcherStatsCollector
-from tests.support import TestCase
+from circus.stats.collector import parse_deadbands, read_deadbands
+from circus.stats.sampler import ProcSampler, PsutilSampler
+from tests.support import TestCase, skipIf
 
 
 class TestCollector(TestCase):
@@ -39,6 +43,7 @@ class TestCollector(TestCase):
 
         class FakeStreamer(object):
             stats = []
+            history = None
 
             def __init__(this):
                 this.sockets = self.socks
@@ -57,6 +62,9 @@ class TestCollector(TestCase):
             def publish(this, name, stat):
                 this.stats.append(stat)
 
+            def publish_all(this, name, stats):
+                this.stats.extend(stats)
+
         self.streamer = FakeStreamer()
         return self.streamer
 
@@ -95,47 +103,64 @@ class TestCollector(TestCase):
                 'cmdline': 'python',
                 'cpu': 0.0 + i / 10.,
                 'create_time': 1378663281.96,
-                'ctime': '0:00.0',
+                'ctime': 0.0,
                 'mem': 0.0,
-                'mem_info1': '52K',
-                'mem_info2': '39M',
+                'mem_info1': 53248,
+                'mem_info2': 40894464,
                 'nice': 0,
                 'pid': None,
                 'username': 'alexis'})
 
-        def _get_info(pid):
-            try:
-                data = info[calls[pid]].copy()
-            except IndexError:
-                raise collector_module.util.NoSuchProcess(pid)
-            data['pid'] = pid
-            calls[pid] += 1
-            return data
-
-        old_info = collector_module.util.get_info
-        try:
-            collector_module.util.get_info = _get_info
-
-            self.pids['firefox'] = [2353, 2354]
-            collector = WatcherStatsCollector(self._get_streamer(), 'firefox')
+        class FakeSampler(object):
+            def sample(self, pids):
+                infos = {}
+                for pid in pids:
+                    # the processes are gone after two samples
+                    if calls[pid] < len(info):
+                        infos[pid] = dict(info[calls[pid]], pid=pid)
+                        calls[pid] += 1
+                return infos
+
+        self.pids['firefox'] = [2353, 2354]
+        collector = WatcherStatsCollector(self._get_streamer(), 'firefox')
+        collector.sampler = FakeSampler()
 
-            stats = list(collector.collect_stats())
-            self.assertEqual(len(stats), 3)
+        stats = list(collector.collect_stats())
+        self.assertEqual(len(stats), 3)
 
-            stats = list(collector.collect_stats())
-            self.assertEqual(len(stats), 3)
+        stats = list(collector.collect_stats())
+        self.assertEqual(len(stats), 3)
 
-            stats = list(collector.collect_stats())
-            self.assertEqual(len(stats), 1)
+        stats = list(collector.collect_stats())
+        self.assertEqual(len(stats), 1)
 
-            self.circus_pids = {1234: 'ohyeah'}
-            self.pids['circus'] = [1234]
-            collector = WatcherStatsCollector(self._get_streamer(), 'circus')
-            stats = list(collector.collect_stats())
-            self.assertEqual(stats[0]['name'], 'ohyeah')
+        self.circus_pids = {1234: 'ohyeah'}
+        self.pids['circus'] = [1234]
+        collector = WatcherStatsCollector(self._get_streamer(), 'circus')
+        collector.sampler = FakeSampler()
+        stats = list(collector.collect_stats())
+        self.assertEqual(stats[0]['name'], 'ohyeah')
 
-        finally:
-            collector_module.util.get_info = old_info
+    def test_psutil_sampler(self):
+        # the systems without /proc get the same raw numbers
+        self.pids['firefox'] = [os.getpid(), 4194305]
+        collector = WatcherStatsCollector(self._get_streamer(), 'firefox')
+        collector.sampler = PsutilSampler()
+        stats = list(collector.collect_stats())
+        self.assertEqual(len(stats), 2)
+        info = stats[0]
+        for key in ('mem_info1', 'mem_info2', 'ctime', 'threads',
+                    'ctx_switches', 'create_time', 'age'):
+            self.assertTrue(isinstance(info[key], (int, float)), key)
+        if ProcSampler.available():
+            expected = ProcSampler().sample([os.getpid()])[os.getpid()]
+            self.assertEqual(set(info) - set(['subtopic', 'name']),
+                             set(expected))
+
+        # the cpu time is a counter turned into a rate
+        time.sleep(0.01)
+        stats = list(collector.collect_stats())
+        self.assertNotEqual(stats[-1]['ctime_rate'], 'N/A')
 
     def test_collector_aggregation(self):
         collector = WatcherStatsCollector(self._get_streamer(), 'firefox')
@@ -172,6 +197,85 @@ class TestCollector(TestCase):
         self.assertEqual(len(res['pid']), 10)
         self.assertEqual(res['cpu'], 'N/A')
 
+    def test_collector_aggregation_columns(self):
+        collector = WatcherStatsCollector(self._get_streamer(), 'firefox')
+
+        def _aggregate(now, ctime):
+            aggregate = {}
+            for i in range(0, 20):
+                pid = 1000 + i
+                aggregate[pid] = {
+                    'age': 10. + i, 'cpu': float(i), 'mem': 1.,
+                    'mem_info1': 1024, 'num_children': i % 2,
+                    'ctime': ctime + i, 'io_read': 'N/A',
+                    'io_write': 100 * now}
+            aggregate[1000]['cpu'] = 'N/A'
+            return collector._aggregate(aggregate, now=now)
+
+        res = _aggregate(10., 0.)
+        self.assertEqual(res['cpu'], 10.)
+        self.assertEqual(res['cpu_max'], 19.)
+        self.assertEqual(res['cpu_p50'], 10.)
+        self.assertEqual(res['cpu_p95'], 19.)
+        self.assertEqual(res['rss'], 20 * 1024)
+        self.assertEqual(res['children'], 10)
+        self.assertEqual(res['age'], 29.)
+        self.assertEqual(res['ctime_rate'], 'N/A')
+
+        # the rates come from the previous aggregation
+        res = _aggregate(12., 1.)
+        self.assertEqual(res['ctime_rate'], 10.)
+        self.assertEqual(res['io_write_rate'], 2000.)
+        self.assertEqual(res['io_read_rate'], 'N/A')
+
+    def test_deadbands(self):
+        streamer = self._get_streamer()
+        streamer.stats = []
+        collector = WatcherStatsCollector(streamer, 'firefox',
+                                          keyframe_interval=3)
+        samples = [
+            {1: {'cpu': 0., 'mem_info1': 1000, 'age': 1.},
+             2: {'cpu': 0., 'mem_info1': 1000, 'age': 1.}},
+            # idle: only the age moved
+            {1: {'cpu': 0.5, 'mem_info1': 1040, 'age': 2.},
+             2: {'cpu': 0., 'mem_info1': 1000, 'age': 2.}},
+            # the first process moved out of its deadbands
+            {1: {'cpu': 0.5, 'mem_info1': 1100, 'age': 3.},
+             2: {'cpu': 0., 'mem_info1': 1000, 'age': 3.}},
+            # a keyframe
+            {1: {'cpu': 0.5, 'mem_info1': 1100, 'age': 4.},
+             2: {'cpu': 0., 'mem_info1': 1000, 'age': 4.}},
+            # the second process is gone
+            {1: {'cpu': 0.5, 'mem_info1': 1100, 'age': 5.}},
+        ]
+        published = []
+        for sample in samples:
+            def _get_infos(pids, sample=sample):
+                return dict((pid, dict(info)) for pid, info in sample.items())
+            collector._get_infos = _get_infos
+            self.pids['firefox'] = list(sample)
+            collector._callback()
+            published.append([stat.get('subtopic')
+                              for stat in streamer.stats])
+            streamer.stats = []
+
+        self.assertEqual(published, [[1, 2, None], [], [1], [1, 2, None],
+                                     [None]])
+
+    def test_parse_deadbands(self):
+        self.assertEqual(parse_deadbands({'cpu': '1', 'rss': '5%'}),
+                         {'cpu': (1., False), 'rss': (.05, True)})
+        self.assertRaises(ValueError, parse_deadbands, {'cpu': 'x'})
+
+    def test_read_deadbands(self):
+        deadbands = read_deadbands(['cpu=5', ' fds = 1'])
+        self.assertEqual(deadbands['cpu'], '5')
+        self.assertEqual(deadbands['fds'], ' 1')
+        self.assertEqual(deadbands['mem'], '0.1')
+        # the way a "cpu = 5" config value is split
+        self.assertRaises(ValueError, read_deadbands, ['cpu', '=', '5'])
+        self.assertRaises(ValueError, read_deadbands, ['cpu=x'])
+
     def test_socketstats(self):
         collector = self._get_collector(SocketStatsCollector)
         collector.start()
@@ -196,3 +300,66 @@ class TestCollector(TestCase):
         self.assertTrue(stat['reads'] > 1)
 
 
+_STAT = ('{pid} (my app) S 1 {pid} {pid} 0 -1 4194304 100 0 0 0 '
+         '{utime} 50 0 0 20 5 1 0 {start} 1048576 256 18446744073709551615')
+
+
+class TestProcSampler(TestCase):
+
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.proc)
+        self._write('stat', 'cpu  1 2 3\nbtime 1000\n')
+        self._write('meminfo', 'MemTotal:        1024 kB\n')
+        os.mkdir(os.path.join(self.proc, 'self'))
+        self._write('self/stat', '')
+
+    def _write(self, name, data):
+        with open(os.path.join(self.proc, name), 'w') as f:
+            f.write(data)
+
+    def _add_process(self, pid, utime):
+        if not os.path.isdir(os.path.join(self.proc, str(pid))):
+            os.makedirs(os.path.join(self.proc, str(pid), 'fd'))
+            os.mkdir(os.path.join(self.proc, str(pid), 'fd', '0'))
+        self._write('%d/stat' % pid, _STAT.format(pid=pid, utime=utime,
+                                                  start=200))
+        self._write('%d/status' % pid, 'Name:\tapp\nUid:\t0\t0\t0\t0\n'
+                    'voluntary_ctxt_switches:\t10\n'
+                    'nonvoluntary_ctxt_switches:\t2\n')
+        self._write('%d/cmdline' % pid, '/usr/bin/python\0app.py\0')
+
+    def test_sample(self):
+        sampler = ProcSampler(self.proc)
+        self.assertTrue(ProcSampler.available(self.proc))
+        self._add_process(12, utime=100)
+        infos = sampler.sample([12, 13])
+        self.assertEqual(list(infos), [12])
+        info = infos[12]
+        ticks = sampler.ticks
+        self.assertEqual(info['cpu'], 0.)
+        self.assertEqual(info['cmdline'], 'python')
+        self.assertEqual(info['username'], 'root')
+        self.assertEqual(info['nice'], 5)
+        self.assertEqual(info['threads'], 1)
+        self.assertEqual(info['fds'], 1)
+        self.assertEqual(info['ctx_switches'], 12)
+        self.assertEqual((info['io_read'], info['io_write']), ('N/A', 'N/A'))
+        self.assertEqual(info['num_children'], 'N/A')
+        self.assertEqual(info['mem_info1'], 256 * sampler.page_size)
+        self.assertEqual(info['mem_info2'], 1048576)
+        self.assertEqual(info['ctime'], 150 / ticks)
+        self.assertEqual(info['create_time'], 1000 + 200 / ticks)
+
+        # the cpu usage comes from the previous sample
+        self._add_process(12, utime=100 + ticks)
+        sampler._previous[12] = (150, time.time() - 2,
+                                 sampler._previous[12][2])
+        self.assertAlmostEqual(sampler.sample([12])[12]['cpu'], 50., 0)
+
+    @skipIf(not ProcSampler.available(), '/proc is not available')
+    def test_sample_self(self):
+        sampler = ProcSampler()
+        info = sampler.sample([os.getpid()])[os.getpid()]
+        self.assertTrue(info['mem_info1'] > 0)
+        self.assertTrue(info['age'] > 0)
@@ -3,8 +3,10 @@ from unittest import mock
 import zmq
 import zmq.utils.jsonapi as json
 
-from tests.support import TestCase
-from circus.stats.publisher import StatsPublisher
+from tests.support import TestCase, skipIf
+from circus.stats.client import StatsClient
+from circus.stats.publisher import StatsPublisher, msgpack
+from circus.stats.publisher import decode_stats, encode_stats
 
 
 class TestStatsPublisher(TestCase):
@@ -38,4 +40,50 @@ class TestStatsPublisher(TestCase):
         stat = {'subtopic': 1, 'foo': 'bar'}
         self.publisher.publish('foobar', stat)
 
+    def test_publish_all_json(self):
+        stats = [{'subtopic': 1, 'foo': 'bar'}, {'foo': 'baz'}]
+        self.publisher.publish_all('foobar', stats)
+        self.assertEqual(self.publisher.socket.send_multipart.call_count, 2)
 
+    def test_publish_all_batch(self):
+        self.publisher.format = 'json-batch'
+        stats = [{'subtopic': 1, 'cpu': 1.}, {'subtopic': 2, 'cpu': 2.},
+                 {'pid': [1, 2], 'cpu': 1.5}]
+        self.publisher.publish_all('foobar', stats)
+        frames = self.publisher.socket.send_multipart.call_args[0][0]
+        self.assertEqual(frames[:2], [b'stat.foobar', b'json-batch'])
+        # the stats sharing their keys are sent as rows
+        self.assertEqual(json.loads(frames[2]),
+                         [[['subtopic', 'cpu'], [[1, 1.], [2, 2.]]],
+                          [['pid', 'cpu'], [[[1, 2], 1.5]]]])
+        self.assertEqual(list(decode_stats(frames[2], 'json-batch')), stats)
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        stats = [{'subtopic': 1, 'cpu': 1., 'username': 'bob'},
+                 {'pid': [1], 'cpu': 1.}]
+        data = encode_stats(stats, 'msgpack')
+        self.assertTrue(len(data) < len(json.dumps(stats)))
+        self.assertEqual(list(decode_stats(data, 'msgpack')), stats)
+
+    def test_bad_format(self):
+        self.assertRaises(ValueError, StatsPublisher, format='xml')
+
+
+class TestStatsClient(TestCase):
+
+    def test_decode_batch(self):
+        client = StatsClient(endpoint='tcp://127.0.0.1:55557')
+        client.poller = mock.MagicMock()
+        client.poller.poll.return_value = [(client.pubsub_socket, 1)]
+        stats = [{'subtopic': 12, 'cpu': 1.}, {'pid': [12], 'cpu': 1.}]
+        client.pubsub_socket = mock.MagicMock()
+        client.pubsub_socket.recv_multipart.side_effect = [
+            [b'stat.foo', b'json-batch', encode_stats(stats, 'json-batch')],
+            [b'stat.foo.12', json.dumps(stats[0])]]
+
+        messages = client.iter_messages()
+        self.assertEqual(next(messages), ('foo', '12', stats[0]))
+        self.assertEqual(next(messages), ('foo', None, stats[1]))
+        self.assertEqual(next(messages), ('foo', '12', stats[0]))
+        messages.close()
@@ -0,0 +1,68 @@
+import math
+
+from tests.support import TestCase
+from circus.stats.series import Series, StatsHistory, aggregate
+
+
+class TestSeries(TestCase):
+
+    def test_ring(self):
+        series = Series(3, metrics=('cpu',))
+        for i in range(5):
+            series.append(100. + i, {'cpu': float(i)})
+        self.assertEqual(series.count, 3)
+        times, values = series.window(0)
+        self.assertEqual(times, [102., 103., 104.])
+        self.assertEqual(values['cpu'], [2., 3., 4.])
+        times, values = series.window(103.)
+        self.assertEqual(values['cpu'], [3., 4.])
+
+    def test_missing_values(self):
+        series = Series(4, metrics=('cpu', 'fds'))
+        series.append(1., {'cpu': 1.})
+        __, values = series.window(0)
+        self.assertTrue(math.isnan(values['fds'][0]))
+
+
+class TestAggregate(TestCase):
+
+    def test_aggregate(self):
+        times = [float(i) for i in range(101)]
+        values = [float(i) for i in range(101)]
+        values[0] = float('nan')
+        res = aggregate(times, values)
+        self.assertEqual(res['count'], 100)
+        self.assertEqual(res['max'], 100.)
+        self.assertEqual(res['p95'], 95.)
+        self.assertEqual(res['rate'], 1.)
+        self.assertEqual(res['mean'], 50.5)
+
+    def test_no_values(self):
+        res = aggregate([1.], [float('nan')])
+        self.assertEqual(res, {'count': 0, 'mean': None, 'max': None,
+                               'p95': None, 'rate': None})
+
+
+class TestStatsHistory(TestCase):
+
+    def test_record_and_query(self):
+        history = StatsHistory(size=10)
+        for i in range(3):
+            history.record('foo', {1: {'cpu': 1. * i, 'mem_info1': 100},
+                                   2: {'cpu': 2. * i, 'mem_info1': 'N/A'}},
+                           when=1000. + i)
+
+        res = history.query('foo', 1, window=10, now=1002.)
+        self.assertEqual(res['cpu']['mean'], 1.)
+        self.assertEqual(res['rss']['max'], 100.)
+
+        # the watcher sums its processes, a missing value makes it missing
+        res = history.query('foo', window=1.5, now=1002.,
+                            metrics=['cpu', 'rss'])
+        self.assertEqual(res['cpu']['count'], 2)
+        self.assertEqual(res['cpu']['max'], 6.)
+        self.assertEqual(res['rss']['count'], 0)
+
+        history.forget('foo', 1)
+        self.assertRaises(KeyError, history.query, 'foo', 1)
+        self.assertRaises(ValueError, history.query, 'foo', metrics=['bar'])
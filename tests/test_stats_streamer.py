@@ -1,5 +1,7 @@
+import json
 import os
 import tempfile
+import time
 
 from unittest import mock
 
@@ -99,4 +101,32 @@ class TestStatsStreamer(TestCircus):
         streamer.remove_pid('foobar', 1235)
         self.assertTrue(streamer._callbacks['foobar'].stop.called)
 
-
+    def test_query(self):
+        streamer = FakeStreamer()
+        streamer.querystream = mock.MagicMock()
+        streamer.history.record('foobar', {1234: {'cpu': 10., 'fds': 5}},
+                                time.time() - 2)
+        streamer.history.record('foobar', {1234: {'cpu': 20., 'fds': 7}},
+                                time.time() - 1)
+
+        msg = client.make_message('query', name='foobar', pid=1234,
+                                  metrics=['cpu', 'fds'])
+        msg['id'] = 'abc'
+        streamer.handle_query([b'cid', json.dumps(msg)])
+        cid, resp = streamer.querystream.send_multipart.call_args[0][0]
+        resp = json.loads(resp)
+        self.assertEqual(cid, b'cid')
+        self.assertEqual(resp['id'], 'abc')
+        self.assertEqual(resp['stats']['cpu']['mean'], 15.)
+        self.assertEqual(resp['stats']['fds']['max'], 7.)
+        self.assertAlmostEqual(resp['stats']['fds']['rate'], 2., 1)
+
+        # the series of a removed process are forgotten
+        streamer._callbacks['foobar'] = mock.MagicMock()
+        streamer._pids = {'foobar': [1234]}
+        streamer.remove_pid('foobar', 1234)
+        streamer.handle_query([b'cid', json.dumps(msg)])
+        cid, resp = streamer.querystream.send_multipart.call_args[0][0]
+        resp = json.loads(resp)
+        self.assertEqual(resp['status'], 'error')
+        self.assertEqual(resp['reason'], 'No stats for foobar pid 1234')
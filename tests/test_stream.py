@@ -3,7 +3,15 @@ import time
 import sys
 import os
 import tempfile
+import gzip
+import shutil
+import subprocess
+import threading
 import tornado
+import json
+from tornado.testing import AsyncTestCase, gen_test
+from tornado import gen
+from unittest import mock
 
 from datetime import datetime
 
@@ -13,6 +21,9 @@ from tests.support import TestCase, skipIf, IS_WINDOWS
 from circus.stream import FileStream, WatchedFileStream
 from circus.stream import TimedRotatingFileStream
 from circus.stream import FancyStdoutStream
+from circus.stream import Redirector, ThreadedStream, get_stream
+from circus.stream.prefixer import LinePrefixer, TimeFormatter
+from circus.stream import SinkStream, JSONLinesStream, RingBufferStream
 
 
 def run_process(testfile, *args, **kw):
@@ -269,7 +280,7 @@ class TestFileStream(TestCase):
 
     def get_output(self, stream):
         # stub data
-        data = {'data': 'hello world',
+        data = {'data': 'hello world\n',
                 'pid': 333}
 
         # get the output
@@ -278,7 +289,7 @@ class TestFileStream(TestCase):
         stream._file.close()
 
         expected = stream.now().strftime(stream._time_format) + " "
-        expected += "[333] | " + data['data'] + '\n'
+        expected += "[333] | hello world\n"
         return output, expected
 
     @skipIf(IS_WINDOWS and sys.version_info[0] < 3,
@@ -297,11 +308,15 @@ class TestFileStream(TestCase):
 
         stream(data)
         output = stream._file.getvalue()
-        stream._file.close()
 
-        # NOTE: We expect 4 b/c the last line needs to add a newline
-        #       in order to prepare for the next chunk
+        # NOTE: the last line is kept until its end comes in the next
+        #       chunk, so it is prefixed once
+        self.assertEqual(len(output.split('\n')), 3)
+        stream({'data': 'qux\n', 'pid': 333})
+        output = stream._file.getvalue()
+        stream._file.close()
         self.assertEqual(len(output.split('\n')), 4)
+        self.assertTrue(output.endswith('] | bazqux\n'))
 
     @skipIf(IS_WINDOWS and sys.version_info[0] < 3,
             "StringIO has no fileno on Python 2 and Windows")
@@ -332,6 +347,184 @@ class TestFileStream(TestCase):
 
         self.assertEqual(output, '*' * 2200)
 
+    @skipIf(not hasattr(os, 'splice'), "os.splice not available")
+    def test_splice(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, filename)
+        stream = self.stream_class(filename=filename)
+        self.addCleanup(stream.close)
+        stream({'data': b'read\n', 'pid': 333})
+
+        read, write = os.pipe()
+        self.addCleanup(os.close, read)
+        os.write(write, b'spliced\n')
+        self.assertEqual(stream.splice(read, 1024), 8)
+        os.close(write)
+        self.assertEqual(stream.splice(read, 1024), 0)
+
+        with open(filename, 'rb') as f:
+            self.assertEqual(f.read(), b'read\nspliced\n')
+
+        # prefixed lines have to go through the stream
+        prefixed = self.stream_class(filename=filename, time_format='%Y')
+        self.addCleanup(prefixed.close)
+        self.assertIsNone(prefixed.splice(read, 1024))
+
+        # and so does the output of a subclass changing how it is written
+        upper = UpperFileStream(filename=filename)
+        self.addCleanup(upper.close)
+        self.assertIsNone(upper.splice(read, 1024))
+
+    def _get_temp_filename(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, filename)
+        return filename
+
+    def _read(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def test_flush_bytes(self):
+        filename = self._get_temp_filename()
+        stream = self.stream_class(filename=filename, flush_bytes=100)
+        self.addCleanup(stream.close)
+
+        stream({'data': 'x' * 50, 'pid': 333})
+        self.assertEqual(self._read(filename), '')
+        stream({'data': 'y' * 50, 'pid': 333})
+        self.assertEqual(self._read(filename), 'x' * 50 + 'y' * 50)
+
+        stream({'data': 'z', 'pid': 333})
+        stream.flush()
+        self.assertEqual(len(self._read(filename)), 101)
+
+    def test_rollover_counts_bytes_in_memory(self):
+        filename = self._get_temp_filename()
+        self.addCleanup(lambda: os.path.exists(filename + '.1') and
+                        os.unlink(filename + '.1'))
+        stream = FileStream(filename=filename, max_bytes=20, backup_count=1)
+        self.addCleanup(stream.close)
+
+        stream({'data': 'a' * 8, 'pid': 333})
+        with mock.patch.object(stream._file, 'tell') as tell:
+            stream({'data': 'b' * 8, 'pid': 333})
+        # the file size is not asked for on each write, only once it goes
+        # over max_bytes
+        self.assertFalse(tell.called)
+        stream({'data': 'c' * 8, 'pid': 333})
+        self.assertEqual(self._read(filename + '.1'), 'a' * 8 + 'b' * 8)
+        self.assertEqual(self._read(filename), 'c' * 8)
+
+    def test_rollover_with_shared_file(self):
+        filename = self._get_temp_filename()
+        for ext in ('.1', '.2'):
+            self.addCleanup(lambda name=filename + ext: os.path.exists(name)
+                            and os.unlink(name))
+        out = FileStream(filename=filename, max_bytes=20, backup_count=2)
+        self.addCleanup(out.close)
+        err = FileStream(filename=filename, max_bytes=20, backup_count=2)
+        self.addCleanup(err.close)
+
+        for stream, data in ((out, 'a'), (err, 'b'), (out, 'c'), (err, 'd')):
+            stream({'data': data * 8, 'pid': 333})
+        # err saw the bytes of out once over max_bytes
+        self.assertEqual(self._read(filename + '.1'),
+                         'a' * 8 + 'b' * 8 + 'c' * 8)
+        self.assertEqual(self._read(filename), 'd' * 8)
+
+        # out writes to the new file instead of rotating again, and both
+        # now roll over on the real size
+        out({'data': 'e' * 8, 'pid': 333})
+        self.assertEqual(self._read(filename), 'd' * 8 + 'e' * 8)
+        err({'data': 'f' * 8, 'pid': 333})
+        self.assertEqual(self._read(filename + '.1'), 'd' * 8 + 'e' * 8)
+        self.assertEqual(len(self._read(filename + '.2')), 24)
+        self.assertEqual(self._read(filename), 'f' * 8)
+
+
+class UpperFileStream(FileStream):
+
+    def write_data(self, data):
+        data = dict(data, data=data['data'].upper())
+        super(UpperFileStream, self).write_data(data)
+
+
+class TestCompressedRotation(TestCase):
+
+    def setUp(self):
+        super(TestCompressedRotation, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.filename = os.path.join(self.dir, 'out.log')
+
+    def _gunzip(self, filename):
+        with gzip.open(filename) as f:
+            return f.read()
+
+    def test_file_stream(self):
+        stream = FileStream(filename=self.filename, max_bytes=10,
+                            backup_count=2, compress='gzip')
+        self.addCleanup(stream.close)
+        for data in (b'a' * 8, b'b' * 8, b'c' * 8, b'd' * 8):
+            stream({'data': data, 'pid': 333})
+        stream._rotation.result()
+
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['out.log', 'out.log.1.gz', 'out.log.2.gz'])
+        self.assertEqual(self._gunzip(self.filename + '.1.gz'), b'c' * 8)
+        self.assertEqual(self._gunzip(self.filename + '.2.gz'), b'b' * 8)
+
+    def test_timed_rotating_file_stream(self):
+        stream = TimedRotatingFileStream(filename=self.filename,
+                                         rotate_when='S', backup_count=1,
+                                         compress='gzip')
+        self.addCleanup(stream.close)
+        old = self.filename + '.20000101000000.gz'
+        with gzip.open(old, 'wb') as f:
+            f.write(b'old')
+        stream({'data': b'new', 'pid': 333})
+        stream._do_rollover()
+        stream._rotation.result()
+
+        backups = [f for f in os.listdir(self.dir) if f != 'out.log']
+        # the older backup was pruned
+        self.assertEqual(len(backups), 1)
+        self.assertTrue(backups[0].endswith('.gz'))
+        self.assertEqual(
+            self._gunzip(os.path.join(self.dir, backups[0])), b'new')
+
+    def test_invalid_compression(self):
+        self.assertRaises(ValueError, FileStream, filename=self.filename,
+                          compress='rar')
+
+
+class TestJSONLinesStream(TestCase):
+
+    def test_records(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, filename)
+        stream = JSONLinesStream(filename=filename)
+        stream({'data': 'caf\xe9\n\\n "quoted"\nhal'.encode('utf8'),
+                'pid': 333, 'wid': 2, 'name': 'stderr', 'watcher': 'foo',
+                'timestamp': 1500000000.5})
+        stream({'data': b'f\n', 'pid': 333, 'wid': 2, 'name': 'stderr',
+                'watcher': 'foo', 'timestamp': 1500000001})
+        stream.close()
+
+        with open(filename, 'rb') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['data'] for r in records],
+                         ['caf\xe9', '\\n "quoted"', 'half'])
+        self.assertEqual(records[0], {'time': 1500000000.5,
+                                      'watcher': 'foo', 'wid': 2,
+                                      'pid': 333, 'stream': 'stderr',
+                                      'data': 'caf\xe9'})
+        # the cut line is written when its end comes
+        self.assertEqual(records[2]['time'], 1500000001)
+
 
 class TestWatchedFileStream(TestFileStream):
     stream_class = WatchedFileStream
@@ -370,3 +563,355 @@ class TestWatchedFileStream(TestFileStream):
         os.unlink(file1)
 
 
+class FakeProcess(object):
+    pid = 333
+    name = 'test'
+    wid = 1
+
+
+class TestRedirector(TestCase):
+
+    def test_drain_pipe(self):
+        read, write = os.pipe()
+        self.addCleanup(os.close, read)
+        os.set_blocking(read, False)
+        received = []
+        redirector = Redirector(received.append, None, buffer=1024,
+                                max_buffer=4096, budget=16384)
+        redirector.pipes[read] = 'stdout', FakeProcess(), None
+        handler = Redirector.Handler(redirector, 'stdout', FakeProcess(),
+                                     None)
+
+        os.write(write, b'x' * 10000)
+        handler(read, tornado.ioloop.IOLoop.READ)
+        # one coalesced chunk, read with a growing buffer
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['data'], b'x' * 10000)
+        self.assertEqual(received[0]['pid'], 333)
+        self.assertEqual(handler.read_size, 4096)
+
+        # the budget leaves the rest for the next call
+        os.write(write, b'y' * 20000)
+        handler(read, tornado.ioloop.IOLoop.READ)
+        self.assertEqual(len(received[1]['data']), 16384)
+        handler(read, tornado.ioloop.IOLoop.READ)
+        self.assertEqual(len(received[2]['data']), 20000 - 16384)
+
+        os.close(write)
+        handler(read, tornado.ioloop.IOLoop.READ)
+        self.assertEqual(len(received), 3)
+        self.assertNotIn(read, redirector.pipes)
+
+    def test_last_line_of_exiting_process(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, filename)
+        stream = FileStream(filename, time_format='%Y')
+        self.addCleanup(stream.close)
+        redirector = Redirector(stream, None)
+        process = subprocess.Popen(
+            [sys.executable, '-c',
+             'import sys; sys.stdout.write("one\\nlast")'],
+            stdout=subprocess.PIPE)
+        self.addCleanup(process.stdout.close)
+        read = process.stdout.fileno()
+        os.set_blocking(read, False)
+        redirector.pipes[read] = 'stdout', FakeProcess(), process.stdout
+        handler = Redirector.Handler(redirector, 'stdout', FakeProcess(),
+                                     process.stdout)
+        process.wait()
+        while read in redirector.pipes:
+            handler(read, tornado.ioloop.IOLoop.READ)
+
+        # the last line is written once the pipe is closed, not when the
+        # stream is closed
+        year = datetime.now().strftime('%Y')
+        with open(filename) as f:
+            self.assertEqual(f.read(), '%s [333] | one\n%s [333] | last\n'
+                             % (year, year))
+
+    def _limited(self, **limits):
+        received, events = [], []
+        redirector = Redirector(received.append, None,
+                                notify=lambda *args: events.append(args),
+                                **limits)
+        handler = Redirector.Handler(redirector, 'stdout', FakeProcess(),
+                                     None)
+        return redirector, handler, received, events
+
+    def test_limit_drop(self):
+        redirector, handler, received, events = self._limited(
+            output_rate=100, output_burst=1.)
+        self.assertTrue(redirector.limited)
+        self.assertEqual(redirector.limit(handler, b'x' * 150), b'x' * 100)
+        self.assertEqual(redirector.limit(handler, b'y' * 10), b'')
+        redirector.report(handler, force=True)
+        self.assertEqual(received, [])
+        self.assertEqual(events, [])
+
+    def test_limit_lines_sample(self):
+        redirector, handler, received, events = self._limited(
+            watcher_output_lines_rate=2, output_overflow='sample')
+        # whole lines are kept
+        self.assertEqual(redirector.limit(handler, b'a\nb\nc\nd\n'),
+                         b'a\nb\n')
+        redirector.report(handler, force=True)
+        self.assertEqual(received[0]['data'], b'[circus] 4 bytes suppressed\n')
+        self.assertEqual(received[0]['pid'], 333)
+        self.assertEqual(events[0][0], 'output_suppressed')
+        self.assertEqual(events[0][1]['bytes'], 4)
+
+    def test_report_quiet_process(self):
+        redirector, handler, received, events = self._limited(
+            output_rate=10, output_overflow='sample', report_interval=0.01)
+        redirector.start()
+        self.addCleanup(redirector.stop)
+        self.assertTrue(redirector._reporter.is_running())
+        redirector.limit(handler, b'x' * 20)
+        self.assertEqual(received, [])
+
+        # the process writes nothing more, the periodic report tells
+        time.sleep(0.02)
+        redirector._report_all()
+        self.assertEqual(received[0]['data'],
+                         b'[circus] 10 bytes suppressed\n')
+
+        # changing the limits does not forget what was dropped
+        redirector.limit(handler, b'y' * 20)
+        redirector.set_limits(output_rate=100, output_overflow='sample',
+                              notify=redirector.notify)
+        self.assertEqual(received[1]['data'],
+                         b'[circus] 20 bytes suppressed\n')
+        self.assertEqual(len(events), 2)
+
+    def test_buckets_of_exited_process(self):
+        read, write = os.pipe()
+        self.addCleanup(os.close, read)
+        os.set_blocking(read, False)
+        redirector, handler, received, events = self._limited(
+            output_rate=100)
+        redirector.pipes[read] = 'stdout', FakeProcess(), None
+        os.write(write, b'x')
+        handler(read, tornado.ioloop.IOLoop.READ)
+        self.assertIn(333, redirector._process_buckets)
+
+        # the process exits on its own, its pipe is closed
+        os.close(write)
+        handler(read, tornado.ioloop.IOLoop.READ)
+        self.assertEqual(redirector._process_buckets, {})
+
+    def test_bad_overflow(self):
+        self.assertRaises(ValueError, Redirector, None, None,
+                          output_overflow='block')
+
+
+class SlowStream(object):
+
+    def __init__(self):
+        self.received = []
+        self.flushed = 0
+        self.closed = False
+        self.gate = threading.Event()
+
+    def __call__(self, data):
+        self.gate.wait()
+        self.received.append(data['data'])
+
+    def flush(self):
+        self.flushed += 1
+
+    def close(self):
+        self.closed = True
+
+
+class TestRingBufferStream(TestCase):
+
+    def test_keep_last_bytes(self):
+        stream = RingBufferStream(max_bytes=10, max_processes=2)
+        stream({'pid': 1, 'data': b'abcdef'})
+        stream({'pid': 1, 'data': b'ghijkl'})
+        stream({'pid': 2, 'data': b'x' * 20})
+        self.assertEqual(stream.tail(), [(1, b'cdefghijkl'), (2, b'x' * 10)])
+        self.assertEqual(stream.tail(1, size=3), [(1, b'jkl')])
+        self.assertEqual(stream.tail(3), [])
+
+        # the process which wrote first is forgotten
+        stream({'pid': 2, 'data': b'y'})
+        stream({'pid': 3, 'data': b'z'})
+        self.assertEqual([pid for pid, __ in stream.tail()], [2, 3])
+
+    def test_follow(self):
+        stream = RingBufferStream()
+        events = []
+        stream({'pid': 1, 'name': 'stdout', 'data': b'before'})
+        stream.follow(lambda *args: events.append(args), 30)
+        stream({'pid': 1, 'name': 'stdout', 'data': b'after'})
+        self.assertEqual(len(events), 1)
+        topic, msg = events[0]
+        self.assertEqual(topic, 'output')
+        self.assertEqual((msg['pid'], msg['stream'], msg['data']),
+                         (1, 'stdout', 'after'))
+
+        # the output is not published anymore once the follow expired
+        stream.follow(lambda *args: events.append(args), -1)
+        stream({'pid': 1, 'name': 'stdout', 'data': b'later'})
+        self.assertEqual(len(events), 1)
+
+
+class TestThreadedStream(TestCase):
+
+    def test_write_from_thread(self):
+        stream = SlowStream()
+        threaded = ThreadedStream(stream)
+        stream.gate.set()
+        for i in range(10):
+            threaded({'data': i})
+        threaded.close()
+        self.assertEqual(stream.received, list(range(10)))
+        self.assertTrue(stream.flushed > 0)
+        self.assertTrue(stream.closed)
+
+    def _fill(self, overflow):
+        stream = SlowStream()
+        threaded = ThreadedStream(stream, queue_size=2, overflow=overflow)
+        # the writer thread takes the first chunk and blocks on it
+        threaded({'data': 0})
+        while threaded._queue:
+            time.sleep(0.01)
+        for i in range(1, 5):
+            threaded({'data': i})
+        stream.gate.set()
+        threaded.close()
+        return stream.received, threaded.dropped
+
+    def test_drop_oldest(self):
+        self.assertEqual(self._fill('drop_oldest'), ([0, 3, 4], 2))
+
+    def test_drop_newest(self):
+        self.assertEqual(self._fill('drop_newest'), ([0, 1, 2], 2))
+
+    def test_timestamp_on_capture(self):
+        written = []
+        gate = threading.Event()
+
+        def stream(data):
+            gate.wait()
+            written.append((data, time.time()))
+
+        threaded = ThreadedStream(stream)
+        captured = time.time()
+        threaded({'data': b'one'})
+        time.sleep(0.1)
+        gate.set()
+        threaded.close()
+        data, when = written[0]
+        # stamped when queued, not when the writer thread got to it
+        self.assertTrue(captured <= data['timestamp'] < when - 0.05)
+
+    def test_invalid_overflow(self):
+        self.assertRaises(ValueError, ThreadedStream, SlowStream(),
+                          overflow='explode')
+
+    def test_get_stream(self):
+        stream = get_stream({'class': 'QueueStream', 'threaded': 'true',
+                             'queue_size': '10'})
+        self.assertTrue(isinstance(stream, ThreadedStream))
+        self.assertEqual(stream.queue_size, 10)
+
+
+class TestLinePrefixer(TestCase):
+
+    def test_cut_lines_are_carried(self):
+        prefixer = LinePrefixer('%Y')
+        now = datetime(2020, 1, 1)
+        self.assertEqual(prefixer({'data': b'a\nb', 'pid': 1}, now),
+                         b'2020 [1] | a\n')
+        # another process doesn't get in the way
+        self.assertEqual(prefixer({'data': b'c', 'pid': 2}, now), b'')
+        self.assertEqual(prefixer({'data': b'b\n\n', 'pid': 1}, now),
+                         b'2020 [1] | bb\n2020 [1] | \n')
+        self.assertEqual(prefixer.drain(now), b'2020 [2] | c\n')
+        self.assertEqual(prefixer.drain(now), b'')
+
+    def test_end_and_timeout(self):
+        prefixer = LinePrefixer('%Y')
+        now = datetime(2020, 1, 1)
+        prefixer({'data': b'a', 'pid': 1}, now)
+        prefixer({'data': b'b', 'pid': 2}, now)
+        self.assertEqual(prefixer.end({'pid': 1}, now), b'2020 [1] | a\n')
+        self.assertEqual(prefixer.end({'pid': 1}, now), b'')
+
+        # only the lines cut for long enough are drained
+        self.assertEqual(prefixer.drain(now, timeout=60), b'')
+        self.assertEqual(prefixer.drain(now, timeout=0), b'2020 [2] | b\n')
+        self.assertFalse(prefixer.carrying)
+
+    def test_max_carry(self):
+        prefixer = LinePrefixer('%Y')
+        prefixer.max_carry = 4
+        now = datetime(2020, 1, 1)
+        self.assertEqual(prefixer({'data': b'abcd', 'pid': 1}, now),
+                         b'2020 [1] | abcd\n')
+
+    def test_time_is_cached(self):
+        formatter = TimeFormatter('%H:%M:%S')
+        now = datetime(2020, 1, 1, 10, 0, 0, 10)
+        with mock.patch.object(formatter, 'time_format', '%Y'):
+            self.assertEqual(formatter.format(now), '2020')
+            # same second, the cached value is used
+            self.assertEqual(
+                formatter.format(now.replace(microsecond=20)), '2020')
+        self.assertEqual(formatter.format(now.replace(second=1)), '10:00:01')
+
+
+class TestSinkStream(AsyncTestCase):
+
+    def setUp(self):
+        super(TestSinkStream, self).setUp()
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.filename)
+
+    def _read(self):
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    @gen_test
+    def test_shared_file(self):
+        foo = SinkStream(filename=self.filename, time_format='%Y')
+        bar = SinkStream(filename=self.filename)
+        self.assertIs(foo.sink, bar.sink)
+
+        foo({'data': b'one\ntw', 'pid': 1, 'name': 'stdout',
+             'watcher': 'foo'})
+        bar({'data': b'three\n', 'pid': 2, 'name': 'stderr',
+             'watcher': 'bar'})
+        # written together on the next loop iteration
+        self.assertEqual(self._read(), b'')
+        yield gen.moment
+        year = datetime.now().strftime('%Y').encode()
+        self.assertEqual(self._read(),
+                         year + b' foo [1] stdout | one\n' +
+                         year + b' bar [2] stderr | three\n')
+
+        foo.close()
+        # still used by bar
+        self.assertFalse(bar.sink._file.closed)
+        bar.close()
+        # the cut line is written once the file is closed
+        self.assertTrue(self._read().endswith(b' foo [1] stdout | tw\n'))
+
+    @gen_test
+    def test_json_lines(self):
+        stream = SinkStream(filename=self.filename, format='json')
+        self.addCleanup(stream.close)
+        stream({'data': b'one\n"two"\n', 'pid': 1, 'name': 'stdout',
+                'watcher': 'foo', 'timestamp': 1500000000})
+        stream.flush()
+
+        records = [json.loads(line) for line in self._read().splitlines()]
+        self.assertEqual([r['data'] for r in records], ['one', '"two"'])
+        self.assertEqual(records[0]['watcher'], 'foo')
+        self.assertEqual(records[0]['pid'], 1)
+        self.assertEqual(records[0]['stream'], 'stdout')
+        self.assertEqual(records[0]['time'], 1500000000)
@@ -15,6 +15,9 @@ import psutil
 from psutil import Popen
 from unittest import mock
 
+from tornado import concurrent, gen, locks
+from tornado.testing import AsyncTestCase, gen_test
+
 from tests.support import (TestCase, skipIf,
                                   IS_WINDOWS, SLEEP)
 
@@ -22,7 +25,7 @@ from circus import util
 from circus.util import (
     get_info, bytes2human, human2bytes, to_bool, parse_env_str, env_to_str,
     to_uid, to_gid, replace_gnu_args, get_python_version, load_virtualenv,
-    get_working_dir
+    get_working_dir, synchronized, ConflictError
 )
 
 
@@ -327,3 +330,93 @@ class TestUtil(TestCase):
             util.os.stat = _old_os_stat
 
 
+class FakeLockArbiter(object):
+
+    def __init__(self, lock_timeout=0):
+        self._exclusive_running_command = None
+        self._restarting = False
+        self.watchers = []
+        self.lock_timeout = lock_timeout
+        self._lock_released = locks.Condition()
+
+    @synchronized("arbiter_global")
+    @gen.coroutine
+    def run_global(self, future):
+        yield future
+
+
+class FakeLockWatcher(object):
+
+    def __init__(self, name, arbiter):
+        self.name = name
+        self.arbiter = arbiter
+        self._running_command = None
+        arbiter.watchers.append(self)
+
+    @synchronized("watcher_run")
+    @gen.coroutine
+    def run(self, future):
+        yield future
+
+
+class TestSynchronized(AsyncTestCase):
+
+    @gen_test
+    def test_watchers_run_concurrently(self):
+        arbiter = FakeLockArbiter()
+        one = FakeLockWatcher('one', arbiter)
+        two = FakeLockWatcher('two', arbiter)
+        done_one, done_two = concurrent.Future(), concurrent.Future()
+
+        run_one = one.run(done_one)
+        run_two = two.run(done_two)
+        self.assertEqual(one._running_command, 'watcher_run')
+        self.assertEqual(two._running_command, 'watcher_run')
+
+        # the same watcher and the whole arbiter are busy
+        self.assertRaises(ConflictError, one.run, concurrent.Future())
+        self.assertRaises(ConflictError, arbiter.run_global,
+                          concurrent.Future())
+
+        done_one.set_result(None)
+        done_two.set_result(None)
+        yield [run_one, run_two]
+        self.assertIsNone(one._running_command)
+        self.assertIsNone(two._running_command)
+
+        # a global command locks every watcher
+        done = concurrent.Future()
+        run = arbiter.run_global(done)
+        self.assertRaises(ConflictError, one.run, concurrent.Future())
+        done.set_result(None)
+        yield run
+        self.assertIsNone(arbiter._exclusive_running_command)
+
+    @gen_test
+    def test_conflicting_commands_are_queued(self):
+        arbiter = FakeLockArbiter(lock_timeout=5)
+        watcher = FakeLockWatcher('one', arbiter)
+        first, second = concurrent.Future(), concurrent.Future()
+
+        run_first = watcher.run(first)
+        run_second = watcher.run(second)
+        yield gen.moment
+        self.assertFalse(run_second.done())
+
+        first.set_result(None)
+        yield run_first
+        second.set_result(None)
+        yield run_second
+        self.assertIsNone(watcher._running_command)
+
+    @gen_test
+    def test_queued_command_times_out(self):
+        arbiter = FakeLockArbiter(lock_timeout=0.1)
+        watcher = FakeLockWatcher('one', arbiter)
+        done = concurrent.Future()
+
+        run = watcher.run(done)
+        with self.assertRaises(ConflictError):
+            yield watcher.run(concurrent.Future())
+        done.set_result(None)
+        yield run
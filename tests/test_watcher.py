@@ -146,6 +146,63 @@ class TestWatcher(TestCircus):
 
         yield self.stop_arbiter()
 
+    @tornado.testing.gen_test
+    def test_reap_running_process(self):
+        yield self.start_arbiter()
+        watcher = self.arbiter.get_watcher("test")
+        pids = list(watcher.processes)
+
+        # running processes are left alone, without blocking
+        start = time.time()
+        self.assertEqual(watcher.reap_processes(), 0)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(list(watcher.processes), pids)
+
+        for pid in pids:
+            os.kill(pid, SIGKILL)
+        reaped = 0
+        while reaped < len(pids) and time.time() - start < 5:
+            yield tornado_sleep(0.1)
+            reaped += watcher.reap_processes()
+        self.assertEqual(reaped, len(pids))
+        self.assertEqual(watcher.processes, {})
+        yield self.stop_arbiter()
+
+    @tornado.testing.gen_test
+    def test_wait_reap_is_bounded(self):
+        yield self.start_arbiter()
+        watcher = self.arbiter.get_watcher("test")
+        pids = list(watcher.processes)
+
+        # the processes are never reaped, the wait gives up, kills them
+        # and forgets them
+        start = time.time()
+        with mock.patch.object(watcher, 'reap_process', return_value=False):
+            yield watcher._wait_reap_processes(timeout=0.1)
+        self.assertTrue(time.time() - start < 3)
+        self.assertEqual(watcher.processes, {})
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        yield self.stop_arbiter()
+
+    @skipIf(IS_WINDOWS, "SIGCHLD not supported on Windows")
+    @tornado.testing.gen_test
+    def test_kill_process_waits_for_exit(self):
+        yield self.start_arbiter()
+        watcher = self.arbiter.get_watcher("test")
+        process = list(watcher.processes.values())[0]
+        with mock.patch('circus.watcher.tornado_sleep') as sleep:
+            res = yield watcher.kill_process(process)
+        self.assertTrue(res)
+        # no polling, the exit is notified
+        self.assertFalse(sleep.called)
+        self.assertFalse(process.is_alive())
+        self.assertEqual(self.arbiter._exit_waiters, {})
+        yield self.stop_arbiter()
+
     @tornado.testing.gen_test
     def test_stats(self):
         yield self.start_arbiter()
@@ -616,6 +673,85 @@ def oneshot_process(test_file):
     pass
 
 
+_READY = []
+
+
+def readiness_probe(watcher, process):
+    _READY.append(process.pid)
+    return True
+
+
+class SpawnConcurrencyTest(TestCircus):
+
+    @tornado.testing.gen_test
+    def test_spawn_concurrency(self):
+        del _READY[:]
+        yield self.start_arbiter(numprocesses=4, spawn_concurrency=3,
+                                 readiness_probe='tests.test_watcher.'
+                                                 'readiness_probe')
+        watcher = self.arbiter.get_watcher("test")
+        self.assertEqual(len(watcher.processes), 4)
+        self.assertEqual(sorted(_READY), sorted(watcher.processes))
+        yield self.stop_arbiter()
+
+    @tornado.testing.gen_test
+    def test_spawn_batches(self):
+        watcher = Watcher("foo", "foobar", numprocesses=5,
+                          spawn_concurrency=2, warmup_delay=0)
+        watcher._status = "active"
+        sleeps = []
+
+        def _spawn_process():
+            pid = len(watcher.processes) + 1
+            watcher.processes[pid] = FakeProcess(pid, RUNNING)
+            return time.time()
+
+        @tornado.gen.coroutine
+        def _sleep(delay):
+            sleeps.append(len(watcher.processes))
+
+        watcher.spawn_process = _spawn_process
+        with mock.patch('circus.watcher.tornado_sleep', _sleep):
+            yield watcher.spawn_processes()
+        self.assertEqual(len(watcher.processes), 5)
+        # one pause after each batch
+        self.assertEqual(sleeps, [2, 4, 5])
+
+
+def never_ready(watcher, process):
+    return False
+
+
+class RollingReloadTest(TestCircus):
+
+    @tornado.testing.gen_test
+    def test_rolling_reload(self):
+        yield self.start_arbiter(numprocesses=3, max_surge=1,
+                                 max_unavailable=1,
+                                 readiness_probe='tests.test_watcher.'
+                                                 'readiness_probe')
+        watcher = self.arbiter.get_watcher("test")
+        old_pids = set(watcher.processes)
+        yield watcher.reload()
+        new_pids = set(watcher.get_active_pids())
+        self.assertEqual(len(new_pids), 3)
+        self.assertEqual(new_pids & old_pids, set())
+        yield self.stop_arbiter()
+
+    @tornado.testing.gen_test
+    def test_rolling_reload_aborted(self):
+        yield self.start_arbiter(numprocesses=3, max_surge=1,
+                                 readiness_timeout=0.2,
+                                 readiness_probe='tests.test_watcher.'
+                                                 'never_ready')
+        watcher = self.arbiter.get_watcher("test")
+        old_pids = set(watcher.processes)
+        yield watcher.reload()
+        # the new process was not ready, the old ones are kept
+        self.assertEqual(set(watcher.get_active_pids()), old_pids)
+        yield self.stop_arbiter()
+
+
 class RespawnTest(TestCircus):
 
     @tornado.testing.gen_test
@@ -631,6 +767,13 @@ class RespawnTest(TestCircus):
             resp = yield self.call("numprocesses", name="test")
             self.assertEqual(resp['numprocesses'], 1)
 
+            # reaping doesn't wait for running processes, so let the
+            # process exit first
+            process = list(watcher.processes.values())[0]
+            start = time.time()
+            while process.status == RUNNING and time.time() - start < 5:
+                yield tornado_sleep(0.1)
+
             # let's reap processes and explicitely ask for process management
             yield watcher.reap_and_manage_processes()
 